@@ -1,17 +1,87 @@
-import os, json, pandas as pd, streamlit as st
+import os, time, pandas as pd, streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import chromadb
-from chromadb.config import Settings
-from utils.openai_wrap import chat_json
-from utils.io_jsonl import write_jsonl
-from utils.cache import cache_load, cache_save, cache_key_from_params, history_load, history_append
+from utils.openai_wrap import chat_json, chat_json_stream
+from utils.embedder import warmup
+from utils.trace import request as trace_request
+from utils.json_repair import SalvageStats, validate_questions
+from utils.cache import cache_get, cache_put, cache_evict, cache_key_from_params, history_load
+from generate import (open_collection, dynamic_retrieve, build_history_block, load_template, build_prompt, build_messages,
+                      to_records, save_outputs, default_out_path, regenerate_missing, record_history)
 
 load_dotenv()
 CHROMA_PATH = os.getenv("CHROMA_PATH","./chroma")
+PROMPT_PATH = "prompts/qg_prompt.txt"
+APP_WORKERS = int(os.getenv("APP_WORKERS", "4"))
+EXPECTED_SECONDS = 30  # rough LLM latency, only used to pace the progress bar
 
 st.set_page_config(page_title="RAG Question Generator", page_icon="📝", layout="centered")
 st.title("📝 RAG Question Generator (MCQ / TF) — Dynamic RAG + Bloom + Cache + Context-Aware")
 
+# ----- Heavy resources: created once per server process, shared by all sessions and reruns
+@st.cache_resource
+def get_collection():
+    # Same resolution as generate.py: a bank ingested with --shard_by opens as a ShardedCollection
+    warmup()
+    return open_collection("exam_bank")
+
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=APP_WORKERS, thread_name_prefix="qg")
+
+@st.cache_resource
+def init_cache_backend():
+    # Opens the SQLite cache (and migrates cache.json) once, dropping expired entries
+    return cache_evict()
+
+def get_template(path=PROMPT_PATH):
+    # Parsed once and cached by mtime, so edits to the prompt file are picked up without a restart
+    return load_template(path)
+
+def run_generation(collection, template, params, max_k, use_cache, stream=False, partial=None):
+    """Runs on the executor, so Streamlit reruns neither cancel nor repeat it.
+    With stream=True each question is appended to `partial` as soon as it is parsed.
+    Invalid questions are dropped and only the shortfall is requested again, as in generate.py.
+    Spans are written to TRACE_FILE when that env variable is set.
+    """
+    with trace_request("app", subject=params["subject"], topic=params["topic"], n=params["n"], stream=stream):
+        cache_key = cache_key_from_params(params)
+        from_cache = False
+        salvage = SalvageStats()  # per request: the module-level stats are shared by every session
+        records = cache_get(cache_key) if use_cache else None
+        if records is not None:
+            from_cache = True
+        else:
+            # Build prompt with context-aware blocks
+            retrieved_block = dynamic_retrieve(collection, params["topic"], params["subject"], max_k=max_k)
+            history_block = build_history_block(history_load(limit=20), max_lines=6)
+            prompt = build_prompt(template, params, retrieved_block, history_block)
+            if stream:
+                records = partial if partial is not None else []
+                for q in chat_json_stream(build_messages(prompt), max_tokens=2200, temperature=0.4, stats=salvage):
+                    for valid in validate_questions([q], params["qtype"], salvage):
+                        records.append(to_records([valid], params, start=len(records))[0])
+                if len(records) < params["n"]:
+                    for valid in regenerate_missing(template, params, retrieved_block, history_block, None,
+                                                    records, params["n"] - len(records), stats=salvage):
+                        records.append(to_records([valid], params, start=len(records))[0])
+            else:
+                result = chat_json(build_messages(prompt), max_tokens=2200, temperature=0.4, stats=salvage)
+                questions = validate_questions(result.get("questions", []), params["qtype"], salvage)
+                if len(questions) < params["n"]:
+                    questions += regenerate_missing(template, params, retrieved_block, history_block, None,
+                                                    questions, params["n"] - len(questions), stats=salvage)
+                records = to_records(questions, params)
+            # save to cache + history
+            if use_cache:
+                cache_put(cache_key, records)
+            record_history(records)
+        # Save to disk
+        out = default_out_path(params)
+        csv_path = save_outputs(records, out)
+        return {"records": records, "from_cache": from_cache, "out": out, "csv_path": csv_path,
+                "salvage": None if from_cache else salvage.summary()}
+
 
 with st.sidebar:
     st.header("Settings")
@@ -23,147 +93,59 @@ with st.sidebar:
     n = st.number_input("Number of questions", min_value=1, max_value=20, value=5, step=1)
     max_k = st.slider("Max retrieved examples (dynamic)", min_value=4, max_value=20, value=12, step=1)
     use_cache = st.checkbox("Use cache when available", value=True)
+    stream = st.checkbox("Show questions as they are generated", value=True)
 
-client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
-collection = client.get_or_create_collection("exam_bank")
-
-
-def dynamic_retrieve(query: str, subject: str | None, max_k: int = 12, min_k: int = 4, distance_delta: float = 0.25):
-    where = {}
-    if subject:
-        where["subject"] = subject
-    res = collection.query(query_texts=[query], n_results=max_k, where=where or None, include=["documents","metadatas","distances"])    
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0] if res.get("distances") else [0.0]*len(docs)
-    if not docs:
-        return ""
-    best = dists[0] if dists else 0.0
-    selected = []
-    for d,m,dist in zip(docs, metas, dists):
-        if len(selected) < min_k or (dist is not None and dist <= best + 0.25):
-            selected.append((d,m,dist))
-    if not selected:
-        selected = list(zip(docs[:min_k], metas[:min_k], dists[:min_k]))
-    lines = []
-    for d,m,dist in selected:
-        lines.append(f"- ({m.get('source','')}) {d}")
-    return "\n".join(lines)
-
-def build_history_block(history_items, max_lines=6):
-    lines = []
-    for item in history_items[-max_lines:]:
-        stem = item.get("stem","");
-        subject = item.get("subject","");
-        topic = item.get("topic","");
-        lines.append(f"* [{subject}/{topic}] {stem}")
-    return "\n".join(lines)
+collection = get_collection()
+executor = get_executor()
+init_cache_backend()
 
 with st.form("gen"):
     st.subheader("Generate")
     submitted = st.form_submit_button("Generate Now")
-    if submitted:
-        # Cache check
+
+job = st.session_state.get("job")
+if submitted:
+    if job is not None and not job["future"].done():
+        st.warning("A generation is already running for this session; showing its progress.")
+    else:
         params = {
             "subject": subject, "topic": topic, "qtype": qtype,
             "difficulty": difficulty, "bloom_level": bloom_level, "n": int(n)
         }
-        cache_key = cache_key_from_params(params)
-        if use_cache:
-            cache = cache_load()
-            if cache_key in cache:
-                st.info("Loaded from cache.")
-                records = cache[cache_key]
-                df = pd.DataFrame(records)
-                st.dataframe(df)
-            else:
-                # Build prompt with context-aware blocks
-                retrieved_block = dynamic_retrieve(topic, subject, max_k=max_k)
-                history_items = history_load(limit=20)
-                history_block = build_history_block(history_items, max_lines=6)
+        partial = []
+        future = executor.submit(run_generation, collection, get_template(), params, max_k, use_cache, stream, partial)
+        job = st.session_state["job"] = {"params": params, "future": future, "partial": partial, "started": time.time()}
 
-                with open("prompts/qg_prompt.txt","r",encoding="utf-8") as f:
-                    prompt = (
-                        f.read()
-                        .replace("{{subject}}", subject)
-                        .replace("{{topic}}", topic)
-                        .replace("{{qtype}}", qtype)
-                        .replace("{{difficulty}}", difficulty)
-                        .replace("{{bloom_level}}", bloom_level)
-                        .replace("{{n}}", str(int(n)))
-                        .replace("{{retrieved_block}}", retrieved_block)
-                        .replace("{{history_block}}", history_block)
-                    )
-                messages = [
-                    {"role":"system","content":"You are a strict exam question generator that outputs pure JSON."},
-                    {"role":"user","content": prompt}
-                ]
-                result = chat_json(messages, max_tokens=2200, temperature=0.4)
-                questions = result.get("questions", [])
-                if qtype == "tf":
-                    for q in questions:
-                        q["options"] = ["True","False"]
-                        if str(q.get("answer_idx","0")) not in ["0","1",0,1]:
-                            q["answer_idx"] = 0
-                # enrich with metadata
-                records = [{
-                    "id": f"gen-{subject}-{topic}-{bloom_level}-{i}",
-                    "subject": subject, "topic": topic, "type": qtype,
-                    "stem": q["stem"], "options": q["options"],
-                    "answer_idx": q["answer_idx"],
-                    "explanation": q.get("explanation",""),
-                    "bloom_level": bloom_level, "difficulty": difficulty
-                } for i,q in enumerate(questions)]
-                # save to cache + history
-                cache[cache_key] = records
-                cache_save(cache)
-                history_append(records)
-                df = pd.DataFrame(records)
-                st.dataframe(df)
-        else:
-            retrieved_block = dynamic_retrieve(topic, subject, max_k=max_k)
-            history_items = history_load(limit=20)
-            history_block = build_history_block(history_items, max_lines=6)
-
-            with open("prompts/qg_prompt.txt","r",encoding="utf-8") as f:
-                prompt = (
-                    f.read()
-                    .replace("{{subject}}", subject)
-                    .replace("{{topic}}", topic)
-                    .replace("{{qtype}}", qtype)
-                    .replace("{{difficulty}}", difficulty)
-                    .replace("{{bloom_level}}", bloom_level)
-                    .replace("{{n}}", str(int(n)))
-                    .replace("{{retrieved_block}}", retrieved_block)
-                    .replace("{{history_block}}", history_block)
-                )
-            messages = [
-                {"role":"system","content":"You are a strict exam question generator that outputs pure JSON."},
-                {"role":"user","content": prompt}
-            ]
-            result = chat_json(messages, max_tokens=2200, temperature=0.4)
-            questions = result.get("questions", [])
-            if qtype == "tf":
-                for q in questions:
-                    q["options"] = ["True","False"]
-                    if str(q.get("answer_idx","0")) not in ["0","1",0,1]:
-                        q["answer_idx"] = 0
-            records = [{
-                "id": f"gen-{subject}-{topic}-{bloom_level}-{i}",
-                "subject": subject, "topic": topic, "type": qtype,
-                "stem": q["stem"], "options": q["options"],
-                "answer_idx": q["answer_idx"],
-                "explanation": q.get("explanation",""),
-                "bloom_level": bloom_level, "difficulty": difficulty
-            } for i,q in enumerate(questions)]
-            history_append(records)
-            df = pd.DataFrame(records)
-            st.dataframe(df)
-
-        # Save to disk
-        os.makedirs("outputs", exist_ok=True)
-        out = f"outputs/{subject}_{topic}_{qtype}_{difficulty}_{bloom_level}_{int(n)}.jsonl"
-        write_jsonl(records, out)
-        csv_path = out.replace(".jsonl",".csv")
-        pd.DataFrame(records).to_csv(csv_path, index=False, encoding="utf-8-sig")
-        st.success(f"Saved JSONL to {out} and CSV to {csv_path}.")
+if job is not None:
+    future = job["future"]
+    if not future.done():
+        bar = st.progress(0.0, text="Generating...")
+        live = st.empty()
+        shown = 0
+        while not future.done():
+            elapsed = time.time() - job["started"]
+            bar.progress(min(0.95, elapsed / EXPECTED_SECONDS), text=f"Generating... {elapsed:.0f}s")
+            partial = job["partial"]
+            if len(partial) > shown:
+                # Render questions as soon as the worker has parsed them
+                shown = len(partial)
+                live.dataframe(pd.DataFrame(partial[:shown]))
+            time.sleep(0.25)
+        bar.empty()
+        live.empty()
+    try:
+        res = future.result()
+    except Exception as e:
+        st.error(f"Generation failed: {e!r}")
+    else:
+        if res["from_cache"]:
+            st.info("Loaded from cache.")
+        st.dataframe(pd.DataFrame(res["records"]))
+        salvage = res.get("salvage")
+        if salvage and (salvage["repaired"] or salvage["unparseable"] or salvage["refills"] or salvage["valid"] < salvage["items"]):
+            st.info(f"JSON salvage: kept {salvage['valid']}/{salvage['items']} generated questions "
+                    f"(repaired {salvage['repaired']}, unparseable {salvage['unparseable']}, rejected {salvage['rejected']}); "
+                    f"{salvage['refills']} refill request(s), ~{salvage['tokens_saved']} completion tokens saved.")
+        if len(res["records"]) < job["params"]["n"]:
+            st.warning(f"Only {len(res['records'])} of {job['params']['n']} questions were usable after the refill.")
+        st.success(f"Saved JSONL to {res['out']} and CSV to {res['csv_path']}.")
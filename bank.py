@@ -0,0 +1,77 @@
+"""
+Consolidated question bank: generated questions as Parquet, partitioned by subject/topic/difficulty.
+
+    python bank.py import outputs/*.jsonl              # backfill from generated sets (or outputs/history.jsonl)
+    python bank.py query --subject science --difficulty hard --bloom_level apply
+    python bank.py query --subject science --columns stem,answer_idx --out hard_apply.parquet
+
+generate.py --bank appends every new set. Queries only open the matching partition
+directories and push the remaining filters down to Parquet row groups.
+"""
+import argparse, time
+
+from utils.columnar import BANK_DIR, bank_append, bank_keys, bank_query, read_table, write_table
+from utils.io_jsonl import read_jsonl
+
+FILTERS = ("subject", "topic", "difficulty", "bloom_level", "type")
+
+def cmd_import(args):
+    # Re-importing a file, or importing sets that generate.py --bank already appended, adds
+    # nothing: rows are matched on (id, stem), since generated ids repeat across runs
+    seen = bank_keys(args.bank)
+    total = skipped = 0
+    for path in args.paths:
+        if path.endswith(".parquet"):
+            records = read_table(path).to_dict("records")
+        else:
+            records = list(read_jsonl(path))
+        new = []
+        for r in records:
+            if not r.get("stem"):
+                continue
+            key = (None if r.get("id") is None else str(r["id"]), str(r["stem"]))
+            if key in seen:
+                skipped += 1
+                continue
+            seen.add(key)
+            new.append(r)
+        total += bank_append(new, args.bank)
+        print(f"{path}: {len(new)} new questions")
+    print(f"Added {total} questions to {args.bank} ({skipped} already present)")
+
+def cmd_query(args):
+    t0 = time.perf_counter()
+    filters = {}
+    for k in FILTERS:
+        value = getattr(args, k)
+        filters[k] = value.split(",") if value and "," in value else value
+    columns = args.columns.split(",") if args.columns else None
+    df = bank_query(args.bank, columns=columns, limit=args.limit, **filters)
+    elapsed = time.perf_counter() - t0
+    if args.out:
+        write_table(df, args.out)
+        print(f"Wrote {len(df)} questions to {args.out} in {elapsed * 1000:.1f} ms")
+    else:
+        print(df.to_string(max_colwidth=80))
+        print(f"{len(df)} questions in {elapsed * 1000:.1f} ms")
+
+def main():
+    ap = argparse.ArgumentParser(description="Build and query the partitioned Parquet question bank")
+    ap.add_argument("--bank", default=BANK_DIR, help="Bank directory")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="Append question records from JSONL/Parquet files")
+    imp.add_argument("paths", nargs="+")
+    q = sub.add_parser("query", help="Filter the bank (comma-separated values match any)")
+    for k in FILTERS:
+        q.add_argument(f"--{k}", default=None)
+    q.add_argument("--columns", default=None, help="Comma-separated columns to read (default all)")
+    q.add_argument("--limit", type=int, default=None)
+    q.add_argument("--out", default=None, help="Write the result as .parquet/.arrow/.csv instead of printing")
+    args = ap.parse_args()
+    if args.cmd == "import":
+        cmd_import(args)
+    else:
+        cmd_query(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+JSONL micro-benchmark: the previous stdlib line-at-a-time read/write vs utils.io_jsonl
+(fast codec when installed, block I/O, gzip, parallel chunked reads).
+
+    python benchmarks/bench_jsonl.py --rows 1000000
+"""
+import argparse, os, sys, json, time, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import io_jsonl
+from utils.io_jsonl import read_jsonl, write_jsonl, read_jsonl_parallel
+
+def legacy_read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line)
+
+def legacy_write(records, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+def make_rows(n):
+    for i in range(n):
+        yield {"id": f"sciq-train-{i}", "subject": "science", "topic": "", "type": "mcq",
+               "stem": f"Which process converts light energy into chemical energy in plant cell number {i}?",
+               "options": ["Photosynthesis", "Respiration", "Fermentation", "Transpiration"],
+               "answer_idx": i % 4, "source": "sciq"}
+
+def count_rows(rows):
+    return len(rows)
+
+def timed(label, fn, n):
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:<34} {dt:7.2f}s  {n / dt:>10,.0f} rows/s")
+    return dt
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+    n = args.rows
+    print(f"{n:,} rows, codec: {'orjson' if io_jsonl.orjson is not None else 'json (stdlib)'}")
+    with tempfile.TemporaryDirectory() as d:
+        old, new, gz = (os.path.join(d, name) for name in ("old.jsonl", "new.jsonl", "new.jsonl.gz"))
+        timed("write  legacy", lambda: legacy_write(make_rows(n), old), n)
+        timed("write  io_jsonl", lambda: write_jsonl(make_rows(n), new), n)
+        timed("write  io_jsonl (.gz)", lambda: write_jsonl(make_rows(n), gz), n)
+        print(f"sizes: plain {os.path.getsize(new) / 1e6:.1f} MB, gzip {os.path.getsize(gz) / 1e6:.1f} MB")
+        timed("read   legacy", lambda: sum(1 for _ in legacy_read(old)), n)
+        timed("read   io_jsonl", lambda: sum(1 for _ in read_jsonl(new)), n)
+        timed("read   io_jsonl (.gz)", lambda: sum(1 for _ in read_jsonl(gz)), n)
+        timed(f"read   parallel ({args.workers} procs, rows)", lambda: sum(len(r) for r in read_jsonl_parallel(new, args.workers)), n)
+        timed(f"read   parallel ({args.workers} procs, fn)",
+              lambda: sum(read_jsonl_parallel(new, args.workers, fn=count_rows)), n)
+
+if __name__ == "__main__":
+    main()
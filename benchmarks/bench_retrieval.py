@@ -0,0 +1,79 @@
+"""
+Retrieval benchmark: dense (Chroma) vs sparse (BM25) vs hybrid (RRF).
+
+Each sampled bank row becomes a short query built from a few of its stem's
+content words; the row itself is the single relevant document. Reports
+recall@k and per-query latency for every retriever. The collection must have
+been ingested with `ingest.py --bm25`.
+
+    python benchmarks/bench_retrieval.py --input data/sciq_train.jsonl --collection exam_bank --queries 200
+"""
+import argparse, os, sys, time, random, statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from chromadb.config import Settings
+
+from generate import CHROMA_PATH, hybrid_search, load_bm25
+from utils.bm25 import tokenize
+from utils.embedder import STEmbeddingFunction, warmup
+from utils.io_jsonl import read_jsonl
+
+def make_queries(path, n, words, seed):
+    rows = [r for r in read_jsonl(path) if len(tokenize(r.get("stem", ""))) >= words]
+    rng = random.Random(seed)
+    out = []
+    for r in rng.sample(rows, min(n, len(rows))):
+        toks = tokenize(r["stem"])
+        start = rng.randrange(0, len(toks) - words + 1)
+        out.append((" ".join(toks[start:start + words]), r.get("subject") or None, r["id"]))
+    return out
+
+def timed(fn):
+    t0 = time.perf_counter()
+    ids = fn()
+    return ids, (time.perf_counter() - t0) * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", required=True, help="Bank JSONL that was ingested into the collection")
+    ap.add_argument("--collection", default="exam_bank")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--words", type=int, default=4, help="Content words per synthetic query")
+    ap.add_argument("--ks", default="1,4,8,12")
+    ap.add_argument("--seed", type=int, default=13)
+    args = ap.parse_args()
+    ks = [int(k) for k in args.ks.split(",")]
+    kmax = max(ks)
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+    collection = client.get_or_create_collection(args.collection, embedding_function=STEmbeddingFunction(use_cache=False))
+    bm25 = load_bm25(args.collection)
+    if bm25 is None:
+        sys.exit(1)
+    warmup()
+    queries = make_queries(args.input, args.queries, args.words, args.seed)
+
+    retrievers = {
+        "dense": lambda q, s: collection.query(query_texts=[q], n_results=kmax, where={"subject": s} if s else None, include=[])["ids"][0],
+        "bm25": lambda q, s: [i for i, _ in bm25.search(q, k=kmax, subject=s)],
+        "hybrid": lambda q, s: hybrid_search(collection, bm25, q, s, k=kmax)[0],
+    }
+    print(f"{len(queries)} queries, {args.words} words each, collection size {collection.count()}")
+    print(f"{'retriever':<8} " + " ".join(f"R@{k:<5}" for k in ks) + "  mean_ms  p95_ms")
+    for name, fn in retrievers.items():
+        hits = {k: 0 for k in ks}
+        lat = []
+        for q, subject, target in queries:
+            ids, ms = timed(lambda: fn(q, subject))
+            lat.append(ms)
+            for k in ks:
+                hits[k] += target in ids[:k]
+        lat.sort()
+        p95 = lat[int(0.95 * (len(lat) - 1))] if lat else 0.0
+        print(f"{name:<8} " + " ".join(f"{hits[k] / max(1, len(queries)):<7.3f}" for k in ks)
+              + f"  {statistics.mean(lat) if lat else 0.0:7.2f}  {p95:6.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Startup and query latency: Chroma PersistentClient vs a memory-mapped snapshot.
+
+Export first, e.g.:
+    python export_index.py --collection exam_bank --out snapshots/exam_bank
+    python export_index.py --collection exam_bank --out snapshots/exam_bank_i8 --quantize int8
+    python benchmarks/bench_snapshot.py --collection exam_bank --snapshots snapshots/exam_bank snapshots/exam_bank_i8
+
+Startup is measured in a fresh interpreter (import + open + first query);
+query latency uses precomputed query vectors so only search time is timed.
+"""
+import argparse, os, sys, time, json, subprocess, statistics
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# VmHWM is reset on exec, unlike ru_maxrss which a child inherits from this (larger) process
+PEAK_RSS = """
+def peak_rss_mb():
+    with open("/proc/self/status") as f:
+        return next(int(l.split()[1]) for l in f if l.startswith("VmHWM")) / 1024
+"""
+STARTUP_CHROMA = PEAK_RSS + """
+import time, sys; t0 = time.perf_counter()
+import chromadb
+from chromadb.config import Settings
+col = chromadb.PersistentClient(path=sys.argv[1], settings=Settings(anonymized_telemetry=False)).get_collection(sys.argv[2])
+col.query(query_embeddings=[[0.1] * int(sys.argv[3])], n_results=12, include=["documents","metadatas","distances"])
+print(time.perf_counter() - t0, peak_rss_mb())
+"""
+STARTUP_SNAPSHOT = PEAK_RSS + """
+import time, sys; t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[4])
+from utils.snapshot import SnapshotRetriever
+col = SnapshotRetriever(sys.argv[1])
+col.query(query_embeddings=[[0.1] * int(sys.argv[3])], n_results=12)
+print(time.perf_counter() - t0, peak_rss_mb())
+"""
+
+def startup(code, *argv, runs=3):
+    """Median (seconds, peak RSS in MiB) of import + open + first query in a fresh interpreter."""
+    times, rss = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code, *map(str, argv)], capture_output=True, text=True, cwd=ROOT, check=True)
+        t, mb = out.stdout.strip().splitlines()[-1].split()
+        times.append(float(t))
+        rss.append(float(mb))
+    return statistics.median(times), statistics.median(rss)
+
+def latency(col, queries, k, where):
+    lat, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        res = col.query(query_embeddings=[q.tolist()], n_results=k, where=where, include=["documents","metadatas","distances"])
+        lat.append((time.perf_counter() - t0) * 1000)
+        ids.append(res["ids"][0])
+    lat.sort()
+    return statistics.mean(lat), lat[int(0.95 * (len(lat) - 1))], ids
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--collection", default="exam_bank")
+    ap.add_argument("--snapshots", nargs="+", required=True, help="Snapshot directories to compare")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--subject", default=None, help="Optional subject filter applied to every query")
+    args = ap.parse_args()
+
+    import chromadb
+    from chromadb.config import Settings
+    from generate import CHROMA_PATH
+    from utils.snapshot import SnapshotRetriever
+
+    snaps = {path: SnapshotRetriever(path) for path in args.snapshots}
+    first = next(iter(snaps.values()))
+    dim = first.header["dim"]
+    rng = np.random.default_rng(0)
+    pick = rng.integers(0, first.count(), size=args.queries)
+    base = np.asarray(first.vectors[pick], dtype=np.float32)
+    if first.scales is not None:
+        base = base * np.asarray(first.scales[pick])[:, None]
+    queries = base + rng.normal(scale=0.05, size=base.shape).astype(np.float32)
+    where = {"subject": args.subject} if args.subject else None
+
+    chroma = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False)).get_collection(args.collection)
+    rows = [("chroma", *startup(STARTUP_CHROMA, CHROMA_PATH, args.collection, dim), *latency(chroma, queries, args.k, where))]
+    for path, snap in snaps.items():
+        rows.append((path, *startup(STARTUP_SNAPSHOT, path, args.collection, dim, ROOT), *latency(snap, queries, args.k, where)))
+
+    ref = rows[0][5]
+    print(f"{len(queries)} queries, k={args.k}, rows={first.count()}, where={json.dumps(where)}")
+    for path in snaps:
+        vec = next(f for f in ("vectors.i8", "vectors.f32") if os.path.exists(os.path.join(path, f)))
+        print(f"{path}: {vec} {os.path.getsize(os.path.join(path, vec)) / 2**20:.1f} MiB")
+    print(f"{'retriever':<32} {'startup_s':>9} {'peak_rss_mb':>11} {'mean_ms':>8} {'p95_ms':>7} {'overlap@k':>9}")
+    for name, start, rss, mean, p95, ids in rows:
+        overlap = statistics.mean(len(set(a) & set(b)) / max(1, len(b)) for a, b in zip(ids, ref))
+        print(f"{name:<32} {start:9.3f} {rss:11.1f} {mean:8.2f} {p95:7.2f} {overlap:9.3f}")
+
+if __name__ == "__main__":
+    main()
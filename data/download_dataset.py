@@ -1,4 +1,143 @@
-import argparse, json, random, os
+import argparse, random, os, sys, time
 from datasets import load_dataset
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.io_jsonl import write_jsonl
+
+# Hugging Face dataset ids and the converter used for each
+DATASETS = {"sciq": "sciq", "arc": "ai2_arc"}
+FIELDS = ("id", "subject", "topic", "type", "stem", "options", "answer_idx", "source")
+
+def convert_sciq(batch, indices, subject, split, seed):
+    """Batched map fn: SciQ rows -> unified schema. The correct answer is shuffled
+    among the distractors with a per-row seed, so reruns produce identical files."""
+    out = {k: [] for k in FIELDS}
+    for i, idx in enumerate(indices):
+        options = [batch["correct_answer"][i], batch["distractor1"][i], batch["distractor2"][i], batch["distractor3"][i]]
+        order = list(range(4))
+        random.Random(seed * 1_000_003 + idx).shuffle(order)
+        out["id"].append(f"sciq-{split}-{idx}")
+        out["stem"].append(batch["question"][i].strip())
+        out["options"].append([options[j].strip() for j in order])
+        out["answer_idx"].append(order.index(0))
+    n = len(indices)
+    out.update(subject=[subject] * n, topic=[""] * n, type=["mcq"] * n, source=["sciq"] * n)
+    return out
+
+def arc_answer_idx(labels, key):
+    """Index of answerKey among the choice labels. A few ARC rows mix schemes (key "1" with
+    labels A-D, or the reverse), so the numeric and letter forms are tried; -1 if neither matches."""
+    key = str(key or "").strip()
+    candidates = [key]
+    if key.isdigit() and 1 <= int(key) <= 26:
+        candidates.append("ABCDEFGHIJKLMNOPQRSTUVWXYZ"[int(key) - 1])
+    elif len(key) == 1 and key.isalpha():
+        candidates.append(str(ord(key.upper()) - ord("A") + 1))
+    for c in candidates:
+        if c in labels:
+            return labels.index(c)
+    return -1
+
+def convert_arc(batch, indices, subject, split, seed):
+    """Batched map fn: ARC rows -> unified schema (answerKey is a label such as "B" or "2").
+    Rows whose key matches no label keep answer_idx=-1 and are dropped (and counted) by main()."""
+    out = {k: [] for k in FIELDS}
+    for i in range(len(indices)):
+        choices = batch["choices"][i]
+        labels = [str(l).strip() for l in choices["label"]]
+        out["id"].append(f"arc-{batch['id'][i]}")
+        out["stem"].append(batch["question"][i].strip())
+        out["options"].append([t.strip() for t in choices["text"]])
+        out["answer_idx"].append(arc_answer_idx(labels, batch["answerKey"][i]))
+    n = len(indices)
+    out.update(subject=[subject] * n, topic=[""] * n, type=["mcq"] * n, source=["arc"] * n)
+    return out
+
+CONVERTERS = {"sciq": convert_sciq, "arc": convert_arc}
+
+def load_split(args):
+    """Memory-mapped Arrow dataset (or an IterableDataset with --streaming); local
+    Parquet/Arrow files can be given with --data_files instead of downloading."""
+    if args.data_files:
+        builder = "arrow" if args.data_files.endswith(".arrow") else "parquet"
+        return load_dataset(builder, data_files={args.split: args.data_files}, split=args.split,
+                            cache_dir=args.cache_dir, streaming=args.streaming)
+    return load_dataset(DATASETS[args.dataset], args.config, split=args.split,
+                        cache_dir=args.cache_dir, streaming=args.streaming)
+
+def convert(ds, args):
+    kwargs = {"subject": args.subject, "split": args.split, "seed": args.seed}
+    fn = CONVERTERS[args.dataset]
+    if args.streaming:
+        if args.limit:
+            ds = ds.take(args.limit)
+        # IterableDataset.map is lazy and single-process; rows are converted as they are read
+        return ds.map(fn, batched=True, with_indices=True, batch_size=args.batch_size,
+                      remove_columns=list(ds.column_names or []), fn_kwargs=kwargs)
+    if args.limit:
+        ds = ds.select(range(min(args.limit, len(ds))))
+    return ds.map(fn, batched=True, with_indices=True, batch_size=args.batch_size,
+                  num_proc=args.workers if args.workers > 1 else None,
+                  remove_columns=ds.column_names, fn_kwargs=kwargs, desc="Converting")
+
+def iter_batches(ds, batch_size, streaming):
+    if streaming:
+        batch = []
+        for row in ds:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+    for cols in ds.iter(batch_size=batch_size):
+        yield [dict(zip(cols, vals)) for vals in zip(*cols.values())]
+
+def valid_row(r):
+    return 0 <= r["answer_idx"] < len(r["options"])
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dataset", choices=sorted(CONVERTERS), default="sciq")
+    ap.add_argument("--config", default=None, help="Dataset config (ARC: ARC-Challenge / ARC-Easy)")
+    ap.add_argument("--split", default="train")
+    ap.add_argument("--out", required=True, help="Output JSONL (.jsonl/.jsonl.gz/.jsonl.zst), or '-' to stream rows to stdout (e.g. into ingest.py --input -)")
+    ap.add_argument("--subject", default="science")
+    ap.add_argument("--limit", type=int, default=None, help="Only convert the first N rows")
+    ap.add_argument("--seed", type=int, default=13, help="Seed for shuffling SciQ answer positions")
+    ap.add_argument("--batch_size", type=int, default=5000, help="Rows per map batch and per write")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes for the batched map")
+    ap.add_argument("--streaming", action="store_true", help="Stream the split instead of using the memory-mapped Arrow cache")
+    ap.add_argument("--data_files", default=None, help="Local Parquet/Arrow file(s) of the split instead of the Hub")
+    ap.add_argument("--cache_dir", default=None)
+    args = ap.parse_args()
+    if args.dataset == "arc" and not args.config and not args.data_files:
+        args.config = "ARC-Challenge"
+    log = sys.stderr  # stdout may carry the JSONL itself
+
+    t0 = time.perf_counter()
+    ds = convert(load_split(args), args)
+    total = None if args.streaming else len(ds)
+    batches = tqdm(iter_batches(ds, args.batch_size, args.streaming), file=log, unit="batch",
+                   total=None if total is None else -(-total // args.batch_size), disable=args.out == "-")
+    skipped = 0
+
+    def rows():
+        nonlocal skipped
+        for batch in batches:
+            for r in batch:
+                if valid_row(r):
+                    yield {k: r[k] for k in FIELDS}
+                else:
+                    skipped += 1
+
+    # write_jsonl serialises into ~1 MiB blocks; .gz/.zst outputs are compressed on the fly
+    n = write_jsonl(rows(), args.out)
+    elapsed = time.perf_counter() - t0
+    print(f"Wrote {n} rows to {'stdout' if args.out == '-' else args.out} in {elapsed:.1f}s "
+          f"({n / elapsed if elapsed else 0.0:.0f} rows/sec), skipped {skipped} without a usable answer", file=log)
+
+if __name__ == "__main__":
+    main()
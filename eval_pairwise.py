@@ -1,9 +1,11 @@
-import argparse, json, os
-import chromadb
-from chromadb.config import Settings
+import argparse, json, os, csv, time, asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from utils.io_jsonl import write_jsonl
-from utils.openai_wrap import chat_json
+from utils.io_jsonl import read_jsonl, write_jsonl, JsonlWriter
+from utils.openai_wrap import chat_json, achat_json, stats as llm_stats
+from utils.prompt_template import load_template
+from generate import open_collection
 
 load_dotenv()
 CHROMA_PATH = os.getenv("CHROMA_PATH","./chroma")
@@ -20,69 +22,191 @@ def retrieve_examples(collection, query: str, subject: str | None, top_k: int =
         lines.append(f"- ({m.get('source','')}) {d}")
     return "\n".join(lines)
 
-def load_template(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-
-def generate_set(with_retrieval: bool, subject, topic, qtype, difficulty, n):
+def gen_messages(with_retrieval: bool, subject, topic, qtype, difficulty, n, bloom_level="understand"):
     # Note: This uses the same prompt but optionally with empty retrieval block.
     tpl = load_template("prompts/qg_prompt.txt")
     retrieved_block = "" if not with_retrieval else "<retrieval included in judge prompt below>"
-    prompt = (
-        tpl.replace("{{subject}}", subject)
-           .replace("{{topic}}", topic)
-           .replace("{{qtype}}", qtype)
-           .replace("{{difficulty}}", difficulty)
-           .replace("{{n}}", str(n))
-           .replace("{{retrieved_block}}", retrieved_block)
-    )
-    messages = [
+    prompt = tpl.render({"subject": subject, "topic": topic, "qtype": qtype, "difficulty": difficulty,
+                         "n": n, "bloom_level": bloom_level, "retrieved_block": retrieved_block, "history_block": ""},
+                        strict=True)
+    return [
         {"role":"system","content":"You are a strict exam question generator that outputs pure JSON."},
         {"role":"user","content": prompt}
     ]
-    out = chat_json(messages, max_tokens=1800, temperature=0.6)
+
+def generate_set(with_retrieval: bool, subject, topic, qtype, difficulty, n, bloom_level="understand"):
+    out = chat_json(gen_messages(with_retrieval, subject, topic, qtype, difficulty, n, bloom_level), max_tokens=1800, temperature=0.6)
     return out.get("questions", [])
 
+def judge_messages(case, retrieved_block, rag_set, norag_set):
+    judge_tpl = load_template("prompts/judge_rubric.txt")
+    judge_prompt = judge_tpl.render({
+        "subject": case["subject"], "topic": case["topic"], "qtype": case["qtype"], "difficulty": case["difficulty"],
+        "retrieved_block": retrieved_block,
+        "rag_block": json.dumps(rag_set, ensure_ascii=False, indent=2),
+        "norag_block": json.dumps(norag_set, ensure_ascii=False, indent=2),
+    }, strict=True)
+    return [
+        {"role":"system","content":"You are an impartial exam-quality judge that outputs JSON only."},
+        {"role":"user","content": judge_prompt}
+    ]
+
+# ----- Suite mode: many cases, arms and judge calls run concurrently under one cap
+CASE_KEYS = ("subject", "topic", "qtype", "difficulty", "n", "bloom_level")
+STAGES = ("retrieve", "rag", "norag", "judge")
+
+def load_cases(path, defaults):
+    """JSONL or CSV rows of (subject, topic[, qtype, difficulty, n, bloom_level]); missing fields use CLI defaults."""
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = [{k: v for k, v in r.items() if v not in (None, "")} for r in csv.DictReader(f)]
+    else:
+        rows = list(read_jsonl(path))
+    cases = []
+    for r in rows:
+        case = {k: r.get(k, defaults.get(k)) for k in CASE_KEYS}
+        if not case["subject"] or not case["topic"]:
+            raise ValueError(f"Case is missing subject/topic: {r}")
+        case["n"] = int(case["n"])
+        cases.append(case)
+    return cases
+
+def case_key(case):
+    # .get: results written before bloom_level was a case field never match, so they are re-run
+    return json.dumps([case.get(k) for k in CASE_KEYS], ensure_ascii=False)
+
+def load_results(path):
+    """Latest result per case from an existing suite output (later lines win)."""
+    done = {}
+    if os.path.exists(path):
+        for r in read_jsonl(path):
+            done[case_key(r)] = r
+    return done
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+def summarize(results):
+    """Win rates (overall and per subject), mean judge scores and per-stage latency."""
+    verdicts = [r for r in results if "judge" in r]
+    def rates(rows):
+        wins = defaultdict(int)
+        for r in rows:
+            wins[str(r["judge"].get("winner", "")).lower()] += 1
+        n = len(rows)
+        return {"cases": n, **{f"{w}_rate": round(wins[w] / n, 3) if n else 0.0 for w in ("rag", "norag", "tie")}}
+    by_subject = defaultdict(list)
+    for r in verdicts:
+        by_subject[r["subject"]].append(r)
+    scores = {}
+    for side in ("rag_score", "norag_score"):
+        vals = [float(r["judge"][side]) for r in verdicts if isinstance(r["judge"].get(side), (int, float))]
+        scores[side] = round(sum(vals) / len(vals), 3) if vals else None
+    latency = {}
+    for stage in STAGES:
+        vals = [r["latency"][stage] for r in results if stage in r.get("latency", {})]
+        latency[stage] = {"p50_s": round(percentile(vals, 50), 3), "p95_s": round(percentile(vals, 95), 3),
+                          "total_s": round(sum(vals), 2)}
+    return {
+        **rates(verdicts), "failed": len(results) - len(verdicts), "mean_scores": scores,
+        "by_subject": {s: rates(rows) for s, rows in sorted(by_subject.items())},
+        "latency": latency,
+    }
+
+async def run_case(case, retrieved_block, retrieve_s, sem):
+    latency = {"retrieve": retrieve_s}
+
+    async def call(stage, messages, **kw):
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                return await achat_json(messages, **kw)
+            finally:
+                latency[stage] = round(time.perf_counter() - t0, 3)
+
+    result = {**case, "retrieved_block": retrieved_block, "latency": latency}
+    try:
+        rag, norag = await asyncio.gather(
+            call("rag", gen_messages(True, *(case[k] for k in CASE_KEYS)), max_tokens=1800, temperature=0.6),
+            call("norag", gen_messages(False, *(case[k] for k in CASE_KEYS)), max_tokens=1800, temperature=0.6),
+        )
+        result["rag_set"] = rag.get("questions", [])
+        result["norag_set"] = norag.get("questions", [])
+        result["judge"] = await call("judge", judge_messages(case, retrieved_block, result["rag_set"], result["norag_set"]),
+                                     max_tokens=800, temperature=0.0)
+    except Exception as e:
+        result["error"] = repr(e)
+    return result
+
+async def run_suite(cases, collection, top_k, out, concurrency):
+    """Judge every case not already in `out`; results are appended as each case finishes."""
+    done = load_results(out)
+    pending = [c for c in cases if "judge" not in done.get(case_key(c), {})]
+    print(f"{len(cases)} cases, {len(cases) - len(pending)} already judged, {len(pending)} to run")
+    blocks = []
+    for case in pending:
+        t0 = time.perf_counter()
+        blocks.append((retrieve_examples(collection, case["topic"], case["subject"], top_k), round(time.perf_counter() - t0, 3)))
+    sem = asyncio.Semaphore(max(1, concurrency))
+    t0 = time.perf_counter()
+    with JsonlWriter(out, mode="a") as writer:
+        tasks = [asyncio.ensure_future(run_case(c, b, s, sem)) for c, (b, s) in zip(pending, blocks)]
+        for fut in asyncio.as_completed(tasks):
+            result = await fut
+            writer.write(result)
+            done[case_key(result)] = result
+            status = result["judge"].get("winner") if "judge" in result else f"error {result['error']}"
+            print(f"[{result['subject']}/{result['topic']}] {status}")
+    summary = summarize([done[case_key(c)] for c in cases if case_key(c) in done])
+    summary["elapsed_s"] = round(time.perf_counter() - t0, 2)
+    summary["llm"] = llm_stats.summary()
+    return summary
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--subject", required=True)
-    ap.add_argument("--topic", required=True)
+    ap.add_argument("--subject", default=None)
+    ap.add_argument("--topic", default=None)
     ap.add_argument("--qtype", choices=["mcq","tf"], default="mcq")
     ap.add_argument("--difficulty", choices=["easy","medium","hard"], default="medium")
     ap.add_argument("--n", type=int, default=5)
+    ap.add_argument("--bloom_level", choices=["remember","understand","apply","analyze","evaluate","create"], default="understand")
     ap.add_argument("--collection", default="exam_bank")
     ap.add_argument("--top_k", type=int, default=6)
     ap.add_argument("--out", default=None)
+    ap.add_argument("--snapshot", default=None, help="Retrieve from a snapshot directory written by export_index.py instead of Chroma")
+    ap.add_argument("--cases", default=None, help="Suite mode: JSONL/CSV of (subject, topic, qtype, difficulty, n, bloom_level) cases")
+    ap.add_argument("--concurrency", type=int, default=8, help="Suite mode: max LLM calls in flight across all cases and stages")
     args = ap.parse_args()
+    if not args.cases and (not args.subject or not args.topic):
+        ap.error("--subject and --topic are required unless --cases is given")
 
-    client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
-    collection = client.get_or_create_collection(args.collection)
+    collection = open_collection(args.collection, args.snapshot)
+
+    if args.cases:
+        out = args.out or "outputs/pairwise_suite.jsonl"
+        summary = asyncio.run(run_suite(load_cases(args.cases, vars(args)), collection, args.top_k, out, args.concurrency))
+        print(f"Saved verdicts to {out}")
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+
+    case = {k: getattr(args, k) for k in CASE_KEYS}
     retrieved_block = retrieve_examples(collection, args.topic, args.subject, args.top_k)
 
-    rag_set = generate_set(True, args.subject, args.topic, args.qtype, args.difficulty, args.n)
-    norag_set = generate_set(False, args.subject, args.topic, args.qtype, args.difficulty, args.n)
+    # The two arms are independent, so they run side by side
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        rag_fut = pool.submit(generate_set, True, args.subject, args.topic, args.qtype, args.difficulty, args.n, args.bloom_level)
+        norag_fut = pool.submit(generate_set, False, args.subject, args.topic, args.qtype, args.difficulty, args.n, args.bloom_level)
+        rag_set, norag_set = rag_fut.result(), norag_fut.result()
 
-    judge_tpl = load_template("prompts/judge_rubric.txt")
-    judge_prompt = (
-        judge_tpl.replace("{{subject}}", args.subject)
-                 .replace("{{topic}}", args.topic)
-                 .replace("{{qtype}}", args.qtype)
-                 .replace("{{difficulty}}", args.difficulty)
-                 .replace("{{retrieved_block}}", retrieved_block)
-                 .replace("{{rag_block}}", json.dumps(rag_set, ensure_ascii=False, indent=2))
-                 .replace("{{norag_block}}", json.dumps(norag_set, ensure_ascii=False, indent=2))
-    )
-    messages = [
-        {"role":"system","content":"You are an impartial exam-quality judge that outputs JSON only."},
-        {"role":"user","content": judge_prompt}
-    ]
-    verdict = chat_json(messages, max_tokens=800, temperature=0.0)
+    verdict = chat_json(judge_messages(case, retrieved_block, rag_set, norag_set), max_tokens=800, temperature=0.0)
 
     result = {
         "subject": args.subject,
         "topic": args.topic,
         "qtype": args.qtype,
         "difficulty": args.difficulty,
+        "bloom_level": args.bloom_level,
         "retrieved_block": retrieved_block,
         "rag_set": rag_set,
         "norag_set": norag_set,
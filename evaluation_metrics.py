@@ -2,8 +2,10 @@
 Evaluation & Visualization Script for QA Predictions
 ----------------------------------------------------
 
-This script loads saved predictions from a CSV file,
-computes evaluation metrics (ROUGE, BLEU), and visualizes results.
+This script loads saved predictions from a CSV (or Parquet/Arrow) file,
+computes evaluation metrics (ROUGE, BLEU, optionally BERTScore), and visualizes results.
+Systems are scored in parallel worker processes and cached per system in
+outputs/metrics_cache.json, so adding one column only scores that column.
 
 Metrics included:
     - ROUGE-1: Overlap of unigrams (words) between prediction and reference
@@ -16,69 +18,67 @@ Higher scores are better, but note:
     - BLEU focuses more on precision (how much predicted text is correct).
 """
 
+import argparse
 import pandas as pd
-import evaluate
 import matplotlib.pyplot as plt
 
-# ============================
-# 1. Load Predictions
-# ============================
-# Assumes "predictions.csv" contains at least:
-#   - reference (gold answer)
-#   - bart_prediction (generated by model)
-preds_df = pd.read_csv("predictions.csv")
+from utils.eval_metrics import score_systems, system_columns, METRICS_CACHE
+from utils.columnar import read_table
 
-# Extract gold answers and predictions
-references = preds_df["reference"].tolist()
-systems = {
-    "BART": preds_df["bart_prediction"].tolist()
-}
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default="all_predictions.csv",
+                    help="CSV/Parquet/Arrow table with a reference column and one column per system "
+                         "(a CSV is read from its .parquet twin when an up-to-date one exists)")
+    ap.add_argument("--cache_parquet", action="store_true",
+                    help="Write a .parquet twin next to a CSV input so later runs skip CSV parsing")
+    ap.add_argument("--systems", default=None, help="Comma-separated prediction columns (default: every system column)")
+    ap.add_argument("--workers", type=int, default=4, help="Processes scoring systems in parallel")
+    ap.add_argument("--bertscore", action="store_true", help="Also compute BERTScore-F1")
+    ap.add_argument("--bert_batch_size", type=int, default=64)
+    ap.add_argument("--cache", default=METRICS_CACHE, help="Per-system metrics cache ('' to disable)")
+    args = ap.parse_args()
 
-# ============================
-# 2. Load Metrics
-# ============================
-rouge = evaluate.load("rouge")
-bleu = evaluate.load("bleu")
+    # ============================
+    # 1. Load Predictions
+    # ============================
+    # The table needs a "reference" (gold answer) column plus one column per system,
+    # e.g. all_predictions.csv or predictions.csv (bart_prediction)
+    preds_df = read_table(args.input, write_twin=args.cache_parquet).fillna("")
 
-# ============================
-# 3. Compute Scores
-# ============================
-results = {}
-for system_name, preds in systems.items():
-    print(f"\n🔹 Evaluating {system_name}...")
+    # Extract gold answers and predictions
+    references = preds_df["reference"].tolist()
+    columns = args.systems.split(",") if args.systems else system_columns(preds_df)
+    systems = {c: preds_df[c].tolist() for c in columns}
 
-    # ROUGE scores
-    rouge_res = rouge.compute(predictions=preds, references=references)
+    # ============================
+    # 2-3. Compute Scores (scorers loaded once per process, cached per system)
+    # ============================
+    print(f"\n🔹 Evaluating {', '.join(systems)}...")
+    results = score_systems(references, systems, workers=args.workers, bertscore=args.bertscore,
+                            bert_batch_size=args.bert_batch_size, cache_path=args.cache or None)
 
-    # BLEU score
-    bleu_res = bleu.compute(predictions=preds, references=references)
+    # Convert results to DataFrame for easy visualization
+    results_df = pd.DataFrame(results).T  # systems × metrics
+    print("\n===== 📊 Final Evaluation Results =====")
+    print(results_df)
 
-    # Store results
-    results[system_name] = {
-        "ROUGE-1": rouge_res["rouge1"],
-        "ROUGE-2": rouge_res["rouge2"],
-        "ROUGE-L": rouge_res["rougeL"],
-        "BLEU": bleu_res["bleu"],
-    }
+    # ============================
+    # 4. Visualization
+    # ============================
 
-# Convert results to DataFrame for easy visualization
-results_df = pd.DataFrame(results).T  # systems × metrics
-print("\n===== 📊 Final Evaluation Results =====")
-print(results_df)
+    # Plot as grouped bar chart
+    results_df.plot(kind="bar", figsize=(10, 6))
+    plt.title("Model Evaluation Metrics")
+    plt.ylabel("Score")
+    plt.xlabel("System")
+    plt.xticks(rotation=0)
+    plt.legend(title="Metrics")
+    plt.tight_layout()
+    plt.savefig("evaluation_scores.png")
+    plt.show()
 
-# ============================
-# 4. Visualization
-# ============================
+    print("\n✅ Visualization saved as evaluation_scores.png")
 
-# Plot as grouped bar chart
-results_df.plot(kind="bar", figsize=(10, 6))
-plt.title("Model Evaluation Metrics")
-plt.ylabel("Score")
-plt.xlabel("System")
-plt.xticks(rotation=0)
-plt.legend(title="Metrics")
-plt.tight_layout()
-plt.savefig("evaluation_scores.png")
-plt.show()
-
-print("\n✅ Visualization saved as evaluation_scores.png")
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ Multi-Model QA Evaluation on SciQ Dataset
 
 This script compares multiple models on the SciQ dataset.
 For each model:
-    - Generates answers given a question
+    - Generates answers given a question (batched, length-sorted, resumable)
     - Evaluates predictions using ROUGE, BLEU, and BERTScore
     - Saves results and predictions
     - Produces a visualization comparing models
@@ -16,111 +16,197 @@ Metrics:
     - BLEU: n-gram precision (common in MT)
     - BERTScore-F1: semantic similarity (cosine sim in embedding space)
 
+Speed options (CPU):
+    --batch_size 32      questions per generate() call, padded to the longest in the batch
+    --threads 8          torch intra-op threads
+    --quantize int8      dynamic int8 quantisation of Linear layers (CPU only)
+Predictions are checkpointed per model under --checkpoint_dir after every
+batch, so an interrupted run resumes where it stopped.
+
 Author: You 😊
 """
 
+import argparse, os, json, time, hashlib
 import pandas as pd
 import matplotlib.pyplot as plt
 from datasets import load_dataset
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import evaluate
 import torch
 
-# ============================
-# 1. Setup
-# ============================
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"🔥 Using device: {device}")
-
-# Models to compare (you can add/remove)
-model_names = {
-    "BART-base": "facebook/bart-base",
-    "T5-small": "t5-small",
-    "FLAN-T5-base": "google/flan-t5-base"
-}
+from utils.io_jsonl import JsonlWriter
+from utils.eval_metrics import score_systems, METRICS_CACHE
+from utils.columnar import write_table
 
 # ============================
-# 2. Load Dataset
+# Batched Generation
 # ============================
-dataset = load_dataset("sciq")["test"]
-dataset = dataset.rename_column("correct_answer", "reference")
-
-# Ensure gold answers are labeled "reference"
-if "reference" not in dataset.column_names:
-    dataset = dataset.rename_column("correct_answer", "reference")
-references = dataset["reference"]
-
-# ============================
-# 3. Metrics
-# ============================
-rouge = evaluate.load("rouge")
-bleu = evaluate.load("bleu")
-bertscore = evaluate.load("bertscore")
-
-results = {}
-all_predictions = pd.DataFrame({"reference": references, "question": dataset["question"]})
-
-# ============================
-# 4. Model Evaluation Loop
-# ============================
-for label, model_name in model_names.items():
-    print(f"\n⏳ Generating predictions with {label}...")
-
-    # Load model + tokenizer
+def checkpoint_path(args, label, model_name):
+    # Generation settings are part of the name, so a changed setting never reuses stale predictions
+    cfg = json.dumps([model_name, args.split, args.num_beams, args.max_new_tokens, args.quantize])
+    return os.path.join(args.checkpoint_dir, f"{label}_{hashlib.md5(cfg.encode('utf-8')).hexdigest()[:8]}.jsonl")
+
+def load_checkpoint(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # partially written last line of an interrupted run
+                done[row["idx"]] = row["prediction"]
+    return done
+
+def length_sorted_batches(tokenizer, questions, idxs, batch_size):
+    # Sorting by tokenized length keeps padding inside each batch small
+    lengths = tokenizer([questions[i] for i in idxs], truncation=True)["input_ids"]
+    order = [i for _, i in sorted(zip(map(len, lengths), idxs))]
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+def load_model(args, model_name, device):
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(device)
-
-    # Generate predictions
-    def generate_prediction(example):
-        inputs = tokenizer(example["question"], return_tensors="pt", truncation=True).to(device)
-        outputs = model.generate(**inputs, max_new_tokens=32, num_beams=4)
-        return tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-
-    predictions = dataset.map(lambda ex: {f"{label}_prediction": generate_prediction(ex)}, batched=False)
-    preds = predictions[f"{label}_prediction"]
-
-    # Save predictions to DataFrame
-    all_predictions[label] = preds
-
-    # Compute metrics
-    rouge_res = rouge.compute(predictions=preds, references=references)
-    bleu_res = bleu.compute(predictions=preds, references=references)
-    bert_res = bertscore.compute(predictions=preds, references=references, lang="en")
-    avg_bert_f1 = sum(bert_res["f1"]) / len(bert_res["f1"])
-
-    results[label] = {
-        "ROUGE-1": rouge_res["rouge1"],
-        "ROUGE-2": rouge_res["rouge2"],
-        "ROUGE-L": rouge_res["rougeL"],
-        "BLEU": bleu_res["bleu"],
-        "BERTScore-F1": avg_bert_f1,
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+    if args.quantize == "int8":
+        if device != "cpu":
+            print("⚠️ Dynamic int8 quantisation is CPU-only; running in full precision.")
+        else:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model.to(device)
+
+def generate_predictions(args, label, model_name, questions, device):
+    path = checkpoint_path(args, label, model_name)
+    done = {} if args.no_resume else load_checkpoint(path)
+    todo = [i for i in range(len(questions)) if i not in done]
+    if done:
+        print(f"↩️ Resuming {label}: {len(done)} predictions from {path}, {len(todo)} left")
+    if not todo:
+        return [done[i] for i in range(len(questions))], None
+
+    tokenizer, model = load_model(args, model_name, device)
+    t0 = time.perf_counter()
+    with JsonlWriter(path, mode="w" if args.no_resume else "a") as ckpt, torch.inference_mode():
+        for n_batch, batch in enumerate(length_sorted_batches(tokenizer, questions, todo, args.batch_size), 1):
+            inputs = tokenizer([questions[i] for i in batch], return_tensors="pt", padding=True, truncation=True).to(device)
+            outputs = model.generate(**inputs, max_new_tokens=args.max_new_tokens, num_beams=args.num_beams)
+            for i, pred in zip(batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+                done[i] = pred
+                ckpt.write({"idx": i, "prediction": pred})
+            if n_batch % 10 == 0:
+                print(f"   {len(done)}/{len(questions)} ({len(done) / len(questions):.0%})")
+    elapsed = time.perf_counter() - t0
+    del model
+    return [done[i] for i in range(len(questions))], len(todo) / elapsed if elapsed else 0.0
+
+def main():
+    # ============================
+    # 0. Options
+    # ============================
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--models", default=None, help="Comma-separated subset of model labels (default: all)")
+    ap.add_argument("--split", default="test")
+    ap.add_argument("--limit", type=int, default=None, help="Only evaluate the first N questions")
+    ap.add_argument("--batch_size", type=int, default=32)
+    ap.add_argument("--num_beams", type=int, default=4)
+    ap.add_argument("--max_new_tokens", type=int, default=32)
+    ap.add_argument("--threads", type=int, default=None, help="torch.set_num_threads (default: torch's choice)")
+    ap.add_argument("--quantize", choices=["none", "int8"], default="none", help="Dynamic int8 quantisation (CPU only)")
+    ap.add_argument("--checkpoint_dir", default="outputs/eval_checkpoints")
+    ap.add_argument("--no_resume", action="store_true", help="Ignore existing checkpoints and regenerate")
+    ap.add_argument("--workers", type=int, default=4, help="Processes scoring models' metrics in parallel")
+    ap.add_argument("--bert_batch_size", type=int, default=64)
+    ap.add_argument("--metrics_cache", default=METRICS_CACHE, help="Per-model metrics cache ('' to disable)")
+    ap.add_argument("--predictions_out", default="all_predictions.csv",
+                    help="Predictions table (.csv also gets a .parquet twin; .parquet/.arrow write only that)")
+    args = ap.parse_args()
+
+    # ============================
+    # 1. Setup
+    # ============================
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(f"🔥 Using device: {device} ({torch.get_num_threads()} threads)")
+
+    # Models to compare (you can add/remove)
+    model_names = {
+        "BART-base": "facebook/bart-base",
+        "T5-small": "t5-small",
+        "FLAN-T5-base": "google/flan-t5-base"
     }
+    if args.models:
+        model_names = {k: v for k, v in model_names.items() if k in args.models.split(",")}
+
+    # ============================
+    # 2. Load Dataset
+    # ============================
+    dataset = load_dataset("sciq")[args.split]
+    if args.limit:
+        dataset = dataset.select(range(min(args.limit, len(dataset))))
+    dataset = dataset.rename_column("correct_answer", "reference")
 
-# ============================
-# 5. Save Results
-# ============================
-# Scores
-results_df = pd.DataFrame(results).T
-results_df.to_csv("evaluation_scores.csv")
-print("\n✅ Scores saved to evaluation_scores.csv")
-
-# Predictions
-all_predictions.to_csv("all_predictions.csv", index=False)
-print("✅ Predictions saved to all_predictions.csv")
-
-# ============================
-# 6. Visualization
-# ============================
-# Plot all metrics as grouped bar chart
-results_df.plot(kind="bar", figsize=(12, 6))
-plt.title("Model Evaluation on SciQ")
-plt.ylabel("Score")
-plt.xlabel("Models")
-plt.xticks(rotation=0)
-plt.legend(title="Metrics")
-plt.tight_layout()
-plt.savefig("evaluation_scores.png")
-plt.show()
-
-print("\n📊 Visualization saved as evaluation_scores.png")
-print("\n📊 Final Results:\n", results_df)
\ No newline at end of file
+    # Ensure gold answers are labeled "reference"
+    if "reference" not in dataset.column_names:
+        dataset = dataset.rename_column("correct_answer", "reference")
+    references = dataset["reference"]
+    questions = dataset["question"]
+
+    throughput = {}
+    all_predictions = pd.DataFrame({"reference": references, "question": questions})
+
+    # ============================
+    # 3. Model Evaluation Loop
+    # ============================
+    for label, model_name in model_names.items():
+        print(f"\n⏳ Generating predictions with {label}...")
+        preds, qps = generate_predictions(args, label, model_name, questions, device)
+        if qps is not None:
+            throughput[label] = qps
+            print(f"⚡ {label}: {qps:.2f} questions/sec")
+
+        # Save predictions to DataFrame
+        all_predictions[label] = preds
+
+    # ============================
+    # 4. Metrics (scorers loaded once; models scored in parallel, cached per model)
+    # ============================
+    results = score_systems(references, {label: all_predictions[label].tolist() for label in model_names},
+                            workers=args.workers, bert_batch_size=args.bert_batch_size,
+                            cache_path=args.metrics_cache or None)
+
+    # ============================
+    # 5. Save Results
+    # ============================
+    # Scores
+    results_df = pd.DataFrame(results).T
+    results_df.to_csv("evaluation_scores.csv")
+    print("\n✅ Scores saved to evaluation_scores.csv")
+
+    # Predictions
+    # CSV for people, plus a Parquet twin that evaluation_metrics.py reads without re-parsing
+    write_table(all_predictions, args.predictions_out)
+    print(f"✅ Predictions saved to {args.predictions_out}")
+
+    # ============================
+    # 6. Visualization
+    # ============================
+    # Plot all metrics as grouped bar chart
+    results_df.plot(kind="bar", figsize=(12, 6))
+    plt.title("Model Evaluation on SciQ")
+    plt.ylabel("Score")
+    plt.xlabel("Models")
+    plt.xticks(rotation=0)
+    plt.legend(title="Metrics")
+    plt.tight_layout()
+    plt.savefig("evaluation_scores.png")
+    plt.show()
+
+    print("\n📊 Visualization saved as evaluation_scores.png")
+    print("\n📊 Final Results:\n", results_df)
+    if throughput:
+        print("\n⚡ Throughput (questions/sec, this run):")
+        for label, qps in throughput.items():
+            print(f"   {label}: {qps:.2f}  (batch_size={args.batch_size}, quantize={args.quantize})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse, os, sys, time
+from dotenv import load_dotenv
+import chromadb
+from chromadb.config import Settings
+
+from utils.embedder import EMBEDDING_NAME, STEmbeddingFunction
+from utils.shards import ShardedCollection, load_registry
+from utils.snapshot import write_snapshot
+
+load_dotenv()
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma")
+
+def main():
+    ap = argparse.ArgumentParser(description="Snapshot a Chroma collection for offline, zero-service retrieval")
+    ap.add_argument("--collection", default="exam_bank", help="Chroma collection name")
+    ap.add_argument("--out", default=None, help="Snapshot directory (default: snapshots/<collection>)")
+    ap.add_argument("--quantize", choices=["none","int8"], default="none", help="Store float32 or int8-quantised vectors")
+    ap.add_argument("--hnsw", action="store_true", help="Also build an HNSW index (requires hnswlib); default is exact search")
+    ap.add_argument("--page", type=int, default=5000, help="Rows fetched from Chroma per page")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+    registry = load_registry(CHROMA_PATH, args.collection)
+    if registry:
+        # Ingested with --shard_by: the rows live in one Chroma collection per shard
+        cols = list(ShardedCollection(client, registry, STEmbeddingFunction()).shards.values())
+    else:
+        cols = [client.get_collection(args.collection)]
+    ids, docs, metas, embs = [], [], [], []
+    for col in cols:
+        total = col.count()
+        for offset in range(0, total, args.page):
+            page = col.get(limit=args.page, offset=offset, include=["documents","metadatas","embeddings"])
+            ids += page["ids"]
+            docs += page["documents"]
+            metas += page["metadatas"]
+            embs += list(page["embeddings"])
+
+    if not ids:
+        sys.exit(f"Collection '{args.collection}' at {CHROMA_PATH} is empty; nothing to export (run ingest.py first).")
+    out = args.out or os.path.join("snapshots", args.collection)
+    header = write_snapshot(out, ids, docs, metas, embs, quantize=None if args.quantize == "none" else args.quantize,
+                            model_name=EMBEDDING_NAME, hnsw=args.hnsw)
+    print(f"Exported {header['n']} rows (dim={header['dim']}, quantize={args.quantize}) from '{args.collection}' "
+          f"to {out} in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,203 @@
-import argparse, os, json, pandas as pd
+import argparse, os, json, csv, time, asyncio, pandas as pd
+import numpy as np
+from collections import defaultdict
 from dotenv import load_dotenv
 import chromadb
 from chromadb.config import Settings
 
-from utils.openai_wrap import chat_json
-from utils.io_jsonl import write_jsonl
-from utils.cache import cache_load, cache_save, cache_key_from_params, history_load, history_append
+from utils.openai_wrap import chat_json, chat_json_stream, agather_json, stats as llm_stats
+from utils.embedder import STEmbeddingFunction
+from utils.io_jsonl import read_jsonl, write_jsonl, JsonlWriter
+from utils.columnar import write_questions, bank_append, BANK_DIR
+from utils.mmr import mmr_select
+from utils.dedup import HistoryIndex, DuplicateFilter
+from utils.snapshot import SnapshotRetriever
+from utils.shards import ShardedCollection, load_registry
+from utils.tokens import count_tokens, fit_lines
+from utils.prompt_template import load_template
+from utils.json_repair import validate_questions, salvage_stats
+from utils.trace import span, traced, request as trace_request, set_trace_file
+from utils.bm25 import BM25Index, index_path, rrf_fuse
+from utils.cache import cache_get, cache_put, cache_key_from_params, history_load, history_append, semantic_lookup, semantic_put
 
 load_dotenv()
 CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma")
+SYSTEM_PROMPT = "You are a strict exam question generator that outputs pure JSON."
+# Token caps for the variable prompt blocks; when the whole prompt exceeds PROMPT_TOKEN_BUDGET,
+# history is trimmed before retrieved examples (0 disables a cap)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+SLOT_BUDGETS = {
+    "retrieved_block": int(os.getenv("RETRIEVED_TOKEN_BUDGET", "2500")),
+    "history_block": int(os.getenv("HISTORY_TOKEN_BUDGET", "600")),
+}
 
-def dynamic_retrieve(collection, query: str, subject: str | None, max_k: int = 12, min_k: int = 4, distance_delta: float = 0.25):
+def select_candidates(dists, min_k: int = 4, distance_delta: float = 0.25):
+    """Indices of hits whose distance <= best + delta, keeping at least min_k."""
+    best = min((d for d in dists if d is not None), default=0.0)
+    keep = []
+    for i, dist in enumerate(dists):
+        if len(keep) < min_k or (dist is not None and dist <= best + distance_delta):
+            keep.append(i)
+    return keep
+
+def format_examples(docs, metas):
+    # Pretty block
+    lines = []
+    for d,m in zip(docs, metas):
+        src = m.get("source","");
+        lines.append(f"- ({src}) {d}")
+    return lines
+
+def dynamic_retrieve(collection, query: str, subject: str | None, max_k: int = 12, min_k: int = 4, distance_delta: float = 0.25,
+                     mmr_lambda: float | None = None, dup_threshold: float = 0.95, token_budget: int = 0, stats: dict | None = None):
     """Retrieve adaptively: start with top results, keep those close to the best distance.
     For cosine distance (smaller better), we keep items whose distance <= best + delta.
     Ensure at least min_k items as a fallback.
+    Optionally re-rank the kept hits with MMR (dropping near-duplicates above dup_threshold)
+    and cap the block at token_budget tokens; `stats` receives the prompt tokens saved.
     """
     where = {}
     if subject:
         where["subject"] = subject
-    res = collection.query(query_texts=[query], n_results=max_k, where=where or None, include=["documents","metadatas","distances"])
+    # The query is embedded here rather than inside collection.query so embedding and search are timed apart
+    with span("retrieve.embed"):
+        qvec = STEmbeddingFunction().encode([query])[0]
+    with span("retrieve.search", max_k=max_k):
+        if mmr_lambda is None:
+            res = collection.query(query_embeddings=[qvec.tolist()], n_results=max_k, where=where or None,
+                                   include=["documents","metadatas","distances"])
+        else:
+            # MMR also needs the embeddings Chroma already stores for the hits
+            res = collection.query(query_embeddings=[qvec.tolist()], n_results=max_k, where=where or None,
+                                   include=["documents","metadatas","distances","embeddings"])
     docs = res.get("documents", [[]])[0]
     metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0] if res.get("distances") else [0.0]*len(docs)
+    dists = res.get("distances", [[]])[0] if res.get("distances") else None
+    embs = res["embeddings"][0] if mmr_lambda is not None else None
+    return examples_block(qvec, docs, metas, dists, embs, min_k=min_k, distance_delta=distance_delta,
+                          mmr_lambda=mmr_lambda, dup_threshold=dup_threshold, token_budget=token_budget, stats=stats)
+
+def examples_block(qvec, docs, metas, dists, embs=None, min_k: int = 4, distance_delta: float = 0.25,
+                   mmr_lambda: float | None = None, dup_threshold: float = 0.95, token_budget: int = 0, stats: dict | None = None):
+    """Shared tail of dense and hybrid retrieval: distance-based selection, optional MMR
+    re-ranking (needs `embs`) and the token budget, formatted as the prompt block."""
     if not docs:
-        return []
-    best = dists[0] if dists else 0.0
-    selected = []
-    for d,m,dist in zip(docs, metas, dists):
-        if len(selected) < min_k or (dist is not None and dist <= best + distance_delta):
-            selected.append((d,m,dist))
-    if not selected:
-        selected = list(zip(docs[:min_k], metas[:min_k], dists[:min_k]))
-    # Pretty block
-    lines = []
-    for d,m,dist in selected:
-        src = m.get("source","");
-        lines.append(f"- ({src}) {d}")
-    return "\n".join(lines)
+        return ""
+    dists = dists or [0.0]*len(docs)
+    keep = select_candidates(dists, min_k=min_k, distance_delta=distance_delta)
+    baseline = format_examples([docs[i] for i in keep], [metas[i] for i in keep])
+    lines = baseline
+    if mmr_lambda is not None:
+        order = mmr_select(qvec, [embs[i] for i in keep], k=len(keep), lambda_=mmr_lambda, dup_threshold=dup_threshold)
+        lines = [baseline[j] for j in order]
+    if token_budget:
+        lines = fit_lines(lines, token_budget)
+    block = "\n".join(lines)
+    if stats is not None:
+        before = count_tokens("\n".join(baseline))
+        after = count_tokens(block)
+        stats.update({"examples_before": len(baseline), "examples_after": len(lines),
+                      "tokens_before": before, "tokens_after": after, "tokens_saved": before - after})
+    return block
+
+def hybrid_search(collection, bm25, query: str, subject: str | None, k: int = 12, candidates: int | None = None, rrf_k: int = 60,
+                  qvec=None):
+    """Fuse dense (Chroma HNSW) and sparse (BM25 over stems) rankings with reciprocal rank fusion.
+    Both sides apply the same subject filter. Returns the top-k fused ids and
+    {id: (document, metadata, cosine distance, embedding)}; BM25-only hits are scored against qvec.
+    """
+    candidates = candidates or k * 2
+    where = {"subject": subject} if subject else None
+    if qvec is None:
+        with span("retrieve.embed"):
+            qvec = STEmbeddingFunction().encode([query])[0]
+    with span("retrieve.search", max_k=candidates):
+        res = collection.query(query_embeddings=[np.asarray(qvec).tolist()], n_results=candidates, where=where,
+                               include=["documents","metadatas","distances","embeddings"])
+    dense_ids = res["ids"][0]
+    found = {i: (d, m, dist, e) for i, d, m, dist, e in zip(dense_ids, res["documents"][0], res["metadatas"][0],
+                                                          res["distances"][0], res["embeddings"][0])}
+    with span("retrieve.bm25"):
+        sparse_ids = [doc_id for doc_id, _ in bm25.search(query, k=candidates, subject=subject)]
+    fused = [doc_id for doc_id, _ in rrf_fuse([dense_ids, sparse_ids], k=rrf_k, limit=k)]
+    missing = [i for i in fused if i not in found]
+    if missing:
+        got = collection.get(ids=missing, include=["documents","metadatas"])
+        if got["ids"]:
+            # Same model as the stored vectors (and served from the embedding cache on repeats)
+            embs = np.asarray(STEmbeddingFunction().encode(got["documents"]), dtype=np.float32)
+            q = np.asarray(qvec, dtype=np.float32)
+            sims = embs @ q / np.maximum(np.linalg.norm(embs, axis=1) * np.linalg.norm(q), 1e-12)
+            found.update({i: (d, m, 1.0 - float(sim), e)
+                          for i, d, m, sim, e in zip(got["ids"], got["documents"], got["metadatas"], sims, embs)})
+    return [i for i in fused if i in found], found
+
+def hybrid_retrieve(collection, bm25, query: str, subject: str | None, max_k: int = 12, rrf_k: int = 60, min_k: int = 4,
+                    distance_delta: float = 0.25, mmr_lambda: float | None = None, dup_threshold: float = 0.95,
+                    token_budget: int = 0, stats: dict | None = None):
+    """Hybrid counterpart of dynamic_retrieve: the top max_k fused hits, in fused order, go through
+    the same distance selection, MMR and token budget as dense retrieval."""
+    with span("retrieve.embed"):
+        qvec = STEmbeddingFunction().encode([query])[0]
+    ids, found = hybrid_search(collection, bm25, query, subject, k=max_k, rrf_k=rrf_k, qvec=qvec)
+    hits = [found[doc_id] for doc_id in ids]
+    return examples_block(qvec, [h[0] for h in hits], [h[1] for h in hits], [h[2] for h in hits], [h[3] for h in hits],
+                          min_k=min_k, distance_delta=distance_delta, mmr_lambda=mmr_lambda,
+                          dup_threshold=dup_threshold, token_budget=token_budget, stats=stats)
+
+def open_collection(name, snapshot=None):
+    """Chroma collection, or a memory-mapped snapshot from export_index.py with the same query() API.
+    Collections ingested with --shard_by open as a ShardedCollection that routes/fans out over the shards.
+    """
+    with span("chroma.open", snapshot=bool(snapshot)):
+        if snapshot:
+            return SnapshotRetriever(snapshot)
+        client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+        registry = load_registry(CHROMA_PATH, name)
+        if registry:
+            return ShardedCollection(client, registry, STEmbeddingFunction())
+        return client.get_or_create_collection(name, embedding_function=STEmbeddingFunction())
+
+def print_shard_stats(collection):
+    if isinstance(collection, ShardedCollection):
+        for key, s in collection.summary().items():
+            print(f"Shard {key or '(none)'} [{s['collection']}]: {s['rows']} rows, {s['queries']} queries, "
+                  f"mean {s['mean_ms']:.1f} ms, p95 {s['p95_ms']:.1f} ms")
+
+def load_bm25(collection_name):
+    bm25 = BM25Index.load(index_path(CHROMA_PATH, collection_name))
+    if not len(bm25):
+        print(f"No BM25 index for '{collection_name}' (re-run ingest.py --bm25); using dense retrieval only.")
+        return None
+    return bm25
+
+@traced("retrieve.batch")
+def batch_retrieve(collection, queries, max_k: int = 12, min_k: int = 4, distance_delta: float = 0.25,
+                   mmr_lambda: float | None = None, dup_threshold: float = 0.95, token_budget: int = 0):
+    """dynamic_retrieve for many (topic, subject) pairs.
+    A Chroma `where` filter applies to every query text of a call, so queries are
+    grouped by subject and each group is sent as one multi-query collection.query.
+    All topics are embedded in one encode call.
+    """
+    groups = defaultdict(list)
+    for i, (topic, subject) in enumerate(queries):
+        groups[subject].append(i)
+    blocks = [""] * len(queries)
+    qvecs = STEmbeddingFunction().encode([topic for topic, _ in queries]) if queries else []
+    include = ["documents","metadatas","distances"] + (["embeddings"] if mmr_lambda is not None else [])
+    for subject, idxs in groups.items():
+        res = collection.query(
+            query_embeddings=[np.asarray(qvecs[i]).tolist() for i in idxs], n_results=max_k,
+            where={"subject": subject} if subject else None,
+            include=include,
+        )
+        for j, i in enumerate(idxs):
+            dists = res["distances"][j] if res.get("distances") else None
+            embs = res["embeddings"][j] if mmr_lambda is not None else None
+            blocks[i] = examples_block(qvecs[i], res["documents"][j], res["metadatas"][j], dists, embs,
+                                       min_k=min_k, distance_delta=distance_delta, mmr_lambda=mmr_lambda,
+                                       dup_threshold=dup_threshold, token_budget=token_budget)
+    return blocks
 
 def build_history_block(history_items, max_lines=6):
     lines = []
@@ -47,27 +208,332 @@ def build_history_block(history_items, max_lines=6):
         lines.append(f"* [{subject}/{topic}] {stem}")
     return "\n".join(lines)
 
-def load_template(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+def build_prompt(template, params, retrieved_block, history_block):
+    """Render a template from load_template(), trimming the retrieved/history blocks to their token budgets."""
+    values = {k: params[k] for k in ("subject", "topic", "qtype", "difficulty", "bloom_level", "n")}
+    values.update(retrieved_block=retrieved_block, history_block=history_block)
+    with span("prompt.build") as entry:
+        stats = {}
+        prompt = template.render(values, budgets={k: v for k, v in SLOT_BUDGETS.items() if v},
+                                 max_tokens=PROMPT_TOKEN_BUDGET, priority=("retrieved_block", "history_block"),
+                                 keep_tail=("history_block",), stats=stats)
+        if entry is not None:
+            entry["attrs"].update(stats)
+    return prompt
+
+def build_messages(prompt):
+    return [
+        {"role":"system","content": SYSTEM_PROMPT},
+        {"role":"user","content": prompt}
+    ]
+
+def to_records(questions, params, start=0):
+    """Normalize raw LLM questions and attach metadata (ids are numbered from `start`)."""
+    # Normalize TF options if necessary
+    norm = []
+    for q in questions:
+        if params["qtype"] == "tf":
+            q["options"] = ["True", "False"]
+            if str(q.get("answer_idx","0")) not in ["0","1",0,1]:
+                q["answer_idx"] = 0
+        # enforce bloom & difficulty in output
+        q["bloom_level"] = params["bloom_level"]
+        q["difficulty"] = params["difficulty"]
+        norm.append(q)
+
+    records = []
+    for i, q in enumerate(norm, start=start):
+        rec = {
+            "id": f"gen-{params['subject']}-{params['topic']}-{params['bloom_level']}-{i}",
+            "subject": params["subject"],
+            "topic": params["topic"],
+            "type": params["qtype"],
+            "stem": q["stem"],
+            "options": q["options"],
+            "answer_idx": q["answer_idx"],
+            "explanation": q.get("explanation",""),
+            "bloom_level": q.get("bloom_level", params["bloom_level"]),
+            "difficulty": q.get("difficulty", params["difficulty"])
+        }
+        records.append(rec)
+    return records
+
+def topic_vector(topic):
+    return STEmbeddingFunction().encode([topic])[0]
+
+def semantic_cache_get(params, cache_key, threshold):
+    """Semantic-tier lookup; a hit is promoted into the exact cache under cache_key."""
+    hit = semantic_lookup(params, topic_vector(params["topic"]), threshold=threshold)
+    if hit is None:
+        print(f"Semantic cache miss (threshold={threshold}).")
+        return None
+    records, sim, matched = hit
+    print(f"Semantic cache hit: '{params['topic']}' ~ '{matched}' (cosine={sim:.3f}).")
+    # Relabel for the requested topic so ids and topic columns match an exact generation
+    records = [dict(r, topic=params["topic"], id=f"gen-{params['subject']}-{params['topic']}-{params['bloom_level']}-{i}")
+               for i, r in enumerate(records)]
+    cache_put(cache_key, records)
+    return records
+
+def make_dup_filter(collection=None, threshold=0.9, bank_threshold=None):
+    """Duplicate filter over all history embeddings (synced incrementally) and optionally the bank."""
+    embed = STEmbeddingFunction().encode
+    history_index = HistoryIndex(embed)
+    history_index.sync()
+    return history_index, DuplicateFilter(embed, history_index, collection, threshold=threshold,
+                                          bank_threshold=bank_threshold)
+
+def record_history(records, history_index=None):
+    """history_append, then embed the new lines into the history index, so it grows with the
+    history and a later --dedup run has nothing to catch up on."""
+    history_append(records)
+    (history_index or HistoryIndex(STEmbeddingFunction().encode)).sync()
+
+def missing_prompt(template, params, retrieved_block, history_block, kept, missing, dropped=()):
+    """Prompt for only the `missing` questions, listing kept (and rejected) stems as items to avoid."""
+    avoid = [q.get("stem", "") for q in kept if isinstance(q, dict)] + [d["stem"] for d in dropped]
+    extra_block = "\n".join([history_block] + [f"* [{params['subject']}/{params['topic']}] {s}" for s in avoid])
+    return build_prompt(template, dict(params, n=missing), retrieved_block, extra_block)
+
+def regenerate_missing(template, params, retrieved_block, history_block, dup_filter, kept, missing, stats=salvage_stats):
+    """Ask once more for `missing` questions (lost to invalid output, or duplicates when dup_filter is given)."""
+    dropped = dup_filter.dropped if dup_filter is not None else ()
+    stats.refilled(kept)
+    prompt = missing_prompt(template, params, retrieved_block, history_block, kept, missing, dropped)
+    result = chat_json(build_messages(prompt), max_tokens=2200, temperature=0.4, stats=stats)
+    questions = validate_questions(result.get("questions", []), params["qtype"], stats)
+    if dup_filter is not None:
+        questions = dup_filter.check(questions)
+    return questions[:missing]
+
+def default_out_path(params):
+    return f"outputs/{params['subject']}_{params['topic']}_{params['qtype']}_{params['difficulty']}_{params['bloom_level']}_{params['n']}.jsonl"
+
+@traced("output.write")
+def save_outputs(records, out, write_json=True, parquet=False, bank_dir=None):
+    """Write JSONL plus a CSV with the same stem (and a .parquet with parquet=True);
+    with bank_dir the records are also appended to the partitioned question bank. Returns the CSV path."""
+    if write_json:
+        write_jsonl(records, out)
+    os.makedirs("outputs", exist_ok=True)
+    df = pd.DataFrame(records)
+    csv_path = out.replace(".jsonl",".csv")
+    df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+    if parquet:
+        write_questions(records, out.replace(".jsonl", ".parquet"))
+    if bank_dir:
+        bank_append(records, bank_dir)
+    return csv_path
+
+# ----- Batch mode (--jobs)
+JOB_KEYS = ("subject", "topic", "qtype", "difficulty", "bloom_level", "n")
+QTYPES = ("mcq", "tf")
+DIFFICULTIES = ("easy", "medium", "hard")
+BLOOM_LEVELS = ("remember", "understand", "apply", "analyze", "evaluate", "create")
+
+def job_error(job):
+    """Why a manifest row cannot run (the checks argparse applies to the CLI flags), or None."""
+    missing = [k for k in ("subject", "topic") if not job.get(k)]
+    if missing:
+        return f"missing {'/'.join(missing)}"
+    for key, choices in (("qtype", QTYPES), ("difficulty", DIFFICULTIES), ("bloom_level", BLOOM_LEVELS)):
+        if job[key] not in choices:
+            return f"invalid {key} {job[key]!r} (choose from {', '.join(choices)})"
+    try:
+        n = int(job["n"])
+    except (TypeError, ValueError):
+        return f"invalid n {job['n']!r}"
+    if n != float(job["n"]) or n < 1:
+        return f"invalid n {job['n']!r}"
+    return None
+
+def load_jobs(path, defaults):
+    """Read a JSONL or CSV manifest of parameter tuples; missing fields fall back to CLI defaults.
+    Rows with invalid values are kept with an "error" and reported as failures by run_jobs."""
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = [{k: v for k, v in r.items() if v not in (None, "")} for r in csv.DictReader(f)]
+    else:
+        rows = list(read_jsonl(path))
+    jobs = []
+    for r in rows:
+        job = {k: r.get(k, defaults.get(k)) for k in JOB_KEYS}
+        error = job_error(job)
+        if error:
+            job["error"] = error
+        else:
+            job["n"] = int(job["n"])
+            job["out"] = r.get("out") or default_out_path(job)
+        jobs.append(job)
+    return jobs
+
+def run_jobs(jobs, collection, template, max_k=12, use_cache=False, concurrency=8, semantic_threshold=None, bm25=None,
+             dedup_threshold=None, dedup_bank=False, parquet=False, bank_dir=None, refill=True, retrieval=None,
+             dedup_bank_threshold=None):
+    """Generate every job of a manifest; `retrieval` holds the MMR/token-budget options
+    (mmr_lambda, dup_threshold, token_budget) for both dense and hybrid retrieval."""
+    retrieval = retrieval or {}
+    t0 = time.perf_counter()
+    summary = {"jobs": len(jobs), "ok": 0, "cached": 0, "failed": 0, "questions": 0, "failures": []}
+
+    def finish(job, records, fresh=False):
+        # cached sets were banked when first generated
+        save_outputs(records, job["out"], parquet=parquet, bank_dir=bank_dir if fresh else None)
+        summary["questions"] += len(records)
+        print(f"[{job['subject']}/{job['topic']}] {len(records)} questions -> {job['out']}")
+
+    pending = []
+    for job in jobs:
+        if job.get("error"):
+            summary["failed"] += 1
+            summary["failures"].append({"subject": job["subject"], "topic": job["topic"], "error": job["error"]})
+            print(f"[{job['subject']}/{job['topic']}] skipped: {job['error']}")
+            continue
+        params = {k: job[k] for k in JOB_KEYS}
+        job["cache_key"] = cache_key_from_params(params)
+        records = cache_get(job["cache_key"]) if use_cache else None
+        if records is None and semantic_threshold is not None:
+            records = semantic_cache_get(params, job["cache_key"], semantic_threshold)
+        if records is not None:
+            finish(job, records)
+            summary["cached"] += 1
+        else:
+            pending.append(job)
+
+    if pending:
+        # One retrieval round trip per subject, one history read for the whole batch
+        if bm25 is not None:
+            blocks = [hybrid_retrieve(collection, bm25, j["topic"], j["subject"], max_k=max_k, **retrieval) for j in pending]
+        else:
+            blocks = batch_retrieve(collection, [(j["topic"], j["subject"]) for j in pending], max_k=max_k, **retrieval)
+        history_block = build_history_block(history_load(limit=20), max_lines=6)
+        requests = [{
+            "messages": build_messages(build_prompt(template, job, block, history_block)),
+            "max_tokens": 2200, "temperature": 0.4,
+        } for job, block in zip(pending, blocks)]
+        results = asyncio.run(agather_json(requests, concurrency=concurrency))
+        valid = [None if isinstance(r, Exception) else validate_questions(r.get("questions", []), job["qtype"])
+                 for job, r in zip(pending, results)]
+        short = [i for i, qs in enumerate(valid) if qs is not None and len(qs) < pending[i]["n"]] if refill else []
+        if short:
+            # Second round only for jobs that lost questions to bad JSON, asking for just the shortfall
+            refills = []
+            for i in short:
+                salvage_stats.refilled(valid[i])
+                missing = pending[i]["n"] - len(valid[i])
+                refills.append({
+                    "messages": build_messages(missing_prompt(template, pending[i], blocks[i], history_block, valid[i], missing)),
+                    "max_tokens": 2200, "temperature": 0.4,
+                })
+            for i, r in zip(short, asyncio.run(agather_json(refills, concurrency=concurrency))):
+                if not isinstance(r, Exception):
+                    extra = validate_questions(r.get("questions", []), pending[i]["qtype"])
+                    valid[i] += extra[:pending[i]["n"] - len(valid[i])]
+        if dedup_threshold is not None:
+            # One filter for the whole batch: stems kept for earlier jobs count as "batch" duplicates
+            history_index, dup_filter = make_dup_filter(collection if dedup_bank else None, dedup_threshold,
+                                                        dedup_bank_threshold)
+            summary["duplicates_dropped"] = 0
+
+        for job, result, questions in zip(pending, results, valid):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                if dedup_threshold is not None:
+                    dropped = len(dup_filter.dropped)
+                    questions = dup_filter.check(questions)
+                    summary["duplicates_dropped"] += len(dup_filter.dropped) - dropped
+                records = to_records(questions, job)
+                finish(job, records, fresh=True)
+                cache_put(job["cache_key"], records)
+                if semantic_threshold is not None:
+                    semantic_put(job["cache_key"], {k: job[k] for k in JOB_KEYS}, topic_vector(job["topic"]))
+                history_append(records)
+                summary["ok"] += 1
+            except Exception as e:
+                summary["failed"] += 1
+                summary["failures"].append({"subject": job["subject"], "topic": job["topic"], "error": repr(e)})
+
+        # Embed every job's new history lines in one sync (embedding-cache hits after --dedup)
+        if dedup_threshold is None:
+            history_index = HistoryIndex(STEmbeddingFunction().encode)
+        history_index.sync()
+
+    elapsed = time.perf_counter() - t0
+    summary["elapsed_s"] = round(elapsed, 2)
+    summary["jobs_per_s"] = round(len(jobs) / elapsed, 2) if elapsed else 0.0
+    summary["questions_per_s"] = round(summary["questions"] / elapsed, 2) if elapsed else 0.0
+    summary["llm"] = llm_stats.summary()
+    summary["salvage"] = salvage_stats.summary()
+    if isinstance(collection, ShardedCollection):
+        summary["shards"] = collection.summary()
+    return summary
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--subject", required=True, help="Subject tag used in ingestion (e.g., science)")
-    ap.add_argument("--topic", required=True, help="Topic to generate questions about")
-    ap.add_argument("--qtype", choices=["mcq","tf"], default="mcq")
-    ap.add_argument("--difficulty", choices=["easy","medium","hard"], default="medium")
-    ap.add_argument("--bloom_level", choices=["remember","understand","apply","analyze","evaluate","create"], default="understand")
+    ap.add_argument("--subject", default=None, help="Subject tag used in ingestion (e.g., science)")
+    ap.add_argument("--topic", default=None, help="Topic to generate questions about")
+    ap.add_argument("--qtype", choices=QTYPES, default="mcq")
+    ap.add_argument("--difficulty", choices=DIFFICULTIES, default="medium")
+    ap.add_argument("--bloom_level", choices=BLOOM_LEVELS, default="understand")
     ap.add_argument("--n", type=int, default=5, help="Number of questions to generate")
     ap.add_argument("--collection", default="exam_bank", help="Chroma collection name")
     ap.add_argument("--max_k", type=int, default=12, help="Max retrieved examples for style guidance")
     ap.add_argument("--prompt_path", default="prompts/qg_prompt.txt")
     ap.add_argument("--out", default=None, help="Output JSONL path; also creates CSV with same stem")
-    ap.add_argument("--use_cache", action="store_true", help="Use cache to reuse prior generations")    
+    ap.add_argument("--use_cache", action="store_true", help="Use cache to reuse prior generations")
+    ap.add_argument("--jobs", default=None, help="Batch mode: JSONL/CSV manifest of (subject, topic, qtype, difficulty, bloom_level, n[, out]) rows")
+    ap.add_argument("--concurrency", type=int, default=8, help="Max concurrent LLM calls in batch mode")
+    ap.add_argument("--semantic_cache", action="store_true", help="Also reuse cached sets for similar topics (same subject/qtype/difficulty/bloom)")
+    ap.add_argument("--mmr_lambda", type=float, default=None, help="Enable MMR diversification of retrieved examples (1.0 = pure relevance)")
+    ap.add_argument("--dup_threshold", type=float, default=0.95, help="With MMR: drop examples this similar to one already kept")
+    ap.add_argument("--retrieval_token_budget", type=int, default=0, help="Cap the retrieved examples block at this many tokens (0 = no cap)")
+    ap.add_argument("--dedup", action="store_true", help="Drop generated questions too similar to history (and the bank with --dedup_bank)")
+    ap.add_argument("--dedup_threshold", type=float, default=0.9, help="Cosine similarity at which a generated stem counts as a duplicate")
+    ap.add_argument("--dedup_bank", action="store_true", help="With --dedup: also compare against the ingested bank")
+    ap.add_argument("--dedup_bank_threshold", type=float, default=0.85,
+                    help="Cosine similarity for a bank duplicate; lower than --dedup_threshold because bank vectors "
+                         "embed the stem with its [subject:..] [topic:..] (source:..) tags")
+    ap.add_argument("--regenerate_dups", action="store_true", help="With --dedup: ask the LLM once more for the number of dropped questions")
+    ap.add_argument("--no_refill", action="store_true",
+                    help="Do not re-request questions lost to malformed/truncated JSON (by default only the missing count is asked for once)")
+    ap.add_argument("--snapshot", default=None, help="Retrieve from a snapshot directory written by export_index.py instead of Chroma")
+    ap.add_argument("--hybrid", action="store_true", help="Fuse BM25 (built by ingest.py --bm25) and vector retrieval with reciprocal rank fusion")
+    ap.add_argument("--stream", action="store_true", help="Stream the completion and write each question to the JSONL as soon as it is complete")
+    ap.add_argument("--semantic_threshold", type=float, default=0.9, help="Min cosine similarity between topics for a semantic cache hit")
+    ap.add_argument("--trace", nargs="?", const="outputs/traces.jsonl", default=None,
+                    help="Append a per-request span trace to this JSONL (default outputs/traces.jsonl; env TRACE_FILE)")
+    ap.add_argument("--parquet", action="store_true", help="Also write the question set as Parquet next to the JSONL/CSV")
+    ap.add_argument("--bank", nargs="?", const=BANK_DIR, default=None,
+                    help="Append new questions to the subject/topic/difficulty-partitioned Parquet bank (default outputs/bank); query it with bank.py")
     args = ap.parse_args()
+    if not args.jobs and (not args.subject or not args.topic):
+        ap.error("--subject and --topic are required unless --jobs is given")
+
+    if args.trace:
+        set_trace_file(args.trace)
+    with trace_request("generate", subject=args.subject, topic=args.topic, n=args.n, jobs=args.jobs,
+                       stream=args.stream, hybrid=args.hybrid):
+        run(args)
+
+def run(args):
+    collection = open_collection(args.collection, args.snapshot)
 
-    client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
-    collection = client.get_or_create_collection(args.collection)
+    bm25 = load_bm25(args.collection) if args.hybrid else None
+
+    if args.jobs:
+        jobs = load_jobs(args.jobs, vars(args))
+        summary = run_jobs(jobs, collection, load_template(args.prompt_path), max_k=args.max_k,
+                           use_cache=args.use_cache, concurrency=args.concurrency,
+                           semantic_threshold=args.semantic_threshold if args.semantic_cache else None,
+                           bm25=bm25, dedup_threshold=args.dedup_threshold if args.dedup else None,
+                           dedup_bank=args.dedup_bank, dedup_bank_threshold=args.dedup_bank_threshold,
+                           parquet=args.parquet, bank_dir=args.bank,
+                           refill=not args.no_refill,
+                           retrieval={"mmr_lambda": args.mmr_lambda, "dup_threshold": args.dup_threshold,
+                                      "token_budget": args.retrieval_token_budget})
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
 
     # ----- Cache check
     params = {
@@ -75,23 +541,28 @@ def main():
         "difficulty": args.difficulty, "bloom_level": args.bloom_level, "n": args.n
     }
     cache_key = cache_key_from_params(params)
-    if args.use_cache:
-        cache = cache_load()
-        if cache_key in cache:
-            print("Loaded from cache.")
-            records = cache[cache_key]
-            # Save also to outputs (JSONL/CSV) for convenience
-            out = args.out or f"outputs/{args.subject}_{args.topic}_{args.qtype}_{args.difficulty}_{args.bloom_level}_{args.n}.jsonl"
-            write_jsonl(records, out)
-            import pandas as pd
-            df = pd.DataFrame(records)
-            csv_path = out.replace(".jsonl",".csv")
-            os.makedirs("outputs", exist_ok=True)
-            df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-            return
+    records = cache_get(cache_key) if args.use_cache else None
+    if records is None and args.semantic_cache:
+        records = semantic_cache_get(params, cache_key, args.semantic_threshold)
+    if records is not None:
+        print("Loaded from cache.")
+        # Save also to outputs (JSONL/CSV) for convenience
+        save_outputs(records, args.out or default_out_path(params), parquet=args.parquet)
+        return
 
     # ----- Dynamic RAG
-    retrieved_block = dynamic_retrieve(collection, query=args.topic, subject=args.subject, max_k=args.max_k)
+    retrieval_stats = {}
+    if bm25 is not None:
+        retrieved_block = hybrid_retrieve(collection, bm25, args.topic, args.subject, max_k=args.max_k,
+                                          mmr_lambda=args.mmr_lambda, dup_threshold=args.dup_threshold,
+                                          token_budget=args.retrieval_token_budget, stats=retrieval_stats)
+    else:
+        retrieved_block = dynamic_retrieve(collection, query=args.topic, subject=args.subject, max_k=args.max_k,
+                                           mmr_lambda=args.mmr_lambda, dup_threshold=args.dup_threshold,
+                                           token_budget=args.retrieval_token_budget, stats=retrieval_stats)
+    if args.mmr_lambda is not None or args.retrieval_token_budget:
+        print(f"Retrieved examples: {retrieval_stats.get('examples_before', 0)} -> {retrieval_stats.get('examples_after', 0)}, "
+              f"prompt tokens saved: {retrieval_stats.get('tokens_saved', 0)}")
 
     # ----- History Context
     history_items = history_load(limit=20)
@@ -99,71 +570,70 @@ def main():
 
     # ----- Prompt (Context-Aware)
     prompt_template = load_template(args.prompt_path)
-    prompt = (
-        prompt_template
-        .replace("{{subject}}", args.subject)
-        .replace("{{topic}}", args.topic)
-        .replace("{{qtype}}", args.qtype)
-        .replace("{{difficulty}}", args.difficulty)
-        .replace("{{bloom_level}}", args.bloom_level)
-        .replace("{{n}}", str(args.n))
-        .replace("{{retrieved_block}}", retrieved_block)
-        .replace("{{history_block}}", history_block)
-    )
-
-    messages = [
-        {"role":"system","content":"You are a strict exam question generator that outputs pure JSON."},
-        {"role":"user","content": prompt}
-    ]
+    prompt = build_prompt(prompt_template, params, retrieved_block, history_block)
+    messages = build_messages(prompt)
 
-    result = chat_json(messages, max_tokens=2200, temperature=0.4)
-    questions = result.get("questions", [])
-    # Normalize TF options if necessary
-    norm = []
-    for q in questions:
-        if args.qtype == "tf":
-            q["options"] = ["True", "False"]
-            if str(q.get("answer_idx","0")) not in ["0","1",0,1]:
-                q["answer_idx"] = 0
-        # enforce bloom & difficulty in output
-        q["bloom_level"] = args.bloom_level
-        q["difficulty"] = args.difficulty
-        norm.append(q)
+    # ----- Post-generation dedup against history/bank
+    history_index = dup_filter = None
+    if args.dedup:
+        history_index, dup_filter = make_dup_filter(collection if args.dedup_bank else None, args.dedup_threshold,
+                                                    args.dedup_bank_threshold)
 
-    # Add metadata and save
-    records = []
-    for i, q in enumerate(norm):
-        rec = {
-            "id": f"gen-{args.subject}-{args.topic}-{args.bloom_level}-{i}",
-            "subject": args.subject,
-            "topic": args.topic,
-            "type": args.qtype,
-            "stem": q["stem"],
-            "options": q["options"],
-            "answer_idx": q["answer_idx"],
-            "explanation": q.get("explanation",""),
-            "bloom_level": q.get("bloom_level", args.bloom_level),
-            "difficulty": q.get("difficulty", args.difficulty)
-        }
-        records.append(rec)
+    out = args.out or default_out_path(params)
+    if args.stream:
+        records = []
+        t0 = time.perf_counter()
+        with JsonlWriter(out) as writer:
+            def emit(questions):
+                for q in questions:
+                    rec = to_records([q], params, start=len(records))[0]
+                    if not records:
+                        print(f"First question after {time.perf_counter() - t0:.2f}s")
+                    writer.write(rec)
+                    records.append(rec)
 
-    out = args.out or f"outputs/{args.subject}_{args.topic}_{args.qtype}_{args.difficulty}_{args.bloom_level}_{args.n}.jsonl"
-    write_jsonl(records, out)
-
-    # Also export CSV for convenience
-    os.makedirs("outputs", exist_ok=True)
-    df = pd.DataFrame(records)
-    csv_path = out.replace(".jsonl",".csv")
-    df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+            for q in chat_json_stream(messages, max_tokens=2200, temperature=0.4):
+                q = validate_questions([q], args.qtype)
+                if dup_filter is not None:
+                    q = dup_filter.check(q)
+                emit(q)
+            dups_only = dup_filter is not None and dup_filter.dropped and not args.regenerate_dups
+            if len(records) < args.n and not args.no_refill and not dups_only:
+                emit(regenerate_missing(prompt_template, params, retrieved_block, history_block,
+                                        dup_filter, records, args.n - len(records)))
+        print(f"All {len(records)} questions after {time.perf_counter() - t0:.2f}s")
+        csv_path = save_outputs(records, out, write_json=False, parquet=args.parquet, bank_dir=args.bank)
+    else:
+        result = chat_json(messages, max_tokens=2200, temperature=0.4)
+        questions = validate_questions(result.get("questions", []), args.qtype)
+        if len(questions) < args.n and not args.no_refill:
+            # Keep what parsed and validated; ask only for the shortfall instead of a full regeneration
+            questions += regenerate_missing(prompt_template, params, retrieved_block, history_block,
+                                            None, questions, args.n - len(questions))
+        if dup_filter is not None:
+            questions = dup_filter.check(questions)
+            if args.regenerate_dups and dup_filter.dropped and len(questions) < args.n:
+                questions += regenerate_missing(prompt_template, params, retrieved_block, history_block,
+                                                dup_filter, questions, args.n - len(questions))
+        records = to_records(questions, params)
+        # Also export CSV for convenience
+        csv_path = save_outputs(records, out, parquet=args.parquet, bank_dir=args.bank)
 
     # ----- Save to cache and history
-    cache = cache_load()
-    cache[cache_key] = records
-    cache_save(cache)
-    history_append(records)
+    cache_put(cache_key, records)
+    if args.semantic_cache:
+        semantic_put(cache_key, params, topic_vector(args.topic))
+    record_history(records, history_index)  # with --dedup the new stems are embedding-cache hits
+    if dup_filter is not None and dup_filter.dropped:
+        print(f"Dropped {len(dup_filter.dropped)} near-duplicate questions: "
+              + json.dumps(dup_filter.dropped, ensure_ascii=False))
 
     print(f"Saved {len(records)} questions to: {out}")
     print(f"CSV also saved to: {csv_path}")
+    salvage = salvage_stats.summary()
+    if salvage["repaired"] or salvage["unparseable"] or salvage["refills"] or salvage["valid"] < salvage["items"]:
+        print("JSON salvage: " + json.dumps(salvage, ensure_ascii=False))
+    print_shard_stats(collection)
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,14 @@
-import argparse, os, json
+import argparse, os, re, json, sys, time, hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import chromadb
 from chromadb.config import Settings
 
 from utils.io_jsonl import read_jsonl
-from utils.embedder import STEmbeddingFunction
+from utils.embedder import STEmbeddingFunction, EMBEDDING_NAME
+from utils.bm25 import BM25Index, index_path
+from utils.shards import SHARD_KEYS, ShardWriter, load_registry, save_registry
 
 load_dotenv()
 CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma")
@@ -17,32 +21,225 @@ def build_text(row):
     source = row.get("source","")
     return f"[subject:{subject}] [topic:{topic}] {stem} (source:{source})"
 
+_TEXT_TAGS = re.compile(r"^\[subject:[^\]]*\] \[topic:[^\]]*\] | \(source:[^)]*\)$")
+
+def stem_of(doc):
+    # Inverse of build_text: the bare stem, used for the BM25 index
+    return _TEXT_TAGS.sub("", doc)
+
+def build_meta(row):
+    return {
+        "subject": row.get("subject",""),
+        "topic": row.get("topic",""),
+        "type": row.get("type","mcq"),
+        "source": row.get("source","")
+    }
+
+def iter_records(path):
+    # "-" reads JSONL from stdin, e.g. piped from data/download_dataset.py --out -
+    for row in read_jsonl(path):
+        yield row["id"], build_text(row), build_meta(row)
+
+def iter_chunks(records, chunk_size):
+    """Group (id, document, metadata) records into lists of at most chunk_size rows."""
+    ids, docs, metas = [], [], []
+    for qid, doc, meta in records:
+        ids.append(qid)
+        docs.append(doc)
+        metas.append(meta)
+        if len(ids) >= chunk_size:
+            yield ids, docs, metas
+            ids, docs, metas = [], [], []
+    if ids:
+        yield ids, docs, metas
+
+# ----- Manifest sidecar (id -> content hash) for incremental re-ingestion
+def manifest_path(collection):
+    base = os.path.abspath(CHROMA_PATH).rstrip(os.sep)
+    return f"{base}_manifest_{collection}.json"
+
+def load_manifest(collection):
+    path = manifest_path(collection)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f).get("rows", {})
+            except Exception:
+                return {}
+    return {}
+
+def save_manifest(collection, rows):
+    path = manifest_path(collection)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"collection": collection, "model": EMBEDDING_NAME, "rows": rows}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def content_hash(doc, meta, model_name=EMBEDDING_NAME):
+    s = json.dumps({"text": doc, "meta": meta, "model": model_name}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+def record_hashes(records, into):
+    for qid, doc, meta in records:
+        into[qid] = content_hash(doc, meta)
+        yield qid, doc, meta
+
+def index_records(records, bm25):
+    """Pass records through while adding their stems to the sparse (BM25) index (if any)."""
+    if bm25 is None:
+        yield from records
+        return
+    for qid, doc, meta in records:
+        bm25.add(qid, stem_of(doc), meta.get("subject", ""))
+        yield qid, doc, meta
+
+def diff_records(records, old, new, stats):
+    """Yield only new or changed records; record every seen hash into `new`."""
+    for qid, doc, meta in records:
+        h = content_hash(doc, meta)
+        new[qid] = h
+        prev = old.get(qid)
+        if prev == h:
+            stats["unchanged"] += 1
+            continue
+        stats["added" if prev is None else "updated"] += 1
+        yield qid, doc, meta
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def save_shards(writer):
+    """Refresh per-shard row counts, persist the shard registry and print the shard sizes."""
+    counts = writer.refresh_counts()
+    save_registry(CHROMA_PATH, writer.registry)
+    print(f"Shards of '{writer.collection}' by {writer.shard_by}: "
+          + ", ".join(f"{key or '(none)'}={n}" for key, n in sorted(counts.items())))
+
+def ingest_streaming(col, emb_fn, records, chunk_size=1000, batch_size=64, workers=2):
+    """Read -> embed -> upsert pipeline.
+    Chunks are embedded on a thread pool while the main thread upserts the
+    previous chunk with precomputed embeddings. At most workers+1 chunks are
+    in flight, so memory stays bounded regardless of the input size.
+    """
+    total = 0
+    pending = deque()
+
+    def write(item):
+        ids, docs, metas, fut = item
+        col.upsert(ids=ids, documents=docs, metadatas=metas, embeddings=fut.result().tolist())
+        return len(ids)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for ids, docs, metas in iter_chunks(records, chunk_size):
+            fut = pool.submit(emb_fn.encode, docs, batch_size)
+            pending.append((ids, docs, metas, fut))
+            if len(pending) > workers:
+                total += write(pending.popleft())
+        while pending:
+            total += write(pending.popleft())
+    return total
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--input", required=True, help="Input JSONL file (unified schema)")
+    ap.add_argument("--input", required=True, help="Input JSONL file (unified schema), or - for stdin")
     ap.add_argument("--collection", default="exam_bank", help="Chroma collection name")
     ap.add_argument("--subject", default=None, help="Optional subject tag to store as metadata filter")
+    ap.add_argument("--stream", action="store_true", help="Streaming mode: bounded chunks, parallel embedding, overlapped upserts")
+    ap.add_argument("--chunk_size", type=int, default=1000, help="Rows per upsert chunk (streaming mode)")
+    ap.add_argument("--batch_size", type=int, default=64, help="Embedding batch size (streaming mode)")
+    ap.add_argument("--workers", type=int, default=2, help="Embedding worker threads (streaming mode)")
+    ap.add_argument("--incremental", action="store_true", help="Embed/upsert only rows whose content hash changed since the last run")
+    ap.add_argument("--delete_missing", action="store_true", help="With --incremental: delete ids that are absent from the input")
+    ap.add_argument("--bm25", action="store_true",
+                    help="Also build/update the BM25 index used by generate.py --hybrid (held in memory while ingesting)")
+    ap.add_argument("--shard_by", choices=SHARD_KEYS, default=None, help="Write one collection per subject/source value (kept once set)")
     args = ap.parse_args()
 
     os.makedirs(CHROMA_PATH, exist_ok=True)
     client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
     emb_fn = STEmbeddingFunction()
-    col = client.get_or_create_collection(name=args.collection, embedding_function=emb_fn, metadata={"hnsw:space":"cosine"})
+    registry = load_registry(CHROMA_PATH, args.collection)
+    shard_by = args.shard_by or (registry or {}).get("shard_by")
+    if shard_by:
+        col = ShardWriter(client, args.collection, shard_by, emb_fn, registry)
+    else:
+        col = client.get_or_create_collection(name=args.collection, embedding_function=emb_fn, metadata={"hnsw:space":"cosine"})
+
+    bm25_path = index_path(CHROMA_PATH, args.collection)
+    # The sparse index is opt-in: it is built in memory and pickled whole, which would undo the
+    # bounded memory of --stream on very large banks
+    bm25 = BM25Index.load(bm25_path) if args.bm25 else None
+    if bm25 is None and os.path.exists(bm25_path):
+        print(f"Note: {bm25_path} is not updated without --bm25 and may go stale.")
+    old_manifest = load_manifest(args.collection)
+    new_manifest = {}
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    if args.incremental:
+        records = iter_records(args.input)
+        full_bm25 = bm25 is not None and not os.path.exists(bm25_path)
+        if full_bm25:
+            # No sparse index yet (e.g. first --incremental run after an older ingest): index every
+            # input row, not only the changed ones, or BM25 would stay partial
+            records = index_records(records, bm25)
+        records = diff_records(records, old_manifest, new_manifest, stats)
+        if not full_bm25:
+            records = index_records(records, bm25)
+        ingest_streaming(col, emb_fn, records, chunk_size=args.chunk_size,
+                         batch_size=args.batch_size, workers=max(1, args.workers))
+        manifest = dict(old_manifest)
+        manifest.update(new_manifest)
+        if args.delete_missing:
+            missing = [qid for qid in old_manifest if qid not in new_manifest]
+            for i in range(0, len(missing), args.chunk_size):
+                col.delete(ids=missing[i:i+args.chunk_size])
+            for qid in missing:
+                manifest.pop(qid, None)
+                if bm25 is not None:
+                    bm25.remove(qid)
+            stats["deleted"] = len(missing)
+        save_manifest(args.collection, manifest)
+        if bm25 is not None:
+            bm25.save(bm25_path)
+        if shard_by:
+            save_shards(col)
+        print(f"Incremental ingest into '{args.collection}' at {CHROMA_PATH}: "
+              f"added={stats['added']} updated={stats['updated']} unchanged={stats['unchanged']} deleted={stats['deleted']}")
+        return
+
+    if args.stream:
+        t0 = time.perf_counter()
+        records = index_records(record_hashes(iter_records(args.input), new_manifest), bm25)
+        n = ingest_streaming(col, emb_fn, records, chunk_size=args.chunk_size,
+                             batch_size=args.batch_size, workers=max(1, args.workers))
+        old_manifest.update(new_manifest)
+        save_manifest(args.collection, old_manifest)
+        if bm25 is not None:
+            bm25.save(bm25_path)
+        if shard_by:
+            save_shards(col)
+        elapsed = time.perf_counter() - t0
+        rss = peak_rss_mb()
+        print(f"Ingested {n} items into collection '{args.collection}' at {CHROMA_PATH}")
+        print(f"Throughput: {n / elapsed if elapsed else 0.0:.1f} rows/sec ({elapsed:.1f}s)"
+              + (f", peak RSS: {rss:.0f} MB" if rss is not None else ""))
+        if emb_fn.cache_stats():
+            print(f"Embedding cache: {emb_fn.cache_stats()}")
+        return
 
     ids = []
     docs = []
     metas = []
 
-    for row in read_jsonl(args.input):
-        qid = row["id"]
+    for qid, doc, meta in index_records(record_hashes(iter_records(args.input), new_manifest), bm25):
         ids.append(qid)
-        docs.append(build_text(row))
-        meta = {
-            "subject": row.get("subject",""),
-            "topic": row.get("topic",""),
-            "type": row.get("type","mcq"),
-            "source": row.get("source","")
-        }
+        docs.append(doc)
         metas.append(meta)
 
     # Chroma upsert
@@ -53,6 +250,12 @@ def main():
             documents=docs[i:i+step],
             metadatas=metas[i:i+step]
         )
+    old_manifest.update(new_manifest)
+    save_manifest(args.collection, old_manifest)
+    if bm25 is not None:
+        bm25.save(bm25_path)
+    if shard_by:
+        save_shards(col)
     print(f"Ingested {len(ids)} items into collection '{args.collection}' at {CHROMA_PATH}")
 
 if __name__ == "__main__":
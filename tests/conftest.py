@@ -0,0 +1,4 @@
+import os, sys
+
+# Tests import the top-level modules and utils/ the same way the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
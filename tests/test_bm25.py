@@ -0,0 +1,51 @@
+from utils.bm25 import BM25Index, rrf_fuse, tokenize
+
+def make_index():
+    idx = BM25Index()
+    idx.add("q1", "What is the chemical formula of water", "chemistry")
+    idx.add("q2", "Water boils at what temperature", "physics")
+    idx.add("q3", "Photosynthesis produces oxygen", "biology")
+    idx.add("q4", "Which enzyme splits water in photosystem II", "biology")
+    return idx
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    assert tokenize("What is the Formula of H2O?") == ["formula", "h2o"]
+
+def test_search_ranks_matching_documents_only():
+    hits = make_index().search("water formula", k=10)
+    assert [doc_id for doc_id, _ in hits][0] == "q1"
+    assert {doc_id for doc_id, _ in hits} == {"q1", "q2", "q4"}
+    assert all(score > 0 for _, score in hits)
+
+def test_search_subject_filter_matches_chroma_where():
+    hits = make_index().search("water", k=10, subject="biology")
+    assert [doc_id for doc_id, _ in hits] == ["q4"]
+    assert make_index().search("water", k=10, subject="history") == []
+
+def test_add_replaces_and_remove_forgets_a_document():
+    idx = make_index()
+    idx.add("q1", "Mitochondria are the powerhouse of the cell", "biology")
+    assert "q1" not in {d for d, _ in idx.search("formula")}
+    idx.remove("q3")
+    idx.remove("missing")  # no-op
+    assert len(idx) == 3
+    assert idx.search("photosynthesis oxygen") == []
+    assert idx.total_len == sum(idx.doc_len.values())
+
+def test_save_load_round_trip(tmp_path):
+    idx = make_index()
+    path = str(tmp_path / "bm25.pkl")
+    idx.save(path)
+    loaded = BM25Index.load(path)
+    assert len(loaded) == 4
+    assert loaded.search("water", k=3) == idx.search("water", k=3)
+    loaded.add("q5", "new water question")  # postings are a defaultdict again
+    assert BM25Index.load(str(tmp_path / "missing.pkl")).search("water") == []
+
+def test_rrf_fuse_rewards_agreement_between_rankings():
+    fused = rrf_fuse([["a", "b", "c"], ["b", "d"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "d", "c"]
+    assert fused[0][1] == 1 / 62 + 1 / 61  # summed over both rankings
+
+def test_rrf_fuse_limit():
+    assert [d for d, _ in rrf_fuse([["a", "b", "c"]], limit=2)] == ["a", "b"]
@@ -0,0 +1,114 @@
+import json, os
+
+import numpy as np
+
+from utils.dedup import HistoryIndex, DuplicateFilter
+
+VOCAB = ["water", "oxygen", "cell", "gravity", "enzyme", "atom"]
+
+def encode(texts):
+    """Deterministic bag-of-words vectors: stems sharing words are similar."""
+    out = np.zeros((len(texts), len(VOCAB)), dtype=np.float32)
+    for i, t in enumerate(texts):
+        for j, w in enumerate(VOCAB):
+            out[i, j] = t.lower().split().count(w)
+    return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+
+class Counting:
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded += list(texts)
+        return encode(texts)
+
+def append(path, *stems):
+    with open(path, "a", encoding="utf-8") as f:
+        for s in stems:
+            f.write(json.dumps({"stem": s}) + "\n")
+
+def make_index(tmp_path, enc):
+    return HistoryIndex(enc, path=str(tmp_path / "emb.f32"), meta_path=str(tmp_path / "emb.json"),
+                        history_path=str(tmp_path / "history.jsonl"))
+
+def test_sync_only_encodes_new_lines(tmp_path):
+    enc = Counting()
+    hist = str(tmp_path / "history.jsonl")
+    append(hist, "water", "oxygen")
+    idx = make_index(tmp_path, enc)
+    assert idx.sync() == 2
+    append(hist, "cell")
+    assert make_index(tmp_path, enc).sync() == 1  # progress is persisted in the meta file
+    assert enc.encoded == ["water", "oxygen", "cell"]
+    assert make_index(tmp_path, enc).matrix.shape == (3, len(VOCAB))
+
+def test_sync_ignores_partial_last_line(tmp_path):
+    hist = str(tmp_path / "history.jsonl")
+    append(hist, "water")
+    with open(hist, "a", encoding="utf-8") as f:
+        f.write('{"stem": "oxy')
+    idx = make_index(tmp_path, Counting())
+    assert idx.sync() == 1
+    with open(hist, "a", encoding="utf-8") as f:
+        f.write('gen"}\n')
+    assert idx.sync() == 1
+
+def test_sync_follows_rotation_without_losing_lines(tmp_path):
+    enc = Counting()
+    hist = str(tmp_path / "history.jsonl")
+    append(hist, "water")
+    idx = make_index(tmp_path, enc)
+    idx.sync()
+    append(hist, "oxygen")  # written before the rotation, never synced
+    os.replace(hist, hist + ".1")
+    append(hist, "cell")
+    assert idx.sync() == 2
+    assert enc.encoded == ["water", "oxygen", "cell"]
+    assert idx.sync() == 0
+
+def test_sync_restarts_after_truncation(tmp_path):
+    enc = Counting()
+    hist = str(tmp_path / "history.jsonl")
+    append(hist, "water oxygen cell")
+    idx = make_index(tmp_path, enc)
+    idx.sync()
+    open(hist, "w").close()
+    append(hist, "atom")
+    assert idx.sync() == 1
+    assert enc.encoded[-1] == "atom"
+
+def test_sync_drops_rows_left_by_a_crashed_sync(tmp_path):
+    hist = str(tmp_path / "history.jsonl")
+    append(hist, "water")
+    idx = make_index(tmp_path, encode)
+    idx.sync()
+    with open(idx.path, "ab") as f:
+        f.write(np.ones(len(VOCAB), dtype=np.float32).tobytes())  # written, never recorded in meta
+    append(hist, "cell")
+    idx.sync()
+    assert os.path.getsize(idx.path) == 2 * len(VOCAB) * 4
+    assert np.allclose(idx.matrix[1], encode(["cell"])[0])
+
+class FakeBank:
+    def __init__(self, vecs):
+        self.vecs = np.asarray(vecs, dtype=np.float32)
+
+    def query(self, query_embeddings, n_results=1, include=()):
+        sims = np.asarray(query_embeddings) @ self.vecs.T
+        return {"distances": [[1.0 - float(s.max())] for s in sims]}
+
+def test_duplicate_filter_history_bank_and_batch(tmp_path):
+    hist = str(tmp_path / "history.jsonl")
+    append(hist, "water")
+    idx = make_index(tmp_path, encode)
+    idx.sync()
+    bank = FakeBank(encode(["gravity atom"]))
+    f = DuplicateFilter(encode, idx, bank, threshold=0.9, bank_threshold=0.7)
+    kept = f.check([{"stem": "water"}, {"stem": "gravity"}, {"stem": "cell"}, {"stem": "cell"}, {"stem": "enzyme"}])
+    assert [q["stem"] for q in kept] == ["cell", "enzyme"]
+    assert [(d["stem"], d["reason"]) for d in f.dropped] == [("water", "history"), ("gravity", "bank"), ("cell", "batch")]
+
+def test_bank_threshold_is_separate_from_history_threshold(tmp_path):
+    bank = FakeBank(encode(["gravity atom"]))  # cosine to "gravity" is ~0.71
+    assert DuplicateFilter(encode, None, bank, threshold=0.9).check(["gravity"]) == ["gravity"]
+    assert DuplicateFilter(encode, None, bank, threshold=0.9, bank_threshold=0.7).check(["gravity"]) == []
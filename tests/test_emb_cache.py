@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from utils.emb_cache import EmbeddingCache
+
+class FakeModel:
+    """Deterministic 4-d vectors; records every text the model is asked to encode."""
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen += list(texts)
+        return np.array([[len(t), t.count(" "), ord(t[0]), 1.0] for t in texts], dtype=np.float32)
+
+def test_misses_encode_once_and_hits_come_from_memory_then_disk(tmp_path):
+    model = FakeModel()
+    cache = EmbeddingCache("org/model", cache_dir=str(tmp_path))
+    first = cache.encode(["water", "  water ", "oxygen"], model)
+    assert model.seen == ["water", "oxygen"]  # whitespace variants share one key
+    assert np.array_equal(first[0], first[1])
+    assert cache.stats()["misses"] == 3
+    cache.encode(["oxygen"], model)
+    assert cache.hits_mem == 1
+    fresh = EmbeddingCache("org/model", cache_dir=str(tmp_path))
+    again = fresh.encode(["water", "oxygen", "cell"], model)
+    assert (fresh.hits_disk, fresh.misses) == (2, 1)
+    assert np.array_equal(again[:2], first[[0, 2]])
+    assert model.seen == ["water", "oxygen", "cell"]
+    assert fresh.stats()["stored"] == 3
+
+def test_model_sees_the_original_text(tmp_path):
+    model = FakeModel()
+    EmbeddingCache("m", cache_dir=str(tmp_path)).encode(["  two   spaces "], model)
+    assert model.seen == ["  two   spaces "]
+
+def test_models_do_not_share_entries(tmp_path):
+    EmbeddingCache("a", cache_dir=str(tmp_path)).encode(["water"], FakeModel())
+    other = EmbeddingCache("b", cache_dir=str(tmp_path))
+    other.encode(["water"], FakeModel())
+    assert other.misses == 1
+
+def test_empty_input(tmp_path):
+    assert EmbeddingCache("m", cache_dir=str(tmp_path)).encode([], FakeModel()).shape == (0, 0)
+
+def test_torn_tail_is_cut_before_the_next_append(tmp_path):
+    model = FakeModel()
+    cache = EmbeddingCache("m", cache_dir=str(tmp_path))
+    expected = cache.encode(["water", "oxygen"], model)
+    with open(cache.data_path, "ab") as f:
+        f.write(b"\x01" * 7)  # partial record left by a crashed writer
+    recovered = EmbeddingCache("m", cache_dir=str(tmp_path))
+    assert recovered.stats()["stored"] == 2
+    cell = recovered.encode(["cell"], model)
+    assert os.path.getsize(cache.data_path) % recovered._dtype.itemsize == 0
+    reread = EmbeddingCache("m", cache_dir=str(tmp_path))
+    got = reread.encode(["water", "oxygen", "cell"], model)
+    assert reread.hits_disk == 3 and reread.misses == 0
+    assert np.array_equal(got, np.vstack([expected, cell]))
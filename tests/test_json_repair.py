@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from utils.json_repair import close_truncated, parse_json, validate_question, validate_questions, SalvageStats
+
+MCQ = {"stem": "Which gas do plants absorb?", "options": ["O2", "CO2", "N2", "H2"], "answer_idx": 1}
+
+# ----- close_truncated
+def test_close_truncated_complete_document_is_unchanged():
+    text = json.dumps({"questions": [MCQ]})
+    assert close_truncated(text) == text
+
+def test_close_truncated_cuts_to_last_complete_value_and_closes_brackets():
+    text = json.dumps({"questions": [MCQ, MCQ]})[:-30]
+    # The cut-off object keeps its complete fields; validation decides whether it is usable
+    assert json.loads(close_truncated(text)) == {"questions": [MCQ, {"stem": MCQ["stem"], "options": ["O2", "CO2"]}]}
+
+def test_close_truncated_keeps_scalars_before_a_comma():
+    assert json.loads(close_truncated('{"winner": "rag", "rag_score": 4, "norag_sc')) == {"winner": "rag", "rag_score": 4}
+
+def test_close_truncated_ignores_brackets_inside_strings():
+    text = '{"questions": [{"stem": "f(x) = [a, b}", "answer_idx": 0}, {"stem": "cut'
+    assert json.loads(close_truncated(text)) == {"questions": [{"stem": "f(x) = [a, b}", "answer_idx": 0}]}
+
+# ----- parse_json
+def test_parse_json_valid_is_not_marked_repaired():
+    assert parse_json(json.dumps({"questions": [MCQ]})) == ({"questions": [MCQ]}, False)
+
+def test_parse_json_strips_fences_prose_and_trailing_commas():
+    content = 'Here you go:\n```json\n{"questions": [%s,]}\n```' % json.dumps(MCQ)
+    assert parse_json(content) == ({"questions": [MCQ]}, True)
+
+def test_parse_json_repairs_truncated_array():
+    content = json.dumps({"questions": [MCQ, MCQ, MCQ]})[:-25]
+    data, repaired = parse_json(content)
+    assert repaired and len(data["questions"]) == 3
+    assert validate_questions(data["questions"], "mcq", stats=None) == [MCQ, MCQ]
+
+@pytest.mark.parametrize("content", ["no json here", "", None])
+def test_parse_json_unrecoverable(content):
+    assert parse_json(content) == (None, True)
+
+# ----- validate_question
+def test_mcq_valid_and_cleaned():
+    q, reason = validate_question(dict(MCQ, stem="  Which gas?  ", answer_idx="B"), "mcq")
+    assert reason is None and q["stem"] == "Which gas?" and q["answer_idx"] == 1
+
+@pytest.mark.parametrize("patch, reason", [
+    ({"stem": ""}, "missing stem"),
+    ({"options": ["a", "b", "c"]}, "mcq needs 4 options"),
+    ({"options": ["a", "", "c", "d"]}, "empty option"),
+    ({"answer_idx": 4}, "answer_idx out of range"),
+    ({"answer_idx": 1.7}, "answer_idx out of range"),
+    ({"answer_idx": True}, "answer_idx out of range"),
+])
+def test_mcq_rejected(patch, reason):
+    assert validate_question(dict(MCQ, **patch), "mcq") == (None, reason)
+
+def test_mcq_whole_float_index_is_accepted():
+    assert validate_question(dict(MCQ, answer_idx=2.0), "mcq")[0]["answer_idx"] == 2
+
+@pytest.mark.parametrize("answer, expected", [(0, 0), ("1", 1), (True, 0), ("false", 1), ("True", 0)])
+def test_tf_answers_normalised(answer, expected):
+    q, reason = validate_question({"stem": "Ice is cold", "options": ["yes", "no"], "answer_idx": answer}, "tf")
+    assert reason is None and q["options"] == ["True", "False"] and q["answer_idx"] == expected
+
+@pytest.mark.parametrize("q", [{"stem": "Ice is hot"}, {"stem": "Ice is hot", "answer_idx": 2},
+                               {"stem": "Ice is hot", "answer_idx": "maybe"}, {"stem": "Ice is hot", "answer_idx": 0.5}])
+def test_tf_missing_or_invalid_answer_rejected(q):
+    assert validate_question(q, "tf") == (None, "tf answer missing or invalid")
+
+def test_validate_questions_counts_rejections():
+    stats = SalvageStats()
+    kept = validate_questions([MCQ, {"stem": "x"}, "junk"], "mcq", stats)
+    assert kept == [MCQ]
+    summary = stats.summary()
+    assert (summary["items"], summary["valid"]) == (3, 1)
+    assert summary["rejected"] == {"mcq needs 4 options": 1, "not an object": 1}
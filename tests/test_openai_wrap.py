@@ -0,0 +1,102 @@
+import asyncio, json, os, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")  # checked when the module is imported
+from utils import openai_wrap
+
+OK_BODY = {
+    "id": "c1", "object": "chat.completion", "created": 0, "model": "m",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": json.dumps({"questions": [{"stem": "s"}]})}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
+
+class FakeServer:
+    """OpenAI-compatible endpoint answering from a script of (status, headers) replies, then 200."""
+    def __init__(self):
+        self.script, self.requests = [], 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["content-length"]))
+                server.requests += 1
+                status, headers = server.script.pop(0) if server.script else (200, {})
+                body = json.dumps(OK_BODY if status == 200 else {"error": {"message": f"status {status}"}}).encode()
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/v1"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def server(monkeypatch):
+    srv = FakeServer()
+    monkeypatch.setattr(openai_wrap, "BASE_URL", srv.url)
+    monkeypatch.setattr(openai_wrap, "_async_clients", {})
+    monkeypatch.setattr(openai_wrap, "_limiters", {})
+    openai_wrap.stats.reset()
+    yield srv
+    srv.httpd.shutdown()
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays requested by achat_json (the sleeps themselves are skipped)."""
+    delays, real_sleep = [], asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(openai_wrap.asyncio, "sleep", fake_sleep)
+    return delays
+
+def call(**kw):
+    return asyncio.run(openai_wrap.achat_json([{"role": "user", "content": "hi"}], **kw))
+
+def test_retry_after_is_honoured(server, sleeps):
+    server.script = [(429, {"retry-after": "2"})]
+    assert call(max_retries=2)["questions"] == [{"stem": "s"}]
+    assert sleeps == [2.0]
+    assert server.requests == 2
+    assert openai_wrap.stats.summary()["retries"] == 1
+
+def test_retry_after_is_capped_at_max_delay(server, sleeps):
+    server.script = [(429, {"retry-after": "3600"}), (429, {"retry-after": "-5"})]
+    call(max_retries=3, max_delay=1.5)
+    assert sleeps == [1.5, 0.0]
+
+def test_backoff_without_retry_after(server, sleeps):
+    server.script = [(503, {}), (500, {}), (429, {})]
+    call(max_retries=3, base_delay=1.0, max_delay=3.0)
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= min(3.0, 1.0 * 2 ** attempt)
+
+def test_gives_up_after_max_retries(server, sleeps):
+    server.script = [(429, {"retry-after": "0"})] * 3
+    with pytest.raises(openai.RateLimitError):
+        call(max_retries=2)
+    assert server.requests == 3
+    assert openai_wrap.stats.summary()["errors"] == 3
+
+def test_client_errors_are_not_retried(server, sleeps):
+    server.script = [(400, {})]
+    with pytest.raises(openai.BadRequestError):
+        call(max_retries=3)
+    assert server.requests == 1
+    assert sleeps == []
@@ -0,0 +1,111 @@
+import numpy as np
+
+from utils.shards import ShardWriter, ShardedCollection, load_registry, save_registry, shard_name
+
+class FakeCollection:
+    """The slice of the Chroma collection API the shard classes use."""
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        for i, d, m, e in zip(ids, documents, metadatas, embeddings or [None] * len(ids)):
+            self.rows[i] = (d, m, np.asarray(e, dtype=np.float32))
+
+    def delete(self, ids):
+        for i in ids:
+            self.rows.pop(i, None)
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, ids=None, include=()):
+        keys = [i for i in (ids if ids is not None else self.rows) if i in self.rows]
+        return {"ids": keys, "documents": [self.rows[i][0] for i in keys], "metadatas": [self.rows[i][1] for i in keys]}
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None, include=()):
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for q in query_embeddings:
+            hits = sorted((1.0 - float(e @ np.asarray(q)), i) for i, (d, m, e) in self.rows.items()
+                          if all(m.get(k) == v for k, v in (where or {}).items()))[:n_results]
+            out["ids"].append([i for _, i in hits])
+            out["distances"].append([d for d, _ in hits])
+            out["documents"].append([self.rows[i][0] for _, i in hits])
+            out["metadatas"].append([self.rows[i][1] for _, i in hits])
+        return out
+
+class FakeClient:
+    def __init__(self):
+        self.collections = {}
+
+    def get_or_create_collection(self, name, **kwargs):
+        assert 3 <= len(name) <= 63, name
+        return self.collections.setdefault(name, FakeCollection())
+
+def unit(*v):
+    v = np.asarray(v, dtype=np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+def embed(texts):
+    return [unit(1, 0) for _ in texts]
+
+def ingest(client, rows, registry=None):
+    writer = ShardWriter(client, "exam_bank", "subject", embed, registry)
+    writer.upsert(ids=[r[0] for r in rows], documents=[r[1] for r in rows],
+                  metadatas=[{"subject": r[2], "topic": r[3]} for r in rows], embeddings=[r[4] for r in rows])
+    writer.refresh_counts()
+    return writer
+
+ROWS = [
+    ("b1", "cell", "bio", "t1", unit(1, 0)),
+    ("b2", "enzyme", "bio", "t2", unit(0.6, 0.8)),
+    ("c1", "atom", "chem", "t1", unit(0.9, 0.1)),
+    ("c2", "bond", "chem", "t2", unit(0, 1)),
+]
+
+def test_shard_name_is_a_valid_chroma_name():
+    assert shard_name("exam_bank", "science") == "exam_bank__science"
+    odd = shard_name("exam_bank", "Life Science/Bio")
+    assert odd.startswith("exam_bank__Life-Science-Bio-") and odd != shard_name("exam_bank", "Life Science Bio")
+    assert shard_name("exam_bank", "") == f"exam_bank__none-{shard_name('exam_bank', '')[-8:]}"
+    for collection, key in [("a" * 60, "science"), ("exam_bank", "x" * 200), ("b" * 70, "é é")]:
+        name = shard_name(collection, key)
+        assert len(name) <= 63 and name[-1].isalnum()
+    assert shard_name("a" * 60, "one") != shard_name("a" * 60, "two")
+
+def test_writer_routes_rows_and_evicts_moved_ones():
+    client = FakeClient()
+    writer = ingest(client, ROWS)
+    assert writer.refresh_counts() == {"bio": 2, "chem": 2}
+    ingest(client, [("b1", "cell", "chem", "t1", unit(1, 0))], writer.registry)  # subject changed
+    assert writer.refresh_counts() == {"bio": 1, "chem": 3}
+
+def test_registry_round_trip(tmp_path):
+    writer = ingest(FakeClient(), ROWS)
+    save_registry(str(tmp_path / "chroma"), writer.registry)
+    assert load_registry(str(tmp_path / "chroma"), "exam_bank")["shards"]["bio"]["count"] == 2
+    assert load_registry(str(tmp_path / "chroma"), "other") is None
+
+def test_sharded_query_merges_by_distance_and_routes_on_shard_key():
+    client = FakeClient()
+    registry = ingest(client, ROWS).registry
+    col = ShardedCollection(client, registry, embed)
+    res = col.query(query_embeddings=[unit(1, 0)], n_results=3)
+    assert res["ids"] == [["b1", "c1", "b2"]]
+    assert res["distances"][0] == sorted(res["distances"][0])
+    assert res["embeddings"] is None
+    routed = col.query(query_embeddings=[unit(1, 0)], n_results=3, where={"subject": "chem", "topic": "t2"})
+    assert routed["ids"] == [["c2"]]
+    assert col.query(query_embeddings=[unit(1, 0)], where={"subject": "art"})["ids"] == [[]]
+    assert col.latencies.keys() == {"bio", "chem"}
+
+def test_sharded_query_embeds_texts_once_for_fan_out():
+    client = FakeClient()
+    col = ShardedCollection(client, ingest(client, ROWS).registry, embed)
+    assert col.query(query_texts=["anything"], n_results=1)["ids"] == [["b1"]]
+
+def test_sharded_get_and_count():
+    client = FakeClient()
+    col = ShardedCollection(client, ingest(client, ROWS).registry, embed)
+    got = col.get(ids=["c2", "missing", "b1"])
+    assert got["ids"] == ["c2", "b1"] and got["documents"] == ["bond", "cell"]
+    assert col.count() == 4
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from utils import snapshot
+from utils.snapshot import SnapshotRetriever, write_snapshot
+
+def make_rows(n=40, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    embs = rng.normal(size=(n, dim)).astype(np.float32)
+    ids = [f"q{i}" for i in range(n)]
+    docs = [f"stem {i}" for i in range(n)]
+    metas = [{"subject": "bio" if i % 2 else "chem", "topic": "", "type": "mcq", "source": "s"} for i in range(n)]
+    return ids, docs, metas, embs
+
+def exact_top(embs, q, k):
+    X = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+    sims = X @ (q / np.linalg.norm(q))
+    return list(np.argsort(-sims)[:k]), sims
+
+@pytest.mark.parametrize("quantize", [None, "int8"])
+def test_round_trip_matches_exact_search(tmp_path, quantize):
+    ids, docs, metas, embs = make_rows()
+    header = write_snapshot(str(tmp_path), ids, docs, metas, embs, quantize=quantize)
+    assert (header["n"], header["dim"], header["quantize"]) == (40, 16, quantize)
+    snap = SnapshotRetriever(str(tmp_path))
+    q = embs[3] + 0.1
+    res = snap.query(query_embeddings=[q], n_results=5, include=["documents", "metadatas", "distances", "embeddings"])
+    top, sims = exact_top(embs, q, 5)
+    assert res["ids"][0][0] == "q3"
+    tol = 1e-5 if quantize is None else 2e-2
+    if quantize is None:
+        assert res["ids"][0] == [ids[i] for i in top]
+    assert np.allclose(res["distances"][0], [1 - sims[i] for i in top], atol=tol)
+    assert res["documents"][0][0] == "stem 3" and res["metadatas"][0][0]["subject"] == "bio"
+    unit = embs[3] / np.linalg.norm(embs[3])
+    assert np.allclose(res["embeddings"][0][0], unit, atol=tol)
+
+def test_where_filters_on_metadata_and_unknown_values(tmp_path):
+    ids, docs, metas, embs = make_rows()
+    write_snapshot(str(tmp_path), ids, docs, metas, embs)
+    snap = SnapshotRetriever(str(tmp_path))
+    res = snap.query(query_embeddings=[embs[3]], n_results=50, where={"subject": "chem"})
+    assert len(res["ids"][0]) == 20 and "q3" not in res["ids"][0]
+    assert all(m["subject"] == "chem" for m in res["metadatas"][0])
+    assert snap.query(query_embeddings=[embs[3]], n_results=5, where={"subject": "art"})["ids"] == [[]]
+    assert res["embeddings"] is None
+
+def test_scores_are_computed_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SCORE_CHUNK", 7)  # several chunks plus a ragged last one
+    ids, docs, metas, embs = make_rows()
+    write_snapshot(str(tmp_path), ids, docs, metas, embs, quantize="int8")
+    res = SnapshotRetriever(str(tmp_path)).query(query_embeddings=[embs[39]], n_results=1)
+    assert res["ids"] == [["q39"]]
+
+def test_get_by_ids(tmp_path):
+    ids, docs, metas, embs = make_rows(n=5)
+    write_snapshot(str(tmp_path), ids, docs, metas, embs)
+    got = SnapshotRetriever(str(tmp_path)).get(ids=["q4", "missing", "q0"])
+    assert got["ids"] == ["q4", "q0"] and got["documents"] == ["stem 4", "stem 0"]
+
+def test_empty_collection_is_rejected(tmp_path):
+    out = tmp_path / "snap"
+    with pytest.raises(ValueError, match="nothing to snapshot"):
+        write_snapshot(str(out), [], [], [], [])
+    assert not out.exists()
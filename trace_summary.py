@@ -0,0 +1,69 @@
+"""
+Summarise a span trace file written with generate.py --trace (or TRACE_FILE=...).
+
+    python trace_summary.py outputs/traces.jsonl
+    python trace_summary.py outputs/traces.jsonl --name app --price_prompt 0.15 --price_completion 0.6
+
+Prints p50/p95/p99 per stage (span name), each stage's share of total request
+time, and token usage (plus cost when prices per 1M tokens are given).
+"""
+import argparse, json
+from collections import defaultdict
+
+from utils.io_jsonl import read_jsonl
+
+def pct(values, p):
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("path", nargs="?", default="outputs/traces.jsonl")
+    ap.add_argument("--name", default=None, help="Only traces with this request name (generate / app)")
+    ap.add_argument("--last", type=int, default=None, help="Only the last N traces")
+    ap.add_argument("--price_prompt", type=float, default=0.0, help="USD per 1M prompt tokens")
+    ap.add_argument("--price_completion", type=float, default=0.0, help="USD per 1M completion tokens")
+    ap.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = ap.parse_args()
+
+    traces = [t for t in read_jsonl(args.path) if args.name is None or t.get("name") == args.name]
+    if args.last:
+        traces = traces[-args.last:]
+    if not traces:
+        print(f"No traces in {args.path}")
+        return
+
+    stages = defaultdict(list)
+    for t in traces:
+        stages["request"].append(t["duration_ms"])
+        for s in t.get("spans", []):
+            stages[s["name"]].append(s["duration_ms"])
+    total_request = sum(stages["request"])
+    rows = {}
+    for name, vals in stages.items():
+        vals.sort()
+        rows[name] = {
+            "count": len(vals), "p50_ms": round(pct(vals, 50), 2), "p95_ms": round(pct(vals, 95), 2),
+            "p99_ms": round(pct(vals, 99), 2), "total_ms": round(sum(vals), 1),
+            "share": round(sum(vals) / total_request, 3) if total_request else 0.0,
+        }
+    prompt = sum(t.get("tokens", {}).get("prompt", 0) for t in traces)
+    completion = sum(t.get("tokens", {}).get("completion", 0) for t in traces)
+    tokens = {
+        "prompt": prompt, "completion": completion,
+        "per_request": round((prompt + completion) / len(traces), 1),
+        "cost_usd": round((prompt * args.price_prompt + completion * args.price_completion) / 1e6, 6),
+    }
+    if args.json:
+        print(json.dumps({"traces": len(traces), "stages": rows, "tokens": tokens}, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{len(traces)} traces from {args.path}")
+    print(f"{'stage':<18} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'total_ms':>10} {'share':>6}")
+    for name, r in sorted(rows.items(), key=lambda kv: (kv[0] != "request", -kv[1]["total_ms"])):
+        print(f"{name:<18} {r['count']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+              f"{r['total_ms']:>10.1f} {r['share']:>6.1%}")
+    print(f"tokens: prompt={prompt} completion={completion} per_request={tokens['per_request']}"
+          + (f" cost=${tokens['cost_usd']:.4f}" if args.price_prompt or args.price_completion else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os, re, math, pickle, heapq
+from collections import Counter, defaultdict
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset("""a an and are as at be by do does for from has have how in is it its of on or that the
+these this those to was were what when where which who why will with""".split())
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+def index_path(chroma_path, collection):
+    base = os.path.abspath(chroma_path).rstrip(os.sep)
+    return f"{base}_bm25_{collection}.pkl"
+
+class BM25Index:
+    """Okapi BM25 over question stems with incremental add/remove.
+
+    Postings map term -> {doc id: term frequency}; per-document lengths and
+    subjects are kept so scores can be restricted to a subject the same way
+    Chroma's `where={"subject": ...}` filter does.
+    """
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1, self.b = k1, b
+        self.postings = defaultdict(dict)
+        self.doc_len = {}
+        self.doc_terms = {}
+        self.doc_subject = {}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, doc_id, text, subject=""):
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        tf = Counter(tokenize(text))
+        for term, c in tf.items():
+            self.postings[term][doc_id] = c
+        n = sum(tf.values())
+        self.doc_len[doc_id] = n
+        self.doc_terms[doc_id] = tuple(tf)
+        self.doc_subject[doc_id] = subject
+        self.total_len += n
+
+    def remove(self, doc_id):
+        if doc_id not in self.doc_len:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            plist = self.postings.get(term)
+            if plist is not None:
+                plist.pop(doc_id, None)
+                if not plist:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id)
+        self.doc_subject.pop(doc_id, None)
+
+    def search(self, query, k=10, subject=None):
+        """Return [(doc_id, score)] best first."""
+        n_docs = len(self.doc_len)
+        if not n_docs:
+            return []
+        avgdl = self.total_len / n_docs
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for doc_id, tf in plist.items():
+                if subject and self.doc_subject.get(doc_id) != subject:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self.__dict__ | {"postings": dict(self.postings)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        idx = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            state["postings"] = defaultdict(dict, state["postings"])
+            idx.__dict__.update(state)
+        return idx
+
+def rrf_fuse(rankings, k=60, limit=None):
+    """Reciprocal rank fusion of several ranked id lists -> [(id, score)] best first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    fused = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    return fused[:limit] if limit else fused
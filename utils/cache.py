@@ -1,7 +1,17 @@
-import os, json, hashlib
+import os, sys, json, hashlib, sqlite3, threading, time
+import numpy as np
 
-CACHE_FILE = "outputs/cache.json"
+from utils.trace import traced
+from utils.io_jsonl import loads as json_loads
+
+CACHE_FILE = "outputs/cache.json"  # legacy monolithic cache, migrated once into CACHE_DB
+CACHE_DB = "outputs/cache.sqlite3"
 HISTORY_FILE = "outputs/history.jsonl"
+SEMANTIC_LOG = "outputs/semantic_cache.jsonl"
+CACHE_TTL = float(os.getenv("CACHE_TTL_SECONDS", "0"))  # 0 = never expire
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "0"))  # 0 = unbounded
+
+_local = threading.local()
 
 def _ensure_dirs():
     os.makedirs("outputs", exist_ok=True)
@@ -20,34 +30,286 @@ def _save_json(path, obj):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
 
+# ----- Generation cache: SQLite in WAL mode (O(1) keyed reads/writes, safe concurrent writers)
+def _db():
+    # One connection per thread; Streamlit sessions and worker threads each get their own
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        _ensure_dirs()
+        conn = sqlite3.connect(CACHE_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, records TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_accessed ON generations(accessed)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic ("
+            "key TEXT PRIMARY KEY, subject TEXT, qtype TEXT, difficulty TEXT, bloom_level TEXT, "
+            "n INTEGER, topic TEXT, vec BLOB NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_semantic_bucket ON semantic(subject, qtype, difficulty, bloom_level)")
+        _local.conn = conn
+        _migrate_json(conn)
+    return conn
+
+def _migrate_json(conn):
+    """Import the legacy cache.json once. The file is left in place (it may be tracked);
+    the meta flag, checked inside the write transaction, keeps concurrent first
+    connections from importing it twice. A file that does not parse is not marked as
+    migrated, so the import is retried by the next connection."""
+    if not os.path.exists(CACHE_FILE):
+        return
+    if conn.execute("SELECT 1 FROM meta WHERE key='migrated_json'").fetchone():
+        return
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        print(f"{CACHE_FILE}: not migrated, could not be read ({e}); will retry on next start", file=sys.stderr)
+        return
+    if not isinstance(legacy, dict):
+        print(f"{CACHE_FILE}: not migrated, expected a JSON object", file=sys.stderr)
+        return
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not conn.execute("SELECT 1 FROM meta WHERE key='migrated_json'").fetchone():
+            conn.executemany(
+                "INSERT OR IGNORE INTO generations(key, records, created, accessed) VALUES (?,?,?,?)",
+                [(k, json.dumps(v, ensure_ascii=False), now, now) for k, v in legacy.items()],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('migrated_json', ?)", (str(len(legacy)),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+@traced("cache.get")
+def cache_get(key, ttl=None):
+    ttl = CACHE_TTL if ttl is None else ttl
+    conn = _db()
+    row = conn.execute("SELECT records, created FROM generations WHERE key=?", (key,)).fetchone()
+    if row is None:
+        return None
+    now = time.time()
+    if ttl and row[1] < now - ttl:
+        conn.execute("DELETE FROM generations WHERE key=?", (key,))
+        return None
+    conn.execute("UPDATE generations SET accessed=? WHERE key=?", (now, key))
+    return json.loads(row[0])
+
+@traced("cache.put")
+def cache_put(key, records, max_entries=None):
+    now = time.time()
+    conn = _db()
+    conn.execute(
+        "INSERT OR REPLACE INTO generations(key, records, created, accessed) VALUES (?,?,?,?)",
+        (key, json.dumps(records, ensure_ascii=False), now, now),
+    )
+    max_entries = CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    if max_entries:
+        cache_evict(max_entries=max_entries)
+
+def cache_evict(ttl=None, max_entries=None):
+    """Drop expired entries, then the least recently used ones beyond max_entries."""
+    ttl = CACHE_TTL if ttl is None else ttl
+    max_entries = CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    conn = _db()
+    removed = 0
+    if ttl:
+        removed += conn.execute("DELETE FROM generations WHERE created < ?", (time.time() - ttl,)).rowcount
+    if max_entries:
+        removed += conn.execute(
+            "DELETE FROM generations WHERE key IN ("
+            "SELECT key FROM generations ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (max_entries,),
+        ).rowcount
+    return removed
+
+# ----- Semantic tier: near-duplicate topics under the same subject/qtype/difficulty/bloom_level
+def semantic_put(key, params, topic_vec):
+    vec = np.asarray(topic_vec, dtype=np.float32)
+    _db().execute(
+        "INSERT OR REPLACE INTO semantic(key, subject, qtype, difficulty, bloom_level, n, topic, vec) VALUES (?,?,?,?,?,?,?,?)",
+        (key, params["subject"], params["qtype"], params["difficulty"], params["bloom_level"],
+         int(params["n"]), params["topic"], vec.tobytes()),
+    )
+
+@traced("cache.semantic")
+def semantic_lookup(params, topic_vec, threshold=0.9):
+    """Find a cached set for a similar topic with at least params["n"] questions.
+    Returns (records[:n], similarity, matched_topic) or None. Every lookup is logged
+    to SEMANTIC_LOG so the threshold can be tuned against hit rate.
+    """
+    rows = _db().execute(
+        "SELECT key, topic, n, vec FROM semantic WHERE subject=? AND qtype=? AND difficulty=? AND bloom_level=? AND n>=?",
+        (params["subject"], params["qtype"], params["difficulty"], params["bloom_level"], int(params["n"])),
+    ).fetchall()
+    hit, best_sim, best = None, None, None
+    if rows:
+        q = np.asarray(topic_vec, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        mat = np.stack([np.frombuffer(r[3], dtype=np.float32) for r in rows])
+        sims = mat @ q / np.maximum(np.linalg.norm(mat, axis=1), 1e-12)
+        # Prefer the most similar topic; among ties, the smallest set that still covers n
+        order = sorted(range(len(rows)), key=lambda i: (-float(sims[i]), rows[i][2]))
+        best, best_sim = rows[order[0]], float(sims[order[0]])
+        # The exact-cache entry behind a candidate may have expired or been evicted:
+        # fall through to the next candidate above the threshold
+        for i in order:
+            if float(sims[i]) < threshold:
+                break
+            records = cache_get(rows[i][0])
+            if records is not None and len(records) >= int(params["n"]):
+                best, best_sim = rows[i], float(sims[i])
+                hit = (records[:int(params["n"])], best_sim, best[1])
+                break
+    _ensure_dirs()
+    with open(SEMANTIC_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "ts": time.time(), "params": params, "hit": hit is not None, "threshold": threshold,
+            "similarity": best_sim, "matched_topic": best[1] if best else None, "candidates": len(rows),
+        }, ensure_ascii=False) + "\n")
+    return hit
+
+@traced("cache.load")
 def cache_load():
-    return _load_json(CACHE_FILE, {})
+    # Whole-cache view kept for backwards compatibility; prefer cache_get
+    cutoff = time.time() - CACHE_TTL if CACHE_TTL else 0
+    rows = _db().execute("SELECT key, records FROM generations WHERE created >= ?", (cutoff,))
+    return {k: json.loads(v) for k, v in rows}
 
+@traced("cache.save")
 def cache_save(cache):
-    _save_json(CACHE_FILE, cache)
+    for k, v in cache.items():
+        cache_put(k, v, max_entries=0)
+    cache_evict()
+
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", "0"))  # rotate when exceeded; 0 = never
+HISTORY_KEEP = int(os.getenv("HISTORY_KEEP", "5"))  # rotated files kept (history.jsonl.1 .. .N)
+
+def _history_files():
+    # Newest first: the live file, then history.jsonl.1, .2, ...
+    files = [HISTORY_FILE] + [f"{HISTORY_FILE}.{i}" for i in range(1, HISTORY_KEEP + 1)]
+    return [p for p in files if os.path.exists(p)]
+
+def _iter_lines_reverse(path, block_size=1 << 16):
+    """Yield non-empty lines from the end of the file backwards, reading fixed-size blocks."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            lines = buf.split(b"\n")
+            buf = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line
+        if buf.strip():
+            yield buf
+
+def _history_match(item, subject, topic):
+    if subject is not None and item.get("subject") != subject:
+        return False
+    if topic is not None and item.get("topic") != topic:
+        return False
+    return True
 
-def history_load(limit=None):
-    # Read JSONL lines (safer for append)
+@traced("history.load")
+def history_load(limit=None, subject=None, topic=None):
+    """Return history records in chronological order.
+    With a limit, only the tail of the file is read (seeking backwards), so the
+    cost depends on `limit`, not on the size of the history.
+    """
+    if not limit:
+        items = []
+        for path in reversed(_history_files()):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        item = json_loads(line)
+                    except Exception:
+                        continue
+                    if _history_match(item, subject, topic):
+                        items.append(item)
+        return items
     items = []
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    items.append(json.loads(line))
-                except Exception:
-                    continue
-    if limit:
-        return items[-limit:]
-    return items
+    for path in _history_files():
+        for line in _iter_lines_reverse(path):
+            try:
+                item = json_loads(line)
+            except Exception:
+                continue
+            if _history_match(item, subject, topic):
+                items.append(item)
+                if len(items) >= limit:
+                    return items[::-1]
+    return items[::-1]
 
+@traced("history.append")
 def history_append(records):
     _ensure_dirs()
     with open(HISTORY_FILE, "a", encoding="utf-8") as f:
         for r in records:
             f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    if HISTORY_MAX_BYTES:
+        history_rotate(HISTORY_MAX_BYTES)
+
+def history_rotate(max_bytes=None, keep=None):
+    """Roll history.jsonl over to history.jsonl.1 (shifting older files) once it exceeds max_bytes."""
+    max_bytes = HISTORY_MAX_BYTES if max_bytes is None else max_bytes
+    keep = HISTORY_KEEP if keep is None else keep
+    if not os.path.exists(HISTORY_FILE) or os.path.getsize(HISTORY_FILE) <= max_bytes:
+        return False
+    oldest = f"{HISTORY_FILE}.{keep}"
+    if os.path.exists(oldest):
+        os.remove(oldest)
+    for i in range(keep - 1, 0, -1):
+        src = f"{HISTORY_FILE}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{HISTORY_FILE}.{i + 1}")
+    os.replace(HISTORY_FILE, f"{HISTORY_FILE}.1")
+    return True
+
+def history_compact(path=HISTORY_FILE):
+    """Rewrite a history file without malformed lines and repeated (subject, topic, stem) entries.
+    The latest occurrence of a duplicate is kept. Returns (kept, dropped).
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    seen = set()
+    kept = []
+    dropped = 0
+    for line in _iter_lines_reverse(path):
+        try:
+            item = json.loads(line)
+        except Exception:
+            dropped += 1
+            continue
+        key = (item.get("subject"), item.get("topic"), " ".join(str(item.get("stem", "")).lower().split()))
+        if key in seen:
+            dropped += 1
+            continue
+        seen.add(key)
+        kept.append(item)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for item in reversed(kept):
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+    return len(kept), dropped
 
 def cache_key_from_params(params: dict) -> str:
     # Stable md5 over sorted params
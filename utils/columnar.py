@@ -0,0 +1,168 @@
+import os, json, time, uuid
+import pandas as pd
+
+try:  # Parquet/Arrow support is optional; JSONL/CSV keep working without it
+    import pyarrow as pa
+    import pyarrow.dataset as pds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+BANK_DIR = "outputs/bank"
+PARTITIONS = ("subject", "topic", "difficulty")
+
+def _require():
+    if pa is None:
+        raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+
+def question_schema():
+    _require()
+    return pa.schema([
+        ("id", pa.string()), ("subject", pa.string()), ("topic", pa.string()), ("type", pa.string()),
+        ("stem", pa.string()), ("options", pa.list_(pa.string())), ("answer_idx", pa.int32()),
+        ("explanation", pa.string()), ("bloom_level", pa.string()), ("difficulty", pa.string()),
+        ("created", pa.float64()),
+    ])
+
+def questions_table(records, created=None):
+    """Arrow table of question records with a fixed schema (missing fields become null)."""
+    schema = question_schema()
+    created = time.time() if created is None else created
+    cols = {f.name: [] for f in schema}
+    for r in records:
+        for name in cols:
+            v = r.get(name)
+            if name == "options" and v is not None:
+                v = [str(o) for o in v]
+            elif name == "answer_idx" and v is not None:
+                v = int(v)
+            elif name == "created":
+                v = r.get("created", created)
+            elif v is not None:
+                v = str(v)
+            cols[name].append(v)
+    return pa.table(cols, schema=schema)
+
+def write_questions(records, path):
+    """Question set as a single Parquet file (zstd-compressed)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    pq.write_table(questions_table(records), path, compression="zstd")
+    return path
+
+# ----- Consolidated question bank: hive-partitioned Parquet under BANK_DIR
+def bank_append(records, bank_dir=BANK_DIR):
+    """Add records to the bank as new files under subject=/topic=/difficulty= directories.
+    Existing files are never rewritten, so appends are cheap and concurrent runs do not collide.
+    """
+    if not records:
+        return 0
+    table = questions_table(records)
+    pds.write_dataset(
+        table, bank_dir, format="parquet",
+        partitioning=pds.partitioning(pa.schema([table.schema.field(p) for p in PARTITIONS]), flavor="hive"),
+        basename_template=f"part-{uuid.uuid4().hex[:12]}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        file_options=pds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+    return len(records)
+
+def _filter(filters):
+    expr = None
+    for col, value in filters.items():
+        if value is None:
+            continue
+        field = pds.field(col)
+        term = field.isin(list(value)) if isinstance(value, (list, tuple, set)) else field == value
+        expr = term if expr is None else expr & term
+    return expr
+
+def bank_dataset(bank_dir=BANK_DIR):
+    _require()
+    schema = question_schema()
+    return pds.dataset(bank_dir, format="parquet", schema=schema,
+                       partitioning=pds.partitioning(pa.schema([schema.field(p) for p in PARTITIONS]), flavor="hive"))
+
+def bank_keys(bank_dir=BANK_DIR):
+    """(id, stem) of every row already in the bank; reads only those two columns."""
+    if not os.path.isdir(bank_dir):
+        return set()
+    table = bank_dataset(bank_dir).to_table(columns=["id", "stem"])
+    return set(zip(table.column("id").to_pylist(), table.column("stem").to_pylist()))
+
+def bank_query(bank_dir=BANK_DIR, columns=None, limit=None, **filters):
+    """Rows matching equality/`isin` filters as a DataFrame, e.g.
+    bank_query(subject="science", difficulty="hard", bloom_level="apply").
+    Filters on partition columns skip whole directories; the rest are pushed down to
+    Parquet row-group statistics, so only matching column chunks are decoded.
+    """
+    if not os.path.isdir(bank_dir):
+        return pd.DataFrame(columns=columns or [f.name for f in question_schema()])
+    dataset = bank_dataset(bank_dir)
+    expr = _filter(filters)
+    if limit:
+        table = dataset.head(limit, columns=columns, filter=expr)
+    else:
+        table = dataset.to_table(columns=columns, filter=expr)
+    return table.to_pandas()
+
+# ----- Tables (evaluation predictions, exports): CSV in, Parquet/Arrow as a faster twin
+_TWIN_KEY = b"source_csv"
+
+def _csv_stamp(path):
+    st = os.stat(path)
+    return json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns}).encode()
+
+def _twin_matches(twin, path):
+    """The twin was written from this exact CSV (same size and mtime recorded in its metadata)."""
+    try:
+        meta = pq.read_schema(twin).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return meta.get(_TWIN_KEY) == _csv_stamp(path)
+
+def _write_twin(df, path):
+    """Best-effort Parquet twin of a CSV; a read-only or full directory just means no twin."""
+    twin = os.path.splitext(path)[0] + ".parquet"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _TWIN_KEY: _csv_stamp(path)})
+    tmp = f"{twin}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, twin)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def read_table(path, write_twin=False):
+    """Read .parquet / .arrow|.feather / .csv into a DataFrame.
+    For a CSV, a sibling .parquet written from that same CSV (size and mtime match) is read
+    instead; otherwise the CSV is parsed, and with write_twin=True the twin is (re)written.
+    """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith((".arrow", ".feather")):
+        return pd.read_feather(path)
+    if pa is None:
+        return pd.read_csv(path)
+    twin = os.path.splitext(path)[0] + ".parquet"
+    if os.path.exists(twin) and _twin_matches(twin, path):
+        return pd.read_parquet(twin)
+    df = pd.read_csv(path)
+    if write_twin:
+        _write_twin(df, path)
+    return df
+
+def write_table(df, path, write_twin=False):
+    """Write a DataFrame by extension (.parquet, .arrow/.feather, otherwise CSV).
+    With write_twin=True a CSV also gets its Parquet twin, so the next read_table() skips CSV parsing.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    elif path.endswith((".arrow", ".feather")):
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+        if write_twin and pa is not None:
+            _write_twin(df, path)
+    return path
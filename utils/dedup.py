@@ -0,0 +1,163 @@
+import os, json
+from contextlib import contextmanager
+import numpy as np
+
+try:  # POSIX advisory locks; elsewhere concurrent syncs are not serialised
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from utils.cache import HISTORY_FILE, HISTORY_KEEP
+
+HISTORY_EMB = "outputs/history_emb.f32"
+HISTORY_EMB_META = "outputs/history_emb.json"
+
+class HistoryIndex:
+    """Embeddings of every history stem in a growing float32 file (one row per record).
+
+    The meta file remembers how far into history.jsonl has been embedded, so
+    sync() only encodes records appended since the last call; history text is
+    never re-encoded. Rows are read back through np.memmap. sync() holds an
+    exclusive lock on <meta>.lock, so concurrent runs never embed the same lines twice.
+    """
+    def __init__(self, encode, path=HISTORY_EMB, meta_path=HISTORY_EMB_META, history_path=HISTORY_FILE):
+        self.encode = encode
+        self.path, self.meta_path, self.history_path = path, meta_path, history_path
+        self._load_meta()
+
+    def _load_meta(self):
+        self.meta = {"offset": 0, "rows": 0, "dim": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.meta.update(json.load(f))
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.meta_path) or ".", exist_ok=True)
+        with open(self.meta_path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @property
+    def matrix(self):
+        rows, dim = self.meta["rows"], self.meta["dim"]
+        if not rows or not dim:
+            return np.zeros((0, dim or 0), dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode="r", shape=(rows, dim))
+
+    def _rotated_path(self, inode):
+        """The rotated history file (history.jsonl.1, .2, ...) that is still the file last synced."""
+        for i in range(1, HISTORY_KEEP + 1):
+            path = f"{self.history_path}.{i}"
+            if os.path.exists(path) and os.stat(path).st_ino == inode:
+                return path
+        return None
+
+    @staticmethod
+    def _read_stems(path, offset):
+        """Stems of the complete lines after `offset`, and the number of bytes consumed."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # ignore a partially written last line
+        stems = []
+        for line in data[:end].splitlines():
+            try:
+                stem = json.loads(line).get("stem")
+            except Exception:
+                continue
+            if stem:
+                stems.append(str(stem))
+        return stems, end
+
+    def sync(self):
+        """Embed history records appended since the last sync; returns how many were added."""
+        if not os.path.exists(self.history_path):
+            return 0
+        with self._locked():
+            self._load_meta()  # another process may have synced since this index was opened
+            return self._sync()
+
+    def _sync(self):
+        st = os.stat(self.history_path)
+        inode = self.meta.get("inode")
+        stems = []
+        if inode is not None and inode != st.st_ino:
+            # history.jsonl was rotated since the last sync: finish the old file where we
+            # stopped (it is now history.jsonl.1 or older), then read the new one from the start
+            rotated = self._rotated_path(inode)
+            if rotated is not None:
+                stems, _ = self._read_stems(rotated, self.meta["offset"])
+            self.meta["offset"] = 0
+        elif st.st_size < self.meta["offset"]:
+            self.meta["offset"] = 0  # truncated in place
+        self.meta["inode"] = st.st_ino
+        new, end = self._read_stems(self.history_path, self.meta["offset"]) if st.st_size > self.meta["offset"] else ([], 0)
+        stems += new
+        if not stems and not end and inode == st.st_ino:
+            return 0
+        if stems:
+            vecs = np.asarray(self.encode(stems), dtype=np.float32)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                # Drop rows a crashed sync wrote without recording them in the meta file
+                f.truncate(self.meta["rows"] * vecs.shape[1] * 4)
+                f.write(vecs.tobytes())
+            self.meta["rows"] += len(vecs)
+            self.meta["dim"] = int(vecs.shape[1])
+        self.meta["offset"] += end
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+        return len(stems)
+
+class DuplicateFilter:
+    """Drops generated questions whose stem is too similar to history, the bank or an earlier
+    question of the same batch. check() can be called repeatedly (e.g. per streamed question).
+    """
+    def __init__(self, encode, history_index=None, collection=None, threshold=0.9, bank_threshold=None):
+        self.encode = encode
+        self.history = history_index.matrix if history_index is not None else None
+        self.collection = collection
+        self.threshold = threshold
+        self.bank_threshold = bank_threshold if bank_threshold is not None else threshold
+        self.kept = []
+        self.dropped = []
+
+    def check(self, questions):
+        """Returns the questions to keep; dropped ones are recorded in self.dropped with the reason."""
+        stems = [str(q.get("stem", "")) if isinstance(q, dict) else str(q) for q in questions]
+        if not stems:
+            return []
+        vecs = np.asarray(self.encode(stems), dtype=np.float32)
+        hist_sim = np.zeros(len(vecs), dtype=np.float32)
+        if self.history is not None and len(self.history):
+            hist_sim = (vecs @ np.asarray(self.history).T).max(axis=1)
+        bank_sim = np.zeros(len(vecs), dtype=np.float32)
+        if self.collection is not None:
+            # One batched query for all stems; Chroma cosine distance = 1 - similarity
+            res = self.collection.query(query_embeddings=vecs.tolist(), n_results=1, include=["distances"])
+            bank_sim = np.array([1.0 - d[0] if d else 0.0 for d in res["distances"]], dtype=np.float32)
+        keep = []
+        for i, q in enumerate(questions):
+            batch_sim = float((np.stack(self.kept) @ vecs[i]).max()) if self.kept else 0.0
+            reason = None
+            if hist_sim[i] >= self.threshold:
+                reason, sim = "history", float(hist_sim[i])
+            elif bank_sim[i] >= self.bank_threshold:
+                reason, sim = "bank", float(bank_sim[i])
+            elif batch_sim >= self.threshold:
+                reason, sim = "batch", batch_sim
+            if reason:
+                self.dropped.append({"stem": stems[i], "reason": reason, "similarity": round(sim, 4)})
+                continue
+            self.kept.append(vecs[i])
+            keep.append(q)
+        return keep
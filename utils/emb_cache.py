@@ -0,0 +1,140 @@
+import os, json, hashlib, threading, unicodedata
+from collections import OrderedDict
+from typing import Callable, List
+import numpy as np
+
+try:  # POSIX advisory locks serialise appends from several processes
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by (model name, normalized text hash).
+
+    Tier 1 is an in-memory LRU of vectors. Tier 2 is an append-only file of
+    fixed-size records (16-byte md5 key + float32 vector) read through
+    np.memmap, so lookups never load the whole store. Each append is a single
+    write of whole records under an exclusive lock, after cutting off any partial
+    record a crashed writer left at the end, so rows stay aligned with their keys.
+    """
+    def __init__(self, model_name: str, cache_dir: str | None = None, lru_size: int = 4096):
+        self.model_name = model_name
+        cache_dir = cache_dir or os.getenv("EMB_CACHE_DIR", "outputs/emb_cache")
+        safe = model_name.replace("/", "__").replace("\\", "__")
+        self.dir = os.path.join(cache_dir, safe)
+        self.data_path = os.path.join(self.dir, "vectors.rec")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._index = {}
+        self._mm = None
+        self._rows = 0
+        self._dtype = None
+        self._lock = threading.Lock()
+        self.hits_mem = self.hits_disk = self.misses = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self._set_dim(json.load(f)["dim"])
+            self._refresh()
+
+    def _set_dim(self, dim):
+        self.dim = dim
+        self._dtype = np.dtype([("key", "S16"), ("vec", "<f4", (dim,))])
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.md5(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def _refresh(self):
+        """Map rows appended since the last refresh (by this or another process)."""
+        if self._dtype is None or not os.path.exists(self.data_path):
+            return
+        rows = os.path.getsize(self.data_path) // self._dtype.itemsize
+        if rows <= self._rows:
+            return
+        self._mm = np.memmap(self.data_path, dtype=self._dtype, mode="r", shape=(rows,))
+        for i, k in enumerate(self._mm["key"][self._rows:rows].tolist(), start=self._rows):
+            self._index[k] = i
+        self._rows = rows
+
+    def _lru_put(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _append(self, keys, vecs):
+        if self._dtype is None:
+            os.makedirs(self.dir, exist_ok=True)
+            self._set_dim(vecs.shape[1])
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+        recs = np.empty(len(keys), dtype=self._dtype)
+        recs["key"] = keys
+        recs["vec"] = vecs
+        with open(self.data_path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            if size % self._dtype.itemsize:
+                f.truncate(size - size % self._dtype.itemsize)
+            f.write(recs.tobytes())
+            f.flush()
+            # the lock is released when the file is closed
+        self._refresh()
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for texts, serving hits in bulk and encoding all misses in one batch.
+        Normalization only builds the cache key; the model always sees the original text."""
+        keys = [self._key(normalize_text(t)) for t in texts]
+        out = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            self._refresh()
+            disk_rows = []
+            for i, k in enumerate(keys):
+                vec = self._lru.get(k)
+                if vec is not None:
+                    self._lru.move_to_end(k)
+                    out[i] = vec
+                    self.hits_mem += 1
+                    continue
+                row = self._index.get(k)
+                if row is not None:
+                    disk_rows.append((i, row))
+                else:
+                    missing.setdefault(k, []).append(i)
+            if disk_rows:
+                vecs = np.array(self._mm["vec"][[r for _, r in disk_rows]])
+                for (i, _), vec in zip(disk_rows, vecs):
+                    out[i] = vec
+                    self._lru_put(keys[i], vec)
+                self.hits_disk += len(disk_rows)
+        if missing:
+            miss_keys = list(missing)
+            vecs = np.asarray(encode_fn([texts[missing[k][0]] for k in miss_keys]), dtype=np.float32)
+            with self._lock:
+                self.misses += sum(len(v) for v in missing.values())
+                new_keys, new_vecs = [], []
+                for k, vec in zip(miss_keys, vecs):
+                    for i in missing[k]:
+                        out[i] = vec
+                    self._lru_put(k, vec)
+                    if k not in self._index:
+                        new_keys.append(k)
+                        new_vecs.append(vec)
+                if new_keys:
+                    self._append(new_keys, np.stack(new_vecs))
+        if not out:
+            return np.zeros((0, getattr(self, "dim", 0)), dtype=np.float32)
+        return np.stack(out).astype(np.float32, copy=False)
+
+    def stats(self) -> dict:
+        total = self.hits_mem + self.hits_disk + self.misses
+        return {
+            "hits_mem": self.hits_mem, "hits_disk": self.hits_disk, "misses": self.misses,
+            "hit_ratio": (self.hits_mem + self.hits_disk) / total if total else 0.0,
+            "stored": self._rows,
+        }
@@ -1,23 +1,97 @@
-import os
+import os, gc, threading
 from typing import List
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+from utils.emb_cache import EmbeddingCache
+
 load_dotenv()
 EMBEDDING_NAME = os.getenv("EMBEDDING_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE") or None
+EMB_CACHE = os.getenv("EMB_CACHE", "1") not in ("0", "false", "False", "")
+
+# ----- Process-wide model registry: one SentenceTransformer per (model name, device)
+_MODELS = {}
+_CACHES = {}
+_LOCK = threading.Lock()
+
+def _key(model_name=None, device=None):
+    return (model_name or EMBEDDING_NAME, device or EMBEDDING_DEVICE)
+
+def get_model(model_name: str | None = None, device: str | None = None) -> SentenceTransformer:
+    """Return the shared model instance, loading it on first use (thread-safe)."""
+    key = _key(model_name, device)
+    model = _MODELS.get(key)
+    if model is None:
+        with _LOCK:
+            model = _MODELS.get(key)
+            if model is None:
+                model = SentenceTransformer(key[0], device=key[1])
+                _MODELS[key] = model
+    return model
+
+def warmup(model_name: str | None = None, device: str | None = None) -> None:
+    """Load the model and run one tiny encode so the first real request is not slow."""
+    get_model(model_name, device).encode(["warmup"], show_progress_bar=False, convert_to_numpy=True)
+
+def unload(model_name: str | None = None, device: str | None = None, all: bool = False) -> None:
+    """Drop a cached model (or every cached model with all=True) and free its memory."""
+    with _LOCK:
+        if all:
+            _MODELS.clear()
+        else:
+            _MODELS.pop(_key(model_name, device), None)
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+def get_cache(model_name: str | None = None) -> EmbeddingCache:
+    """Return the shared on-disk embedding cache for a model."""
+    name = model_name or EMBEDDING_NAME
+    cache = _CACHES.get(name)
+    if cache is None:
+        with _LOCK:
+            cache = _CACHES.get(name)
+            if cache is None:
+                cache = EmbeddingCache(name)
+                _CACHES[name] = cache
+    return cache
+
+def encode_batch(texts: List[str], batch_size: int = 32, model_name: str | None = None, device: str | None = None) -> np.ndarray:
+    """Batch-encode to a normalized float32 matrix using the shared model."""
+    model = get_model(model_name, device)
+    vecs = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True)
+    return vecs.astype(np.float32, copy=False)
 
 class STEmbeddingFunction:
     """Callable wrapper compatible with Chroma's embedding_function interface."""
-    def __init__(self, model_name: str | None = None):
+    def __init__(self, model_name: str | None = None, device: str | None = None, use_cache: bool | None = None):
         self.model_name = model_name or EMBEDDING_NAME
-        self._model = SentenceTransformer(self.model_name)
+        self.device = device
+        self.use_cache = EMB_CACHE if use_cache is None else use_cache
+
+    @property
+    def _model(self) -> SentenceTransformer:
+        return get_model(self.model_name, self.device)
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.encode(input).tolist()
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Batch-encode to a float32 matrix (used to precompute embeddings before upsert)."""
+        def _encode(batch):
+            return encode_batch(batch, batch_size=batch_size, model_name=self.model_name, device=self.device)
+        if self.use_cache:
+            return get_cache(self.model_name).encode(texts, _encode)
+        return _encode(texts)
 
-    def __call__(self, texts: List[str]) -> List[List[float]]:
-        vecs = self._model.encode(texts, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True)
-        return vecs.tolist()
+    def cache_stats(self) -> dict | None:
+        return get_cache(self.model_name).stats() if self.use_cache else None
 
 def encode_one(text: str) -> List[float]:
-    model = SentenceTransformer(EMBEDDING_NAME)
-    v = model.encode([text], convert_to_numpy=True, normalize_embeddings=True)[0]
-    return v.tolist()
+    return encode_batch([text])[0].tolist()
@@ -0,0 +1,103 @@
+import os, json, hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+METRICS_CACHE = "outputs/metrics_cache.json"
+NON_SYSTEM_COLUMNS = {"reference", "question", "support", "distractor1", "distractor2", "distractor3"}
+
+_scorers = {}
+
+def get_scorer(name):
+    """evaluate.load() once per process; the BERTScore metric also keeps its model between calls."""
+    if name not in _scorers:
+        import evaluate
+        _scorers[name] = evaluate.load(name)
+    return _scorers[name]
+
+def system_columns(df):
+    """Prediction columns of a predictions CSV: `*_prediction` columns if any, else everything but the inputs."""
+    cols = [c for c in df.columns if c.endswith("_prediction")]
+    return cols or [c for c in df.columns if c not in NON_SYSTEM_COLUMNS]
+
+def prediction_hash(preds, references, config):
+    h = hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8"))
+    for p, r in zip(preds, references):
+        h.update(f"{p}\x1f{r}\x1e".encode("utf-8"))
+    return h.hexdigest()
+
+def lexical_scores(preds, references):
+    rouge_res = get_scorer("rouge").compute(predictions=preds, references=references)
+    bleu_res = get_scorer("bleu").compute(predictions=preds, references=references)
+    return {
+        "ROUGE-1": rouge_res["rouge1"],
+        "ROUGE-2": rouge_res["rouge2"],
+        "ROUGE-L": rouge_res["rougeL"],
+        "BLEU": bleu_res["bleu"],
+    }
+
+def _lexical_task(args):
+    return lexical_scores(*args)
+
+def bertscore_f1(systems, references, batch_size=64, lang="en"):
+    """Mean BERTScore-F1 for several systems from one batched call (the model is loaded once)."""
+    names = list(systems)
+    if not names:
+        return {}
+    preds = [p for name in names for p in systems[name]]
+    res = get_scorer("bertscore").compute(predictions=preds, references=list(references) * len(names),
+                                          lang=lang, batch_size=batch_size)
+    n = len(references)
+    return {name: sum(res["f1"][i * n:(i + 1) * n]) / n for i, name in enumerate(names)}
+
+def load_cache(path=METRICS_CACHE):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+    return {}
+
+def save_cache(cache, path=METRICS_CACHE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def score_systems(references, systems, workers=4, bertscore=True, bert_batch_size=64, lang="en",
+                  cache_path=METRICS_CACHE):
+    """Score {system: predictions} against references -> {system: {metric: value}}.
+
+    Results are cached under (system, hash of its predictions + references + metric
+    settings), so only new or changed systems are scored. ROUGE/BLEU run in worker
+    processes, one system each; BERTScore runs once in this process over all pending
+    systems so its model is loaded a single time.
+    """
+    references = ["" if r is None else str(r) for r in references]
+    systems = {name: ["" if p is None else str(p) for p in preds] for name, preds in systems.items()}
+    config = {"bertscore": bertscore, "lang": lang}
+    cache = load_cache(cache_path) if cache_path else {}
+    keys = {name: f"{name}:{prediction_hash(preds, references, config)}" for name, preds in systems.items()}
+    results = {name: cache[keys[name]] for name in systems if keys[name] in cache}
+    pending = [name for name in systems if name not in results]
+    if results:
+        print(f"Metrics cache hit for: {', '.join(results)}")
+    if not pending:
+        return {name: results[name] for name in systems}
+
+    tasks = [(systems[name], references) for name in pending]
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            lexical = list(pool.map(_lexical_task, tasks))
+    else:
+        lexical = [_lexical_task(t) for t in tasks]
+    bert = bertscore_f1({name: systems[name] for name in pending}, references, bert_batch_size, lang) if bertscore else {}
+
+    for name, scores in zip(pending, lexical):
+        if bertscore:
+            scores["BERTScore-F1"] = bert[name]
+        results[name] = scores
+        cache[keys[name]] = scores
+    if cache_path:
+        save_cache(cache, cache_path)
+    return {name: results[name] for name in systems}
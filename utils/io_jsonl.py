@@ -1,15 +1,180 @@
-import json, os
-
-def read_jsonl(path):
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            yield json.loads(line)
-
-def write_jsonl(records, path):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+import json, os, sys, gzip, io
+from concurrent.futures import ProcessPoolExecutor
+
+try:  # optional fast codec; stdlib json is the fallback
+    import orjson
+except ImportError:
+    orjson = None
+
+BUFFER_SIZE = 1 << 20  # read/write block size
+
+def loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+def dumps(record):
+    """One record as UTF-8 bytes without the newline (non-ASCII kept as-is, like ensure_ascii=False)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(record)
+        except TypeError:
+            pass  # e.g. numpy scalars or non-str keys: let stdlib json have a go
+    return json.dumps(record, ensure_ascii=False).encode("utf-8")
+
+def open_jsonl(path, mode="rb"):
+    """Binary file object for a JSONL path; .gz and .zst/.zstd are (de)compressed transparently, '-' is stdin/stdout."""
+    if path == "-":
+        return sys.stdin.buffer if "r" in mode else sys.stdout.buffer
+    if "r" not in mode:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith((".zst", ".zstd")):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading/writing {path} needs the 'zstandard' package") from None
+        f = open(path, mode)
+        if "r" in mode:
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, closefd=True), BUFFER_SIZE)
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=True)
+    return open(path, mode, buffering=BUFFER_SIZE)
+
+def _parse_lines(lines, stats, first_lineno):
+    for n, line in enumerate(lines, first_lineno):
+        if not line.strip():
+            continue
+        try:
+            record = loads(line)
+        except ValueError:
+            stats["bad"] += 1
+            if len(stats["bad_lines"]) < 20:
+                stats["bad_lines"].append(n)
+            continue
+        stats["rows"] += 1
+        yield record
+
+def _new_stats(stats):
+    if stats is None:
+        stats = {}
+    stats.setdefault("rows", 0)
+    stats.setdefault("bad", 0)
+    stats.setdefault("bad_lines", [])
+    return stats
+
+def read_jsonl(path, stats=None):
+    """Yield records from a JSONL file (plain, .gz, .zst or '-' for stdin), reading large blocks.
+    Lines that are not valid JSON are skipped and counted in `stats` ({"rows", "bad", "bad_lines"});
+    a summary of skipped lines is printed to stderr once the file is exhausted.
+    """
+    stats = _new_stats(stats)
+    f = open_jsonl(path, "rb")
+    lineno = 1
+    tail = b""
+    try:
+        while True:
+            block = f.read(BUFFER_SIZE)
+            if not block:
+                break
+            lines = (tail + block).split(b"\n")
+            tail = lines.pop()
+            yield from _parse_lines(lines, stats, lineno)
+            lineno += len(lines)
+        if tail:
+            yield from _parse_lines([tail], stats, lineno)
+    finally:
+        if path != "-":
+            f.close()
+    if stats["bad"]:
+        print(f"{path}: skipped {stats['bad']} malformed line(s), e.g. line {stats['bad_lines'][0]}", file=sys.stderr)
+
+def write_jsonl(records, path, mode="w"):
+    """Write records (any iterable) as JSONL in ~1 MiB blocks; returns the number written."""
+    f = open_jsonl(path, mode.replace("b", "") + "b")
+    n = 0
+    chunk, size = [], 0
+    try:
         for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            line = dumps(r)
+            chunk.append(line)
+            size += len(line) + 1
+            n += 1
+            if size >= BUFFER_SIZE:
+                f.write(b"\n".join(chunk) + b"\n")
+                chunk, size = [], 0
+        if chunk:
+            f.write(b"\n".join(chunk) + b"\n")
+    finally:
+        if path == "-":
+            f.flush()
+        else:
+            f.close()
+    return n
+
+# ----- Parallel chunked reading (uncompressed files only: ranges need seekable byte offsets)
+def jsonl_chunks(path, n_chunks):
+    """Split a file into up to n_chunks (start, end) byte ranges that begin and end at line boundaries."""
+    if path.endswith((".gz", ".zst", ".zstd")):
+        raise ValueError("Chunked reading needs an uncompressed file")
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, max(1, n_chunks)):
+            f.seek(max(bounds[-1], size * i // n_chunks))
+            f.readline()  # move to the start of the next line
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def read_jsonl_range(path, start, end, stats=None):
+    """Records whose lines lie in [start, end) of an uncompressed JSONL file."""
+    stats = _new_stats(stats)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return list(_parse_lines(data.split(b"\n"), stats, 1))
+
+def _read_range_task(args):
+    path, start, end, fn = args
+    stats = _new_stats(None)
+    rows = read_jsonl_range(path, start, end, stats)
+    return (fn(rows) if fn is not None else rows), stats
+
+def read_jsonl_parallel(path, workers=None, fn=None, stats=None):
+    """Parse a large JSONL file in worker processes, one newline-aligned byte range each.
+    Yields each range's records in file order, or fn(records) when fn (a picklable,
+    module-level function) is given so heavy per-row work also runs in the workers.
+    """
+    stats = _new_stats(stats)
+    workers = workers or os.cpu_count() or 1
+    ranges = jsonl_chunks(path, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for out, part in pool.map(_read_range_task, [(path, s, e, fn) for s, e in ranges]):
+            stats["rows"] += part["rows"]
+            stats["bad"] += part["bad"]
+            yield out
+    if stats["bad"]:
+        print(f"{path}: skipped {stats['bad']} malformed line(s)", file=sys.stderr)
+
+class JsonlWriter:
+    """Line-at-a-time JSONL writer that flushes each record (for streamed outputs and checkpoints)."""
+    def __init__(self, path, mode="w"):
+        self.path = path
+        self.f = open_jsonl(path, mode.replace("b", "") + "b")
+
+    def write(self, record):
+        self.f.write(dumps(record) + b"\n")
+        self.f.flush()
+
+    def close(self):
+        if self.path != "-":
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
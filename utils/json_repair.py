@@ -0,0 +1,177 @@
+import json, re, threading
+
+from utils.json_stream import QuestionStreamParser
+from utils.tokens import count_tokens
+
+_FENCE = re.compile(r"^\s*```[\w-]*\s*\n?|\n?\s*```\s*$")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+def strip_fences(text):
+    """Drop a surrounding ```json fence and any prose before the first { or [."""
+    text = _FENCE.sub("", text.strip())
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    return text[min(starts):] if starts else text
+
+def close_truncated(text):
+    """Cut a truncated JSON document back to its last complete value and close the open brackets."""
+    stack, in_string, escape = [], False, False
+    safe, safe_stack = 0, []
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c == "," and stack:
+            safe, safe_stack = i, list(stack)  # the value before a comma is complete
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if not stack:
+                break
+            stack.pop()
+            safe, safe_stack = i + 1, list(stack)
+            if not stack:
+                return text[:safe]
+    return text[:safe] + "".join(reversed(safe_stack))
+
+def parse_json(content):
+    """Parse an LLM completion as JSON, repairing the usual damage: code fences, leading prose,
+    trailing commas and output cut off mid-array. Returns (data, repaired); data is None when
+    nothing could be recovered."""
+    try:
+        return json.loads(content), False
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(content, str):
+        return None, True
+    text = _TRAILING_COMMA.sub(r"\1", strip_fences(content))
+    for candidate in (text, close_truncated(text)):
+        try:
+            return json.loads(_TRAILING_COMMA.sub(r"\1", candidate)), True
+        except ValueError:
+            continue
+    # Last resort: every complete question object, wherever the document broke
+    parser = QuestionStreamParser()
+    items = parser.feed(text)
+    return ({"questions": items} if items else None), True
+
+# ----- Schema validation
+_LETTERS = "ABCD"
+
+def _answer_index(value, n_options):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().rstrip(").").strip()
+        if len(value) == 1 and value.upper() in _LETTERS[:n_options]:
+            return _LETTERS.index(value.upper())
+    try:
+        num = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not num.is_integer():
+        return None  # 1.7 is not an index
+    idx = int(num)
+    return idx if 0 <= idx < n_options else None
+
+def validate_question(q, qtype):
+    """(cleaned copy, None) for a usable generated question, else (None, reason)."""
+    if not isinstance(q, dict):
+        return None, "not an object"
+    stem = q.get("stem")
+    if not isinstance(stem, str) or not stem.strip():
+        return None, "missing stem"
+    q = dict(q, stem=stem.strip())
+    if qtype == "tf":
+        # Options are fixed as in to_records; the answer must be given (a truncated object
+        # often lacks it) and be 0/1 or true/false, never defaulted
+        ans = q.get("answer_idx")
+        if isinstance(ans, bool):
+            ans = 0 if ans else 1
+        elif isinstance(ans, str) and ans.strip().lower() in ("true", "false"):
+            ans = 0 if ans.strip().lower() == "true" else 1
+        else:
+            ans = _answer_index(ans, 2) if ans is not None else None
+        if ans is None:
+            return None, "tf answer missing or invalid"
+        q["options"], q["answer_idx"] = ["True", "False"], ans
+        return q, None
+    options = q.get("options")
+    if isinstance(options, dict):
+        options = list(options.values())
+    if not isinstance(options, list) or len(options) != 4:
+        return None, "mcq needs 4 options"
+    options = [str(o).strip() for o in options]
+    if not all(options):
+        return None, "empty option"
+    idx = _answer_index(q.get("answer_idx"), len(options))
+    if idx is None:
+        return None, "answer_idx out of range"
+    q["options"], q["answer_idx"] = options, idx
+    return q, None
+
+class SalvageStats:
+    """How many generated items survived repair/validation, and the completion tokens a
+    full regeneration would have spent on items that were kept instead."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.responses = 0
+        self.repaired = 0
+        self.unparseable = 0
+        self.items = 0
+        self.valid = 0
+        self.rejected = {}
+        self.refills = 0
+        self.tokens_saved = 0
+
+    def parsed(self, data, repaired):
+        with self._lock:
+            self.responses += 1
+            self.repaired += int(repaired and data is not None)
+            self.unparseable += int(data is None)
+
+    def checked(self, items, valid, reasons):
+        with self._lock:
+            self.items += items
+            self.valid += valid
+            for r in reasons:
+                self.rejected[r] = self.rejected.get(r, 0) + 1
+
+    def refilled(self, kept):
+        """Only the missing items were re-requested; the kept ones were not paid for again."""
+        with self._lock:
+            self.refills += 1
+            if kept:
+                self.tokens_saved += count_tokens(json.dumps({"questions": kept}, ensure_ascii=False))
+
+    def summary(self):
+        return {
+            "responses": self.responses, "repaired": self.repaired, "unparseable": self.unparseable,
+            "items": self.items, "valid": self.valid,
+            "salvage_rate": round(self.valid / self.items, 3) if self.items else 1.0,
+            "rejected": dict(self.rejected), "refills": self.refills, "tokens_saved": self.tokens_saved,
+        }
+
+salvage_stats = SalvageStats()
+
+def validate_questions(questions, qtype, stats=salvage_stats):
+    """Keep the usable questions (cleaned); rejected ones are counted by reason in `stats`."""
+    valid, reasons = [], []
+    for q in questions or []:
+        clean, reason = validate_question(q, qtype)
+        if clean is None:
+            reasons.append(reason)
+        else:
+            valid.append(clean)
+    if stats is not None:
+        stats.checked(len(questions or []), len(valid), reasons)
+    return valid
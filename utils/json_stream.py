@@ -0,0 +1,61 @@
+import json
+
+class QuestionStreamParser:
+    """Incrementally extract objects from the "questions" array of a streamed JSON completion.
+
+    feed() takes raw text deltas and returns every question object that became
+    complete with that delta, so callers can act on a question as soon as its
+    closing brace arrives instead of waiting for the whole completion.
+    A bare top-level array of objects is accepted as well.
+    """
+    def __init__(self):
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.array_depth = None  # depth just inside the questions array
+        self.obj_start = None
+        self.done = False
+        self.text = ""
+
+    def _opens_questions(self, i):
+        before = self.text[:i].rstrip()
+        if before.endswith(":"):
+            return self.depth == 1 and before[:-1].rstrip().endswith('"questions"')
+        return self.depth == 0
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        out = []
+        text = self.text
+        for i in range(self.pos, len(text)):
+            c = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                continue
+            if c == '"':
+                self.in_string = True
+            elif c in "{[":
+                if c == "[" and self.array_depth is None and not self.done and self._opens_questions(i):
+                    self.array_depth = self.depth + 1
+                elif c == "{" and self.array_depth is not None and self.depth == self.array_depth:
+                    self.obj_start = i
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if c == "}" and self.obj_start is not None and self.depth == self.array_depth:
+                    try:
+                        out.append(json.loads(text[self.obj_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.obj_start = None
+                elif c == "]" and self.array_depth is not None and self.depth == self.array_depth - 1:
+                    self.array_depth = None
+                    self.done = True
+        self.pos = len(text)
+        return out
@@ -0,0 +1,34 @@
+import numpy as np
+
+def mmr_select(query_vec, doc_vecs, k, lambda_=0.7, dup_threshold=None):
+    """Maximal marginal relevance over candidate embeddings.
+
+    Greedily picks the candidate maximising
+        lambda * sim(query, d) - (1 - lambda) * max sim(d, already selected)
+    and returns the chosen indices in pick order. Candidates whose similarity to
+    an already selected item exceeds dup_threshold are treated as duplicates
+    and never picked.
+    """
+    D = np.asarray(doc_vecs, dtype=np.float32)
+    if D.ndim != 2 or not len(D):
+        return []
+    q = np.asarray(query_vec, dtype=np.float32)
+    D = D / np.maximum(np.linalg.norm(D, axis=1, keepdims=True), 1e-12)
+    q = q / max(float(np.linalg.norm(q)), 1e-12)
+    rel = D @ q
+    sim = D @ D.T
+    selected = []
+    max_sim = np.full(len(D), -np.inf, dtype=np.float32)
+    available = np.ones(len(D), dtype=bool)
+    for _ in range(min(k, len(D))):
+        red = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        score = np.where(available, lambda_ * rel - (1 - lambda_) * red, -np.inf)
+        i = int(np.argmax(score))
+        if not np.isfinite(score[i]):
+            break
+        selected.append(i)
+        available[i] = False
+        max_sim = np.maximum(max_sim, sim[i])
+        if dup_threshold is not None:
+            available &= max_sim < dup_threshold
+    return selected
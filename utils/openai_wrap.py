@@ -1,6 +1,12 @@
-import os
+import os, time, random, asyncio, threading
 from dotenv import load_dotenv
-from openai import OpenAI
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+from utils.json_stream import QuestionStreamParser
+from utils.json_repair import parse_json, salvage_stats
+from utils.trace import span, add_usage
 
 # تحميل ملف .env
 load_dotenv()
@@ -11,23 +17,232 @@ api_key = os.getenv("OPENROUTER_API_KEY")
 if not api_key:
     raise ValueError("⚠️ مفيش مفتاح OpenRouter متسجل! ضيفي OPENROUTER_API_KEY في .env")
 
+# Override to point at a local OpenAI-compatible server (e.g. a fake for tests)
+BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))  # requests/min, 0 = unlimited
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))  # tokens/min, 0 = unlimited
+
 # تعريف العميل باستخدام OpenRouter
 client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
+    base_url=BASE_URL,
     api_key=api_key,
+    timeout=LLM_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES,
 )
 
-import json
+def _parse_json(content, stats=salvage_stats):
+    # Fences, trailing commas and truncated arrays are repaired; unusable output becomes an
+    # empty set (callers validate and re-request what is missing) instead of {"questions": [content]}
+    data, repaired = parse_json(content)
+    stats.parsed(data, repaired)
+    return data if isinstance(data, dict) else {"questions": data if isinstance(data, list) else []}
 
-def chat_json(messages, max_tokens=2200, temperature=0.4, model="openai/gpt-4o-mini"):
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
-    )
+def chat_json(messages, max_tokens=2200, temperature=0.4, model="openai/gpt-4o-mini", stats=salvage_stats):
+    with span("llm.call", model=model) as sp:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        add_usage(getattr(response, "usage", None), sp)
     content = response.choices[0].message.content
+    with span("llm.parse"):
+        return _parse_json(content, stats)
+
+def chat_json_stream(messages, max_tokens=2200, temperature=0.4, model="openai/gpt-4o-mini", stats=salvage_stats):
+    """Streaming chat_json: yields each question dict as soon as its JSON object is complete.
+    If nothing could be parsed incrementally, falls back to chat_json's parsing of the full text.
+    `stats` (both functions) receives the repair outcome; pass a SalvageStats for per-request numbers.
+    """
+    with span("llm.stream", model=model) as sp:
+        t0 = time.perf_counter()
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        parser = QuestionStreamParser()
+        yielded = 0
+        for chunk in stream:
+            # Servers that send usage put it on the final chunk
+            add_usage(getattr(chunk, "usage", None), sp)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if sp is not None and "first_token_ms" not in sp["attrs"]:
+                    sp["attrs"]["first_token_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                for q in parser.feed(delta):
+                    yielded += 1
+                    yield q
+    if not yielded:
+        yield from _parse_json(parser.text, stats).get("questions", [])
+
+# ----- Async companion API
+
+class TokenBucket:
+    """Dual token bucket: requests/min and tokens/min. A rate of 0 disables that bucket."""
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM):
+        self.rpm, self.tpm = rpm, tpm
+        self._req = rpm
+        self._tok = tpm
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.rpm:
+            self._req = min(self.rpm, self._req + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tok = min(self.tpm, self._tok + elapsed * self.tpm / 60.0)
+
+    async def acquire(self, tokens=0):
+        if self.tpm:
+            tokens = min(tokens, self.tpm)  # a single oversized request must still fit the bucket
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._req < 1:
+                    wait = max(wait, (1 - self._req) * 60.0 / self.rpm)
+                if self.tpm and self._tok < tokens:
+                    wait = max(wait, (tokens - self._tok) * 60.0 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._req -= 1
+                    if self.tpm:
+                        self._tok -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+class LatencyStats:
+    """Per-call latency/outcome bookkeeping for the async client."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latencies = []
+        self.errors = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, seconds, ok=True, usage=None):
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+                self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def summary(self):
+        lat = sorted(self.latencies)
+        def pct(p):
+            return lat[min(len(lat) - 1, int(round(p / 100 * (len(lat) - 1))))] if lat else 0.0
+        return {
+            "calls": len(lat), "errors": self.errors, "retries": self.retries,
+            "p50_s": pct(50), "p95_s": pct(95), "max_s": lat[-1] if lat else 0.0,
+            "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+        }
+
+stats = LatencyStats()
+_async_clients = {}
+_limiters = {}
+
+def _loop_local(registry, factory):
+    # httpx connection pools and asyncio locks are bound to the loop that created them
+    loop = asyncio.get_running_loop()
+    obj = registry.get(loop)
+    if obj is None:
+        for dead in [l for l in registry if l.is_closed()]:
+            registry.pop(dead, None)
+        obj = registry[loop] = factory()
+    return obj
+
+def get_async_client():
+    """Shared AsyncOpenAI client with a pooled HTTP connection per event loop."""
+    return _loop_local(_async_clients, lambda: AsyncOpenAI(
+        base_url=BASE_URL,
+        api_key=api_key,
+        timeout=LLM_TIMEOUT,
+        max_retries=0,  # retries are handled by achat_json with jittered backoff
+        http_client=httpx.AsyncClient(
+            timeout=LLM_TIMEOUT,
+            limits=httpx.Limits(max_connections=max(LLM_CONCURRENCY, 1) * 2, max_keepalive_connections=max(LLM_CONCURRENCY, 1)),
+        ),
+    ))
+
+def get_rate_limiter():
+    return _loop_local(_limiters, TokenBucket)
+
+def _estimate_tokens(messages, max_tokens):
+    # ~4 chars per token is close enough for budgeting the tokens/min bucket
+    return sum(len(m.get("content") or "") for m in messages) // 4 + max_tokens
+
+def _retryable(exc):
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+def _retry_after(exc):
+    resp = getattr(exc, "response", None)
     try:
-        return json.loads(content)   # يحول النص لـ dict
-    except json.JSONDecodeError:
-        return {"questions": [content]}  # fallback لو مش JSON
+        return float(resp.headers.get("retry-after")) if resp is not None else None
+    except (TypeError, ValueError):
+        return None
+
+async def achat_json(messages, max_tokens=2200, temperature=0.4, model="openai/gpt-4o-mini",
+                     max_retries=LLM_MAX_RETRIES, base_delay=1.0, max_delay=30.0):
+    """Async chat_json: rate limited, retried with jittered exponential backoff on 429/5xx/timeouts."""
+    aclient = get_async_client()
+    limiter = get_rate_limiter()
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(_estimate_tokens(messages, max_tokens))
+        t0 = time.perf_counter()
+        try:
+            with span("llm.call", model=model, attempt=attempt) as sp:
+                response = await aclient.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+                add_usage(getattr(response, "usage", None), sp)
+        except Exception as e:
+            stats.record(time.perf_counter() - t0, ok=False)
+            if attempt >= max_retries or not _retryable(e):
+                raise
+            stats.retries += 1
+            retry_after = _retry_after(e)
+            if retry_after is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            else:  # honour the server's hint, but never park a worker longer than max_delay
+                delay = min(max_delay, max(0.0, retry_after))
+            await asyncio.sleep(delay)
+            continue
+        stats.record(time.perf_counter() - t0, usage=getattr(response, "usage", None))
+        with span("llm.parse"):
+            return _parse_json(response.choices[0].message.content)
+
+async def agather_json(requests, concurrency=LLM_CONCURRENCY, return_exceptions=True):
+    """Run many achat_json calls with at most `concurrency` in flight.
+    `requests` is a list of kwargs dicts for achat_json (each must contain "messages").
+    Results keep the input order; failures are returned as exceptions when return_exceptions=True.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(kwargs):
+        async with sem:
+            return await achat_json(**kwargs)
+
+    return await asyncio.gather(*(one(r) for r in requests), return_exceptions=return_exceptions)
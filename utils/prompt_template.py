@@ -0,0 +1,110 @@
+import os, re, threading
+
+from utils.tokens import count_tokens, fit_lines
+
+_SLOT = re.compile(r"\{\{(\w+)\}\}")
+
+def _trim_lines(text, max_tokens, keep):
+    lines = text.split("\n")
+    if keep == "tail":
+        return "\n".join(reversed(fit_lines(list(reversed(lines)), max_tokens)))
+    return "\n".join(fit_lines(lines, max_tokens))
+
+def trim_block(text, max_tokens, keep="head"):
+    """Drop whole lines until a block fits max_tokens: trailing lines with keep="head"
+    (ranked blocks such as retrieved examples), leading lines with keep="tail" (history, newest last)."""
+    if not text or count_tokens(text) <= max_tokens:
+        return text
+    return _trim_lines(text, max_tokens, keep)
+
+class PromptTemplate:
+    """A prompt file parsed once into static text and {{slot}} segments.
+
+    render() fills every slot in one pass over the segments. Slots without a value are
+    left as written, like the chained str.replace() calls this replaces, unless strict=True.
+    `prefix` is the static text before the first slot, i.e. what stays byte-identical across
+    requests. Provider prompt caches only apply above a minimum length (OpenAI: 1024 tokens);
+    the bundled prompts are far shorter, so they keep their slots where they always were.
+    """
+    def __init__(self, text, path=None):
+        self.path = path
+        self.text = text
+        self.segments = []  # (is_slot, text_or_name)
+        pos = 0
+        for m in _SLOT.finditer(text):
+            if m.start() > pos:
+                self.segments.append((False, text[pos:m.start()]))
+            self.segments.append((True, m.group(1)))
+            pos = m.end()
+        if pos < len(text):
+            self.segments.append((False, text[pos:]))
+        self.slots = {name for is_slot, name in self.segments if is_slot}
+        self.prefix = self.segments[0][1] if self.segments and not self.segments[0][0] else ""
+        self.prefix_tokens = count_tokens(self.prefix)
+        self.static_tokens = sum(count_tokens(s) for is_slot, s in self.segments if not is_slot)
+        self._uses = {name: sum(1 for is_slot, s in self.segments if is_slot and s == name) for name in self.slots}
+
+    def render(self, values, budgets=None, max_tokens=None, priority=(), keep_tail=(), stats=None, strict=False):
+        """Fill the template.
+
+        budgets:    {slot: max tokens} applied to that slot's value (line-wise trimming).
+        max_tokens: cap on the whole prompt; when exceeded, slots in `priority` (most important
+                    first) are trimmed starting from the least important one.
+        keep_tail:  slots whose newest lines are at the end (trimmed from the front).
+        stats:      optional dict filled with prompt/prefix token counts and tokens trimmed per slot.
+        strict:     raise ValueError instead of leaving unfilled {{slots}} in the prompt.
+        """
+        values = {k: str(v) for k, v in values.items() if k in self.slots}
+        if strict and len(values) < len(self.slots):
+            raise ValueError(f"{self.path or 'template'}: no value for {sorted(self.slots - set(values))}")
+        tokens, trimmed = {}, {}
+
+        def size(name):
+            if name not in tokens:
+                tokens[name] = count_tokens(values[name])
+            return tokens[name]
+
+        def trim(name, limit):
+            before = size(name)
+            if before <= limit:
+                return
+            values[name] = _trim_lines(values[name], max(0, limit), "tail" if name in keep_tail else "head")
+            tokens[name] = count_tokens(values[name])
+            trimmed[name] = trimmed.get(name, 0) + before - tokens[name]
+
+        for name, limit in (budgets or {}).items():
+            if values.get(name):
+                trim(name, limit)
+        total = None
+        if max_tokens or stats is not None:  # token counts are only needed for these
+            total = self.static_tokens + sum(size(name) * self._uses[name] for name in values)
+            for name in reversed(priority):
+                excess = total - max_tokens if max_tokens else 0
+                if excess <= 0:
+                    break
+                if not values.get(name):
+                    continue
+                before = size(name)
+                cut = -(-excess // self._uses[name])  # ceil: tokens to drop from each occurrence
+                trim(name, before - cut)
+                total -= (before - size(name)) * self._uses[name]
+        out = "".join(values.get(s, "{{" + s + "}}") if is_slot else s for is_slot, s in self.segments)
+        if stats is not None:
+            stats.update(prompt_tokens=total, prefix_tokens=self.prefix_tokens, trimmed_tokens=trimmed)
+        return out
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def load_template(path):
+    """Parsed template for a prompt file, re-read only when its mtime changes."""
+    mtime = os.path.getmtime(path)
+    with _cache_lock:
+        hit = _cache.get(path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+    with open(path, "r", encoding="utf-8") as f:
+        tpl = PromptTemplate(f.read(), path)
+    with _cache_lock:
+        _cache[path] = (mtime, tpl)
+    return tpl
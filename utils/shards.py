@@ -0,0 +1,164 @@
+import os, re, json, time, hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+SHARD_KEYS = ("subject", "source")
+
+def registry_path(chroma_path, collection):
+    base = os.path.abspath(chroma_path).rstrip(os.sep)
+    return f"{base}_shards_{collection}.json"
+
+def load_registry(chroma_path, collection):
+    path = registry_path(chroma_path, collection)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_registry(chroma_path, registry):
+    path = registry_path(chroma_path, registry["collection"])
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def shard_name(collection, key):
+    # Chroma names: 3-63 chars of [A-Za-z0-9._-], alphanumeric at both ends.
+    # Values that are not already a valid slug get a short hash so they cannot collide.
+    key = str(key)
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", key).strip("-_")[:40] or "none"
+    if slug != key:
+        slug = f"{slug}-{hashlib.md5(key.encode('utf-8')).hexdigest()[:8]}"
+    name = f"{collection}__{slug}"
+    if len(name) > 63:
+        # Long collection names: keep a readable head and a hash of the full name
+        digest = hashlib.md5(name.encode("utf-8")).hexdigest()[:8]
+        name = f"{name[:63 - len(digest) - 1].rstrip('-_.')}-{digest}"
+    return name
+
+class ShardWriter:
+    """Collection-like sink for ingest.py: every upsert is split by metadata[shard_by]
+    and written to one Chroma collection per value; the registry maps value -> shard.
+    Upserted ids are also deleted from the other shards (evict, on in every ingest mode),
+    so a row whose subject/source changed does not stay behind in its old shard.
+    """
+    def __init__(self, client, collection, shard_by, embedding_function, registry=None):
+        if registry and registry.get("shard_by") != shard_by:
+            raise ValueError(f"'{collection}' is already sharded by {registry.get('shard_by')!r}, not {shard_by!r}")
+        self.client = client
+        self.collection = collection
+        self.shard_by = shard_by
+        self.ef = embedding_function
+        self.registry = registry or {"collection": collection, "shard_by": shard_by, "shards": {}}
+        self.evict = True
+        self._cols = {}
+
+    def _shard(self, key):
+        if key not in self._cols:
+            entry = self.registry["shards"].setdefault(key, {"name": shard_name(self.collection, key), "count": 0})
+            self._cols[key] = self.client.get_or_create_collection(entry["name"], embedding_function=self.ef,
+                                                                   metadata={"hnsw:space": "cosine"})
+        return self._cols[key]
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        groups = defaultdict(list)
+        for i, meta in enumerate(metadatas):
+            groups[str((meta or {}).get(self.shard_by, ""))].append(i)
+        for key, idx in groups.items():
+            part = [ids[i] for i in idx]
+            if self.evict:
+                for other in list(self.registry["shards"]):
+                    if other != key:
+                        self._shard(other).delete(ids=part)
+            extra = {} if embeddings is None else {"embeddings": [embeddings[i] for i in idx]}
+            self._shard(key).upsert(ids=part, documents=[documents[i] for i in idx],
+                                    metadatas=[metadatas[i] for i in idx], **extra)
+
+    def delete(self, ids):
+        for key in list(self.registry["shards"]):
+            self._shard(key).delete(ids=ids)
+
+    def count(self):
+        return sum(self.refresh_counts().values())
+
+    def refresh_counts(self):
+        for key, entry in self.registry["shards"].items():
+            entry["count"] = self._shard(key).count()
+        return {key: entry["count"] for key, entry in self.registry["shards"].items()}
+
+class ShardedCollection:
+    """Read side of a sharded collection with the collection.query()/get() API the pipeline uses.
+
+    A `where` on the shard key routes the query to that shard only (the key is removed
+    from the filter). Anything else fans out to every shard on a thread pool, with query
+    texts embedded once up front, and the hits are merged by distance.
+    """
+    def __init__(self, client, registry, embedding_function, workers=None):
+        self.shard_by = registry["shard_by"]
+        self.names = {key: entry["name"] for key, entry in registry["shards"].items()}
+        self.sizes = {key: entry.get("count", 0) for key, entry in registry["shards"].items()}
+        self.shards = {key: client.get_or_create_collection(name, embedding_function=embedding_function)
+                       for key, name in self.names.items()}
+        self._ef = embedding_function
+        self._pool = ThreadPoolExecutor(max_workers=workers or min(8, max(1, len(self.shards))))
+        self.latencies = defaultdict(list)
+
+    def count(self):
+        return sum(col.count() for col in self.shards.values())
+
+    def _targets(self, where):
+        where = dict(where or {})
+        if self.shard_by not in where:
+            return list(self.shards), where
+        key = str(where.pop(self.shard_by))
+        return ([key] if key in self.shards else []), where
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None,
+              include=("documents", "metadatas", "distances")):
+        targets, where = self._targets(where)
+        if query_embeddings is None and len(targets) > 1:
+            query_embeddings, query_texts = self._ef(list(query_texts)), None
+        n_queries = len(query_texts) if query_embeddings is None else len(query_embeddings)
+        fields = ["distances"] + [f for f in include if f != "distances"]
+
+        def one(key):
+            t0 = time.perf_counter()
+            res = self.shards[key].query(query_texts=query_texts, query_embeddings=query_embeddings,
+                                         n_results=n_results, where=where or None, include=fields)
+            self.latencies[key].append((time.perf_counter() - t0) * 1000)
+            return res
+
+        results = list(self._pool.map(one, targets))
+        merged = {"ids": [], **{f: [] for f in fields}}
+        for qi in range(n_queries):
+            hits = sorted(((res["distances"][qi][j], doc_id, res, j)
+                           for res in results for j, doc_id in enumerate(res["ids"][qi])),
+                          key=lambda h: h[0])[:n_results]
+            merged["ids"].append([h[1] for h in hits])
+            for f in fields:
+                merged[f].append([h[2][f][qi][h[3]] for h in hits])
+        for f in ("documents", "metadatas", "distances", "embeddings"):
+            if f not in include:
+                merged[f] = None
+        return merged
+
+    def get(self, ids=None, include=("documents", "metadatas")):
+        results = list(self._pool.map(lambda col: col.get(ids=ids, include=list(include)), self.shards.values()))
+        found = {}
+        for res in results:
+            for j, doc_id in enumerate(res["ids"]):
+                found[doc_id] = (res["documents"][j], res["metadatas"][j])
+        order = [i for i in ids if i in found] if ids is not None else list(found)
+        return {"ids": order, "documents": [found[i][0] for i in order], "metadatas": [found[i][1] for i in order]}
+
+    def summary(self):
+        """Per-shard size and query latency (ms) since the collection was opened."""
+        out = {}
+        for key, name in self.names.items():
+            lat = sorted(self.latencies.get(key, []))
+            out[key] = {
+                "collection": name, "rows": self.sizes.get(key, 0), "queries": len(lat),
+                "mean_ms": round(sum(lat) / len(lat), 2) if lat else 0.0,
+                "p95_ms": round(lat[int(0.95 * (len(lat) - 1))], 2) if lat else 0.0,
+            }
+        return out
@@ -0,0 +1,178 @@
+import os, json, mmap
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+CATEGORICAL = ("subject", "topic", "type", "source")
+SCORE_CHUNK = 16384  # rows scored per step in exact search
+
+def write_snapshot(out_dir, ids, documents, metadatas, embeddings, quantize=None, model_name=None, hnsw=False):
+    """Write a collection snapshot:
+    - vectors.f32 (N x D, L2-normalized) or vectors.i8 + scales.f32 (symmetric per-row int8)
+    - <column>.codes.npy: dictionary-encoded metadata columns (categories in header.json)
+    - rows.jsonl + offsets.npy: id/document/metadata per row, seekable by row number
+    - hnsw.bin when hnsw=True and hnswlib is installed
+    An empty collection is rejected with ValueError (its vector files could not be memory-mapped).
+    """
+    X = np.asarray(embeddings, dtype=np.float32)
+    if X.ndim != 2 or not len(X):
+        raise ValueError(f"nothing to snapshot: expected an N x D embedding matrix with N > 0, got shape {X.shape}")
+    os.makedirs(out_dir, exist_ok=True)
+    X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    n, dim = X.shape
+    header = {"version": SNAPSHOT_VERSION, "n": n, "dim": dim, "model": model_name, "quantize": quantize, "columns": {}}
+    if quantize == "int8":
+        scales = np.maximum(np.abs(X).max(axis=1), 1e-12) / 127.0
+        np.round(X / scales[:, None]).astype(np.int8).tofile(os.path.join(out_dir, "vectors.i8"))
+        scales.astype(np.float32).tofile(os.path.join(out_dir, "scales.f32"))
+    else:
+        X.tofile(os.path.join(out_dir, "vectors.f32"))
+    for col in CATEGORICAL:
+        values = [str((m or {}).get(col, "")) for m in metadatas]
+        cats = sorted(set(values))
+        lookup = {c: i for i, c in enumerate(cats)}
+        np.save(os.path.join(out_dir, f"{col}.codes.npy"), np.array([lookup[v] for v in values], dtype=np.int32))
+        header["columns"][col] = cats
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    with open(os.path.join(out_dir, "rows.jsonl"), "wb") as f:
+        for i, (qid, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+            f.write(json.dumps({"id": qid, "document": doc, "metadata": meta}, ensure_ascii=False).encode("utf-8") + b"\n")
+            offsets[i + 1] = f.tell()
+    np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+    if hnsw:
+        try:
+            import hnswlib
+        except ImportError:
+            print("hnswlib not installed; snapshot will use exact search.")
+        else:
+            index = hnswlib.Index(space="ip", dim=dim)
+            index.init_index(max_elements=max(n, 1), ef_construction=200, M=16)
+            index.add_items(X, np.arange(n))
+            index.save_index(os.path.join(out_dir, "hnsw.bin"))
+            header["hnsw"] = True
+    with open(os.path.join(out_dir, "header.json"), "w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False)
+    return header
+
+class SnapshotRetriever:
+    """Read-only, Chroma-compatible `query()` over a snapshot opened with np.memmap.
+
+    Supports the parts of collection.query the pipeline uses (query_texts or
+    query_embeddings, n_results, equality `where` on metadata columns, include)
+    and returns cosine distances, so dynamic_retrieve works unchanged.
+    """
+    def __init__(self, path, embedding_function=None):
+        self.path = path
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        n, dim = self.header["n"], self.header["dim"]
+        if self.header.get("quantize") == "int8":
+            self.vectors = np.memmap(os.path.join(path, "vectors.i8"), dtype=np.int8, mode="r", shape=(n, dim))
+            self.scales = np.memmap(os.path.join(path, "scales.f32"), dtype=np.float32, mode="r", shape=(n,))
+        else:
+            self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=(n, dim))
+            self.scales = None
+        self.codes = {c: np.load(os.path.join(path, f"{c}.codes.npy"), mmap_mode="r") for c in self.header["columns"]}
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "rows.jsonl"), "rb") as f:
+            self._rows = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if n else b""
+        self._hnsw = None
+        if self.header.get("hnsw"):
+            try:
+                import hnswlib
+                self._hnsw = hnswlib.Index(space="ip", dim=dim)
+                self._hnsw.load_index(os.path.join(path, "hnsw.bin"))
+            except ImportError:
+                pass
+        self._ef = embedding_function
+        self._id_rows = None
+
+    def count(self):
+        return self.header["n"]
+
+    def _embed(self, texts):
+        if self._ef is None:
+            from utils.embedder import STEmbeddingFunction
+            self._ef = STEmbeddingFunction(self.header.get("model"))
+        return self._ef(texts)
+
+    def _mask(self, where):
+        if not where:
+            return None
+        mask = np.ones(self.header["n"], dtype=bool)
+        for col, value in where.items():
+            cats = self.header["columns"].get(col)
+            if cats is None or str(value) not in cats:
+                return np.zeros(self.header["n"], dtype=bool)
+            mask &= np.asarray(self.codes[col]) == cats.index(str(value))
+        return mask
+
+    def _scores(self, q):
+        # Row chunks keep the working set to SCORE_CHUNK x D floats: the int8 matrix is never
+        # widened to float32 as a whole, and memmap pages are touched once per query
+        n = self.header["n"]
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCORE_CHUNK):
+            block = self.vectors[start:start + SCORE_CHUNK]
+            if self.scales is not None:
+                scores[start:start + len(block)] = (block.astype(np.float32) @ q) * self.scales[start:start + len(block)]
+            else:
+                scores[start:start + len(block)] = block @ q
+        return scores
+
+    def _search(self, q, k, mask):
+        if self._hnsw is not None:
+            k = min(k, int(mask.sum()) if mask is not None else self.header["n"])
+            if k <= 0:
+                return [], []
+            self._hnsw.set_ef(max(50, k * 4))
+            filt = (lambda i: bool(mask[i])) if mask is not None else None
+            labels, dists = self._hnsw.knn_query(q[None, :], k=k, filter=filt)
+            return labels[0].tolist(), dists[0].tolist()  # "ip" space distance is 1 - cosine
+        scores = self._scores(q)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return [], []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top.tolist(), (1.0 - scores[top]).tolist()
+
+    def _row(self, i):
+        return json.loads(self._rows[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None,
+              include=("documents", "metadatas", "distances")):
+        if query_embeddings is None:
+            query_embeddings = self._embed(list(query_texts))
+        Q = np.asarray(query_embeddings, dtype=np.float32)
+        Q = Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+        mask = self._mask(where)
+        res = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        for q in Q:
+            idx, dists = self._search(q, n_results, mask)
+            rows = [self._row(i) for i in idx]
+            res["ids"].append([r["id"] for r in rows])
+            res["documents"].append([r["document"] for r in rows])
+            res["metadatas"].append([r["metadata"] for r in rows])
+            res["distances"].append(dists)
+            if "embeddings" in include:
+                vecs = np.asarray(self.vectors[idx], dtype=np.float32)
+                if self.scales is not None:
+                    vecs = vecs * np.asarray(self.scales[idx])[:, None]
+                res["embeddings"].append(vecs)
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key not in include:
+                res[key] = None
+        return res
+
+    def get(self, ids=None, include=("documents", "metadatas")):
+        # id -> row map is built on first use; only needed for hybrid back-fills
+        if self._id_rows is None:
+            self._id_rows = {}
+            for i in range(self.header["n"]):
+                self._id_rows[self._row(i)["id"]] = i
+        idx = range(self.header["n"]) if ids is None else [self._id_rows[i] for i in ids if i in self._id_rows]
+        rows = [self._row(i) for i in idx]
+        return {"ids": [r["id"] for r in rows], "documents": [r["document"] for r in rows],
+                "metadatas": [r["metadata"] for r in rows]}
@@ -0,0 +1,31 @@
+import re
+
+try:  # optional: exact counts for OpenAI-family models
+    import tiktoken
+    _ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENC = None
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    """Token count via tiktoken when installed, else a word/punctuation estimate."""
+    if not text:
+        return 0
+    if _ENC is not None:
+        return len(_ENC.encode(text, disallowed_special=()))
+    # Long words split into several BPE pieces; ~4 chars per piece
+    return sum(max(1, len(p) // 4) for p in _PIECES.findall(text))
+
+def fit_lines(lines, max_tokens):
+    """Keep leading lines while the joined block stays within max_tokens."""
+    kept, used = [], 0
+    for line in lines:
+        cost = count_tokens(line) + 1  # newline
+        if kept and used + cost > max_tokens:
+            break
+        if not kept and cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return kept
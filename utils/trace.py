@@ -0,0 +1,100 @@
+import os, json, time, uuid, functools, threading, contextvars
+from contextlib import contextmanager
+
+# Traces are written only when TRACE_FILE is set (generate.py --trace sets it too)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+_current = contextvars.ContextVar("trace", default=None)
+_write_lock = threading.Lock()
+
+class Trace:
+    """One request: a flat list of timed spans plus token usage, written as one JSONL line."""
+    def __init__(self, name, attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self.tokens = {"prompt": 0, "completion": 0}
+
+    def add_usage(self, usage, span=None):
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        self.tokens["prompt"] += prompt
+        self.tokens["completion"] += completion
+        if span is not None:
+            span["attrs"].update({"prompt_tokens": prompt, "completion_tokens": completion})
+
+    def record(self):
+        return {
+            "trace_id": self.id, "name": self.name, "ts": self.start, "attrs": self.attrs,
+            "duration_ms": round((time.perf_counter() - self._t0) * 1000, 3),
+            "tokens": self.tokens, "spans": self.spans,
+        }
+
+def enabled():
+    return bool(TRACE_FILE)
+
+def set_trace_file(path):
+    global TRACE_FILE
+    TRACE_FILE = path or ""
+
+@contextmanager
+def request(name, **attrs):
+    """Start a per-request trace; spans opened inside it (also in asyncio tasks) are attached to it."""
+    if not TRACE_FILE or _current.get() is not None:
+        yield _current.get()
+        return
+    tr = Trace(name, attrs)
+    token = _current.set(tr)
+    try:
+        yield tr
+    except BaseException as e:
+        tr.attrs["error"] = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        _write(tr.record())
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage of the current request. A no-op (yields None) when no trace is active."""
+    tr = _current.get()
+    if tr is None:
+        yield None
+        return
+    entry = {"name": name, "start_ms": round((time.perf_counter() - tr._t0) * 1000, 3), "attrs": attrs}
+    t0 = time.perf_counter()
+    try:
+        yield entry
+    except Exception as e:
+        entry["attrs"]["error"] = type(e).__name__
+        raise
+    finally:
+        entry["duration_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        tr.spans.append(entry)
+
+def add_usage(usage, entry=None):
+    """Add completion usage (prompt/completion tokens) to the current trace and optionally a span."""
+    tr = _current.get()
+    if tr is not None and usage is not None:
+        tr.add_usage(usage, entry)
+
+def traced(name):
+    """Decorator form of span() for plain functions."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+def _write(record):
+    os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _write_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+        f.write(line)